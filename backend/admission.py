@@ -0,0 +1,132 @@
+# Load shedding for the CPU-heavy endpoints.
+# SingleFlight: concurrent calls with the same key (say, everyone asking for one popular
+# user's matches at once) await one shared computation instead of each scoring the
+# whole population. ConcurrencyLimiter: at most `limit` computations run at a time
+# and at most `queue` more wait for a slot; past that, or after `max_wait` in the
+# queue, the caller gets 503 with Retry-After right away instead of piling up work.
+from async_firebase import run_scoring
+from fastapi import HTTPException, status
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Optional
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Overloaded(HTTPException):
+    """503 for a saturated limiter; an HTTPException so endpoint error handling passes it through"""
+
+    def __init__(self, name: str, retry_after: int):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Too many {name} requests in progress, retry shortly",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+class SingleFlight:
+    """Event-loop side: one in-flight task per key, shared by every caller that asks meanwhile"""
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.calls = 0
+        self.shared = 0
+
+    def _done(self, key: Hashable, task: asyncio.Future):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # retrieved even when every caller went away
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable]) -> Any:
+        self.calls += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda done: self._done(key, done))
+        else:
+            self.shared += 1
+        # Shielded: one client disconnecting must not cancel the work the others are waiting on.
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict:
+        return {"calls": self.calls, "shared": self.shared, "in_flight": len(self._inflight)}
+
+class ConcurrencyLimiter:
+    """Event-loop side: `limit` running, `queue` waiting in FIFO order, everyone else rejected"""
+
+    def __init__(self, name: str, limit: int, queue: int, retry_after: int = 1, max_wait: Optional[float] = None):
+        if limit < 1:
+            raise ValueError("ConcurrencyLimiter needs a limit of at least 1")
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.retry_after = retry_after
+        self.max_wait = max_wait
+        self._active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def saturated(self) -> bool:
+        return self._active >= self.limit and len(self._waiters) >= self.queue
+
+    async def acquire(self):
+        if self._active < self.limit and not self._waiters:
+            self._active += 1
+            self.admitted += 1
+            return
+        if len(self._waiters) >= self.queue:
+            self.rejected += 1
+            raise Overloaded(self.name, self.retry_after)
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        self.queued += 1
+        try:
+            # release() hands its slot straight to the first waiter, so _active already counts us.
+            await asyncio.wait_for(future, self.max_wait)
+        except asyncio.TimeoutError:
+            self._abandon(future)
+            self.timed_out += 1
+            raise Overloaded(self.name, self.retry_after)
+        except asyncio.CancelledError:
+            self._abandon(future)
+            raise
+        self.admitted += 1
+
+    # A waiter gave up: leave the queue, or pass on the slot if it was handed over in the meantime.
+    def _abandon(self, future: asyncio.Future):
+        if future in self._waiters:
+            self._waiters.remove(future)
+        elif future.done() and not future.cancelled():
+            self.release()
+
+    def release(self):
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self._active -= 1
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """run_scoring(fn, ...) once a slot is free"""
+        await self.acquire()
+        try:
+            return await run_scoring(fn, *args, **kwargs)
+        finally:
+            self.release()
+
+    def stats(self) -> Dict:
+        return {
+            "limit": self.limit,
+            "queue": self.queue,
+            "max_wait_seconds": self.max_wait,
+            "active": self._active,
+            "waiting": len(self._waiters),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out
+        }
@@ -0,0 +1,130 @@
+# Awaitable Firestore access for the async FastAPI endpoints.
+# firebase_utils uses the blocking firestore.client(); these wrappers run those
+# calls on a bounded thread pool so one slow stream cannot stall the event loop.
+# Reads the in-memory user store can answer are served inline without a hop.
+import firebase_utils
+import profiling
+from firebase_utils import user_store
+from models import User
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+import functools
+import contextvars
+import asyncio
+import time
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Bounded so a burst of slow reads queues here instead of spawning threads without limit.
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("FIRESTORE_IO_THREADS", "16")),
+    thread_name_prefix="firestore-io"
+)
+
+# Scoring gets its own threads, so a burst of CPU-bound matching cannot hold every IO thread.
+_scoring_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("SCORING_THREADS", str(os.cpu_count() or 4))),
+    thread_name_prefix="scoring"
+)
+
+async def run_blocking(fn: Callable, *args, **kwargs):
+    """Run a blocking Firestore call off the event loop"""
+    return await _run_on(_executor, fn, *args, **kwargs)
+
+async def run_scoring(fn: Callable, *args, **kwargs):
+    """Run CPU-heavy matching work off the event loop, on the scoring threads"""
+    return await _run_on(_scoring_executor, fn, *args, **kwargs)
+
+async def _run_on(executor: ThreadPoolExecutor, fn: Callable, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    # Carry the request's context into the worker so its Firestore IO is attributed to the route.
+    context = contextvars.copy_context()
+    if profiling.active():
+        name = getattr(fn, "__qualname__", None) or getattr(getattr(fn, "func", None), "__qualname__", "blocking")
+        call = functools.partial(context.run, profiling.traced, name, time.perf_counter(), fn, *args, **kwargs)
+    else:
+        call = functools.partial(context.run, fn, *args, **kwargs)
+    return await loop.run_in_executor(executor, call)
+
+def shutdown():
+    _executor.shutdown(wait=False)
+    _scoring_executor.shutdown(wait=False)
+
+# Reads
+async def get_user_data_async(user_id: str) -> Optional[User]:
+    if user_store.is_ready:
+        return user_store.get(user_id)
+    return await run_blocking(firebase_utils.get_user_data, user_id)
+
+async def get_all_users_async(exclude: List[str] = None) -> Dict[str, User]:
+    if user_store.is_ready:
+        return firebase_utils.get_all_users(exclude)
+    return await run_blocking(firebase_utils.get_all_users, exclude)
+
+async def batch_get_users_async(user_ids: List[str]) -> Dict[str, User]:
+    if user_store.is_ready:
+        return user_store.get_many(user_ids)
+    return await run_blocking(firebase_utils.batch_get_users, user_ids)
+
+async def get_pending_requests_async(user_id: str) -> List[Dict]:
+    return await run_blocking(firebase_utils.get_pending_requests, user_id)
+
+async def get_friend_request_async(request_id: str) -> Optional[dict]:
+    return await run_blocking(firebase_utils.get_friend_request, request_id)
+
+async def get_friends_list_async(user_id: str) -> List[Dict]:
+    return await run_blocking(firebase_utils.get_friends_list, user_id)
+
+async def get_friends_page_async(user_id: str, cursor: Optional[str] = None, limit: int = 50) -> Optional[Dict]:
+    """One page of projected friends plus the cursor for the next, or None when the user does not exist"""
+    if user_store.is_ready:
+        friend_ids = firebase_utils.get_friend_ids(user_id)
+    else:
+        friend_ids = await run_blocking(firebase_utils.get_friend_ids, user_id)
+    if friend_ids is None:
+        return None
+
+    start = firebase_utils.decode_friends_cursor(cursor, friend_ids) if cursor else 0
+    page_ids = friend_ids[start:start + limit]
+    # In memory unless some friends fail validation and have to come from Firestore.
+    if user_store.is_ready and not user_store.unvalidated(page_ids):
+        found = firebase_utils.fetch_friends_chunk(page_ids) if page_ids else {}
+    else:
+        # Every `in`-sized chunk of the page is fetched at once.
+        chunks = await asyncio.gather(*(
+            run_blocking(firebase_utils.fetch_friends_chunk, chunk)
+            for chunk in firebase_utils.friend_id_chunks(page_ids)
+        ))
+        found = {fid: friend for chunk in chunks for fid, friend in chunk.items()}
+
+    end = start + len(page_ids)
+    return {
+        "friends": [found[fid] for fid in page_ids if fid in found],
+        "total": len(friend_ids),
+        "next_cursor": firebase_utils.encode_friends_cursor(end, page_ids[-1]) if end < len(friend_ids) else None
+    }
+
+# Writes
+async def update_user_sports_async(user_id: str, sports: List[str]) -> bool:
+    return await run_blocking(firebase_utils.update_user_sports, user_id, sports)
+
+async def create_friend_request_async(from_user_id: str, to_user_id: str,
+                                      from_user: Optional[User] = None, to_user: Optional[User] = None) -> Optional[str]:
+    return await run_blocking(firebase_utils.create_friend_request, from_user_id, to_user_id, from_user, to_user)
+
+async def update_friend_request_status_async(request_id: str, status: str) -> bool:
+    return await run_blocking(firebase_utils.update_friend_request_status, request_id, status)
+
+async def respond_to_friend_request_async(request_id: str, status: str) -> Optional[Dict]:
+    return await run_blocking(firebase_utils.respond_to_friend_request, request_id, status)
+
+async def respond_to_friend_requests_async(responses: Dict[str, str]) -> Dict[str, Dict]:
+    return await run_blocking(firebase_utils.respond_to_friend_requests, responses)
+
+async def add_friendship_async(user1_id: str, user2_id: str) -> bool:
+    return await run_blocking(firebase_utils.add_friendship, user1_id, user2_id)
+
+async def remove_friends_from_lists_async(user1_id: str, user2_id: str) -> bool:
+    return await run_blocking(firebase_utils.remove_friends_from_lists, user1_id, user2_id)
@@ -0,0 +1 @@
+# Synthetic-population benchmarks for the matching engine; run with `python -m benchmarks.run`.
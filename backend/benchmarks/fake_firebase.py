@@ -0,0 +1,61 @@
+# In-memory stand-in for the firebase_utils read helpers.
+# install() registers it as the `firebase_utils` module, so it has to run before
+# matching_agent (or anything else that imports firebase_utils) is imported.
+from models import User, UserRecord
+from typing import Dict, List, Optional
+import sys
+import types
+
+class InMemoryFirebase:
+    """Serves the user and user-record read helpers from a dict and counts the calls"""
+
+    def __init__(self, users: Optional[Dict[str, User]] = None):
+        self.calls: Dict[str, int] = dict.fromkeys(
+            ["get_user_data", "get_all_users", "batch_get_users", "get_all_user_records", "batch_get_user_records"], 0
+        )
+        self.load(users or {})
+
+    # Records are built here once, like the user store does when documents arrive.
+    def load(self, users: Dict[str, User]):
+        self.users = users
+        self.records: Dict[str, UserRecord] = {
+            uid: UserRecord.from_user(uid, u) for uid, u in users.items() if u.surveyCompleted
+        }
+        self.calls = dict.fromkeys(self.calls, 0)
+
+    def get_user_data(self, user_id: str) -> Optional[User]:
+        self.calls["get_user_data"] += 1
+        return self.users.get(user_id)
+
+    # Same population as the real helper: surveyed users only.
+    def get_all_users(self, exclude: List[str] = None) -> Dict[str, User]:
+        self.calls["get_all_users"] += 1
+        excluded = set(exclude or [])
+        return {uid: u for uid, u in self.users.items() if uid not in excluded and u.surveyCompleted}
+
+    def batch_get_users(self, user_ids: List[str]) -> Dict[str, User]:
+        self.calls["batch_get_users"] += 1
+        return {uid: self.users[uid] for uid in user_ids if uid in self.users}
+
+    def get_all_user_records(self, exclude: List[str] = None) -> Dict[str, UserRecord]:
+        self.calls["get_all_user_records"] += 1
+        excluded = set(exclude or [])
+        return {uid: r for uid, r in self.records.items() if uid not in excluded}
+
+    def batch_get_user_records(self, user_ids: List[str]) -> Dict[str, UserRecord]:
+        self.calls["batch_get_user_records"] += 1
+        return {uid: self.records[uid] for uid in user_ids if uid in self.records}
+
+def install(backend: Optional[InMemoryFirebase] = None) -> InMemoryFirebase:
+    backend = backend or InMemoryFirebase()
+    if "matching_agent" in sys.modules:
+        raise RuntimeError("install() must run before matching_agent is imported")
+    module = types.ModuleType("firebase_utils")
+    module.get_user_data = backend.get_user_data
+    module.get_all_users = backend.get_all_users
+    module.batch_get_users = backend.batch_get_users
+    module.get_all_user_records = backend.get_all_user_records
+    module.batch_get_user_records = backend.batch_get_user_records
+    module.backend = backend
+    sys.modules["firebase_utils"] = module
+    return backend
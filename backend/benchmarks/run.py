@@ -0,0 +1,158 @@
+# MatchingAgent benchmarks over synthetic populations, no Firestore needed.
+#   python -m benchmarks.run                          (from backend/)
+#   python -m benchmarks.run --sizes 1000 10000 --queries 100
+#   python -m benchmarks.run --compare benchmarks/results/previous.json
+# Latency is timed without tracing; peak memory comes from a separate, shorter
+# tracemalloc pass so the tracing overhead does not leak into the percentiles.
+from benchmarks.fake_firebase import install
+from benchmarks.synthetic import generate_users
+
+backend = install()  # must precede the matching_agent import
+
+from matching_agent import MatchingAgent
+from typing import Callable, Dict, List, Optional
+from datetime import datetime
+import numpy as np
+import subprocess
+import tracemalloc
+import platform
+import argparse
+import json
+import time
+import os
+import gc
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+def _percentiles(latencies_ms: List[float]) -> Dict:
+    values = np.asarray(latencies_ms)
+    return {
+        "calls": len(values),
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p90_ms": round(float(np.percentile(values, 90)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "max_ms": round(float(values.max()), 3),
+        "throughput_per_s": round(len(values) / (values.sum() / 1000), 2) if values.sum() else None
+    }
+
+def _time_calls(fn: Callable, args_list: List[tuple]) -> List[float]:
+    latencies = []
+    for args in args_list:
+        started = time.perf_counter()
+        fn(*args)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+def _peak_memory_mb(fn: Callable, args_list: List[tuple]) -> float:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        for args in args_list:
+            fn(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak / 2 ** 20, 2)
+
+def bench_size(n: int, queries: int, pairs: int, refreshes: int, memory_calls: int, seed: int,
+               featurizer: str) -> List[Dict]:
+    started = time.perf_counter()
+    users = generate_users(n, seed)
+    backend.load(users)
+    logger.info(f"Generated {n} users in {time.perf_counter() - started:.1f}s")
+
+    agent = MatchingAgent(featurizer=featurizer)
+    rng = np.random.default_rng(seed + 1)
+    surveyed = [uid for uid, u in users.items() if u.surveyCompleted]
+    query_ids = list(rng.choice(surveyed, size=min(queries, len(surveyed)), replace=False))
+    pair_ids = [tuple(rng.choice(surveyed, size=2, replace=False)) for _ in range(pairs)]
+
+    operations = [
+        ("refresh_vectorizer", agent.refresh_vectorizer, [()] * refreshes),
+        ("find_matches", agent.find_matches, [(uid, 10) for uid in query_ids]),
+        ("calculate_compatibility", agent.calculate_compatibility, [(users[a], users[b]) for a, b in pair_ids]),
+        ("get_match_explanation", agent.get_match_explanation, [(a, b) for a, b in pair_ids[:queries]]),
+    ]
+
+    agent.refresh_vectorizer()  # warm: every operation below runs against a built index
+    results = []
+    for name, fn, args_list in operations:
+        latencies = _time_calls(fn, args_list)
+        row = {"users": n, "operation": name, **_percentiles(latencies)}
+        row["peak_memory_mb"] = _peak_memory_mb(fn, args_list[:memory_calls])
+        logger.info(f"{n} users {name}: p50 {row['p50_ms']}ms p99 {row['p99_ms']}ms peak {row['peak_memory_mb']}MB")
+        results.append(row)
+    return results
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(__file__), stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+# Print p50/p99 ratios against an earlier results file (>1 means slower now).
+def compare(current: Dict, previous: Dict):
+    before = {(r["users"], r["operation"]): r for r in previous["results"]}
+    print(f"{'users':>8} {'operation':<26} {'p50 ratio':>10} {'p99 ratio':>10} {'peak MB':>16}")
+    for row in current["results"]:
+        old = before.get((row["users"], row["operation"]))
+        if old is None:
+            continue
+        p50 = row["p50_ms"] / old["p50_ms"] if old["p50_ms"] else float("nan")
+        p99 = row["p99_ms"] / old["p99_ms"] if old["p99_ms"] else float("nan")
+        memory = f"{old['peak_memory_mb']} -> {row['peak_memory_mb']}"
+        print(f"{row['users']:>8} {row['operation']:<26} {p50:>10.2f} {p99:>10.2f} {memory:>16}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MatchingAgent on synthetic populations")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--queries", type=int, default=200, help="find_matches / explanation calls per size")
+    parser.add_argument("--pairs", type=int, default=2000, help="calculate_compatibility calls per size")
+    parser.add_argument("--refreshes", type=int, default=3)
+    parser.add_argument("--memory-calls", type=int, default=20, help="calls per operation in the tracemalloc pass")
+    parser.add_argument("--featurizer", default="tfidf", choices=["tfidf", "hashing"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="results file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    for noisy in ("matching_agent", "feature_store", "candidate_retrieval"):
+        logging.getLogger(noisy).setLevel(logging.WARNING)
+
+    results = []
+    for n in args.sizes:
+        results += bench_size(n, args.queries, args.pairs, args.refreshes, args.memory_calls, args.seed, args.featurizer)
+
+    report = {
+        "meta": {
+            "generated_at": datetime.utcnow().isoformat(),
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "seed": args.seed,
+            "featurizer": args.featurizer
+        },
+        "results": results
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"bench-{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+# Multi-core scaling of sharded scoring (parallel_scoring.ShardedScorer).
+#   python -m benchmarks.scaling                                  (from backend/)
+#   python -m benchmarks.scaling --users 100000 --workers 1 2 4 8
+# Times a match-table style batch (blocks of query rows against every candidate)
+# and single find_matches-style queries, in-process and then with 1..N worker
+# processes, and checks that every sharded result equals the in-process one.
+from benchmarks.run import backend, _percentiles, _git_revision, RESULTS_DIR
+from benchmarks.synthetic import generate_users
+
+from matching_agent import MatchingAgent
+from parallel_scoring import ShardedScorer
+from typing import Callable, Dict, List
+from datetime import datetime
+import numpy as np
+import platform
+import argparse
+import json
+import time
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+def _default_workers() -> List[int]:
+    cores = os.cpu_count() or 1
+    counts = [1]
+    while counts[-1] * 2 < cores:
+        counts.append(counts[-1] * 2)
+    return counts + [cores] if cores > 1 else counts
+
+# Run fn once per item, returning (latencies in ms, results).
+def _timed(fn: Callable, items: List) -> tuple:
+    latencies, results = [], []
+    for item in items:
+        started = time.perf_counter()
+        results.append(fn(item))
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies, results
+
+def _same(a, b) -> bool:
+    return np.array_equal(a[0], b[0]) and np.allclose(a[1], b[1])
+
+def bench(n: int, workers: List[int], batch: int, block_size: int, queries: int, k: int, seed: int) -> List[Dict]:
+    users = generate_users(n, seed)
+    backend.load(users)
+    agent = MatchingAgent()
+    agent.refresh_vectorizer()
+    features = agent.features
+    logger.info(f"Indexed {len(features)} users")
+
+    rng = np.random.default_rng(seed + 1)
+    surveyed = list(features.index.values())
+    batch_rows = rng.choice(surveyed, size=min(batch, len(surveyed)), replace=False)
+    blocks = [batch_rows[i:i + block_size] for i in range(0, len(batch_rows), block_size)]
+    query_ids = rng.choice(list(features.index), size=min(queries, len(features)), replace=False)
+    encoded = [
+        (features.index[uid], features.encode(backend.records[uid], agent.vectorizer, agent._create_feature_text))
+        for uid in query_ids
+    ]
+
+    def local_query(item):
+        row, query = item
+        scores, components = features.score(query, agent.weights)
+        winners = np.array(features.top_k(scores, k, exclude=[row]), dtype=np.int64)
+        return winners, scores[winners]
+
+    runs = [("in-process", None, lambda rows: features.top_k_block(rows, agent.weights, k), local_query)]
+    for count in workers:
+        scorer = ShardedScorer(count, min_rows=0)
+        runs.append((
+            f"{count} workers", scorer,
+            lambda rows, scorer=scorer: scorer.top_k_block(features, rows, agent.weights, k),
+            lambda item, scorer=scorer: scorer.top_k(features, item[1], agent.weights, k, exclude=[item[0]])
+        ))
+
+    results, baseline = [], None
+    for label, scorer, block_fn, query_fn in runs:
+        try:
+            if scorer is not None:
+                block_fn(blocks[0])  # start the pool and publish the features outside the timings
+            block_ms, block_out = _timed(block_fn, blocks)
+            query_ms, query_out = _timed(query_fn, encoded)
+        finally:
+            if scorer is not None:
+                scorer.close()
+
+        flat = [ranked for block in block_out for ranked in block]
+        if baseline is None:
+            baseline = (flat, query_out)
+        matches = all(_same(a, b) for a, b in zip(flat, baseline[0])) and \
+            all(_same(a, b) for a, b in zip(query_out, baseline[1]))
+
+        for mode, latencies, unit in (("batch", block_ms, len(batch_rows)), ("query", query_ms, len(encoded))):
+            row = {"users": n, "mode": mode, "run": label, "workers": scorer.workers if scorer else 0,
+                   **_percentiles(latencies), "rows_per_s": round(unit / (sum(latencies) / 1000), 1),
+                   "matches_in_process": matches}
+            results.append(row)
+    # Speedup of each run's total time over the in-process run of the same mode.
+    for mode in ("batch", "query"):
+        rows = [r for r in results if r["mode"] == mode]
+        for r in rows:
+            r["speedup"] = round(r["rows_per_s"] / rows[0]["rows_per_s"], 2)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Scaling of sharded multi-process scoring")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--workers", type=int, nargs="+", default=_default_workers())
+    parser.add_argument("--batch", type=int, default=512, help="query rows in the match-table style batch")
+    parser.add_argument("--block-size", type=int, default=64)
+    parser.add_argument("--queries", type=int, default=50, help="single find_matches style queries")
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="results file (default: benchmarks/results/scaling-<timestamp>.json)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    for noisy in ("matching_agent", "feature_store", "parallel_scoring"):
+        logging.getLogger(noisy).setLevel(logging.WARNING)
+
+    results = bench(args.users, args.workers, args.batch, args.block_size, args.queries, args.k, args.seed)
+    print(f"{'mode':<6} {'run':<12} {'p50 ms':>9} {'p99 ms':>9} {'rows/s':>10} {'speedup':>8} {'same':>5}")
+    for r in results:
+        print(f"{r['mode']:<6} {r['run']:<12} {r['p50_ms']:>9} {r['p99_ms']:>9} {r['rows_per_s']:>10} "
+              f"{r['speedup']:>8} {str(r['matches_in_process']):>5}")
+
+    report = {
+        "meta": {
+            "generated_at": datetime.utcnow().isoformat(),
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "seed": args.seed
+        },
+        "results": results
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"scaling-{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+# Seeded synthetic user population for benchmarks.
+# Distributions roughly follow the sign-up data: mostly 18-24 year olds, beginners
+# and intermediates outnumbering advanced lifters, a long tail of sports with a
+# few very popular ones, and a small share of unfinished or malformed profiles.
+from models import User, Preferences
+from datetime import datetime, timedelta
+from typing import Dict
+import numpy as np
+
+GYM_LEVELS = ["Beginner", "Intermediate", "Advanced"]
+GYM_LEVEL_WEIGHTS = [0.45, 0.38, 0.17]
+
+WORKOUT_GOALS = ["Build muscle", "Lose weight", "Improve endurance", "Stay active", "Gain strength", "Flexibility"]
+WORKOUT_GOAL_WEIGHTS = [0.3, 0.22, 0.15, 0.18, 0.1, 0.05]
+
+# Ordered by popularity; weights fall off Zipf-style.
+SPORTS = [
+    "basketball", "soccer", "running", "weightlifting", "volleyball", "tennis", "swimming",
+    "yoga", "cycling", "badminton", "boxing", "climbing", "table tennis", "hiking", "football",
+    "baseball", "martial arts", "pilates", "dance", "crossfit", "rowing", "skating", "golf",
+    "wrestling", "ultimate frisbee", "squash", "lacrosse", "hockey", "cricket", "fencing"
+]
+SPORT_WEIGHTS = 1.0 / np.arange(1, len(SPORTS) + 1) ** 0.9
+SPORT_WEIGHTS /= SPORT_WEIGHTS.sum()
+
+UNSURVEYED_SHARE = 0.08  # started sign-up, never finished the survey
+BAD_AGE_SHARE = 0.02  # free-text age the matcher cannot parse
+
+def _age(rng: np.random.Generator) -> str:
+    if rng.random() < BAD_AGE_SHARE:
+        return rng.choice(["n/a", "twenty", ""])
+    # Undergrads with a tail of grad students and staff.
+    return str(int(np.clip(round(rng.gamma(2.0, 2.2) + 17.5), 17, 45)))
+
+def generate_users(n: int, seed: int = 0) -> Dict[str, User]:
+    """n users keyed by id; the same (n, seed) always yields the same population"""
+    rng = np.random.default_rng(seed)
+    now = datetime(2025, 1, 1)
+    users = {}
+    for i in range(n):
+        sports = list(rng.choice(SPORTS, size=min(rng.poisson(2.2), 6), replace=False, p=SPORT_WEIGHTS))
+        users[f"user{i:06d}"] = User(
+            email=f"user{i}@uic.edu",
+            fullName=f"Synthetic User {i}",
+            phoneNumber=f"312555{i % 10000:04d}",
+            preferences=Preferences(
+                age=_age(rng),
+                gymLevel=rng.choice(GYM_LEVELS, p=GYM_LEVEL_WEIGHTS),
+                height=str(int(rng.normal(68, 4))),
+                weight=str(int(rng.normal(160, 30))),
+                workoutGoal=rng.choice(WORKOUT_GOALS, p=WORKOUT_GOAL_WEIGHTS),
+                sports=sports
+            ),
+            sports=sports,
+            surveyCompleted=bool(rng.random() >= UNSURVEYED_SHARE),
+            createdAt=now - timedelta(minutes=int(rng.integers(0, 365 * 24 * 60)))
+        )
+    return users
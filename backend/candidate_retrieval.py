@@ -0,0 +1,185 @@
+from feature_store import FeatureStore, QueryFeatures
+from scipy import sparse
+from typing import Callable, Dict, List, Optional, Sequence
+import numpy as np
+import argparse
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class SentenceEncoder:
+    """Dense profile embeddings from a local sentence-transformers model (no downloads at runtime)"""
+
+    def __init__(self, model_path: str):
+        # Optional dependency: only needed when embeddings are switched on.
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_path, device="cpu", local_files_only=True)
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        return np.asarray(self.model.encode(texts, normalize_embeddings=True), dtype=np.float32)
+
+class IVFRetriever:
+    """Inverted-file approximate nearest-neighbour index over profile vectors.
+
+    Rows are clustered with spherical k-means; a query probes the `n_probe`
+    closest clusters and keeps the `n_candidates` most similar rows for the
+    full weighted rerank. Vectors are the TF-IDF rows of the feature store,
+    or dense embeddings when an `encoder` is given. Rows appended after the
+    last build are always searched.
+    """
+
+    def __init__(self, n_probe: int = 8, n_candidates: int = 300, n_lists: Optional[int] = None,
+                 min_users: int = 2000, encoder: Optional[Callable[[List[str]], np.ndarray]] = None,
+                 iterations: int = 10, train_size: int = 20000, rebuild_ratio: float = 0.2, seed: int = 0):
+        self.n_probe = n_probe
+        self.n_candidates = n_candidates
+        self.n_lists = n_lists  # defaults to ~sqrt(rows)
+        self.min_users = min_users  # below this, exact scoring is cheaper than probing
+        self.encoder = encoder
+        self.iterations = iterations
+        self.train_size = train_size
+        self.rebuild_ratio = rebuild_ratio
+        self.seed = seed
+        self.centroids: Optional[np.ndarray] = None
+        self.list_rows: List[np.ndarray] = []
+        self.embeddings: Optional[np.ndarray] = None
+        self.indexed_rows = 0
+
+    @property
+    def needs_texts(self) -> bool:
+        return self.encoder is not None
+
+    def needs_rebuild(self, features: FeatureStore) -> bool:
+        if len(features) < self.min_users:
+            return False
+        if self.centroids is None or len(features.user_ids) < self.indexed_rows:
+            return True
+        return len(features.user_ids) - self.indexed_rows > self.rebuild_ratio * max(self.indexed_rows, 1)
+
+    def _normalize(self, matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+    # Cluster the current rows; `texts` (one per row) are only needed with an encoder.
+    def build(self, features: FeatureStore, texts: Optional[List[str]] = None):
+        started = time.perf_counter()
+        if self.encoder is not None:
+            if texts is None:
+                raise ValueError("An embedding encoder needs the feature text of every row")
+            self.embeddings = self.encoder(texts)
+            vectors = self.embeddings
+        else:
+            vectors = features.text
+
+        n = vectors.shape[0]
+        n_lists = min(self.n_lists or max(int(np.sqrt(n)), 1), n)
+        rng = np.random.default_rng(self.seed)
+        train = vectors[rng.choice(n, size=min(n, self.train_size), replace=False)]
+
+        centroids = self._as_dense(train[rng.choice(train.shape[0], size=n_lists, replace=False)])
+        for _ in range(self.iterations):
+            assign = np.asarray((train @ centroids.T)).argmax(axis=1)
+            members = sparse.csr_matrix(
+                (np.ones(len(assign)), (assign, np.arange(len(assign)))),
+                shape=(n_lists, train.shape[0])
+            )
+            summed = self._as_dense(members @ train)
+            empty = np.asarray(members.sum(axis=1)).ravel() == 0
+            if empty.any():  # re-seed empty clusters from random rows
+                summed[empty] = self._as_dense(train[rng.choice(train.shape[0], size=int(empty.sum()))])
+            centroids = self._normalize(summed)
+
+        assign = np.asarray((vectors @ centroids.T)).argmax(axis=1)
+        order = np.argsort(assign, kind="stable")
+        bounds = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=n_lists))])
+        self.list_rows = [order[bounds[i]:bounds[i + 1]] for i in range(n_lists)]
+        self.centroids = centroids
+        self.indexed_rows = n
+        logger.info(f"Built IVF index: {n} rows, {n_lists} lists in {time.perf_counter() - started:.3f}s")
+
+    def _as_dense(self, matrix) -> np.ndarray:
+        return matrix.toarray() if sparse.issparse(matrix) else np.asarray(matrix)
+
+    def _query_vector(self, query: QueryFeatures, query_text: Optional[str]) -> np.ndarray:
+        if self.encoder is not None:
+            return self.encoder([query_text])[0]
+        return query.text.toarray().ravel()
+
+    def candidates(self, features: FeatureStore, query: QueryFeatures,
+                   query_text: Optional[str] = None) -> Optional[np.ndarray]:
+        """Row ids worth a full rerank, or None when the exact scorer should run over everything"""
+        if self.centroids is None or len(features) < self.min_users:
+            return None
+        vector = self._query_vector(query, query_text)
+
+        centroid_sims = self.centroids @ vector
+        n_probe = min(self.n_probe, len(self.list_rows))
+        probed = np.argpartition(-centroid_sims, n_probe - 1)[:n_probe]
+        indexed = np.concatenate([self.list_rows[i] for i in probed])
+        tail = np.arange(self.indexed_rows, len(features.user_ids))  # appended since the build
+
+        if len(indexed) > self.n_candidates:
+            if self.embeddings is not None:
+                sims = self.embeddings[indexed] @ vector
+            else:
+                sims = np.asarray(features.take(indexed).text @ vector).ravel()
+            indexed = indexed[np.argpartition(-sims, self.n_candidates - 1)[:self.n_candidates]]
+        rows = np.concatenate([indexed, tail])
+        return rows[features.active[rows]]
+
+# Recall@k of the approximate path against the exact scorer, per (n_probe, n_candidates) setting.
+def recall_benchmark(agent, user_ids: Sequence[str], k: int = 10,
+                     settings: Sequence[tuple] = ((4, 100), (8, 300), (16, 1000))) -> List[Dict]:
+    from firebase_utils import get_user_data
+
+    retriever = agent.retriever or IVFRetriever(min_users=0)
+    features = agent.ensure_index()
+    if retriever.centroids is None:
+        retriever.build(features, agent.row_texts(features) if retriever.needs_texts else None)
+
+    queries = [(uid, get_user_data(uid)) for uid in user_ids]
+    queries = [(uid, user) for uid, user in queries if user is not None]
+    exact, exact_ms = {}, []
+    for uid, user in queries:
+        started = time.perf_counter()
+        exact[uid] = set(agent.rank(uid, user, k, retriever=None))
+        exact_ms.append((time.perf_counter() - started) * 1000)
+
+    results = [{
+        "mode": "exact",
+        "recall": 1.0,
+        "p50_ms": round(float(np.percentile(exact_ms, 50)), 3),
+        "p99_ms": round(float(np.percentile(exact_ms, 99)), 3)
+    }]
+    for n_probe, n_candidates in settings:
+        retriever.n_probe, retriever.n_candidates = n_probe, n_candidates
+        hits, latencies = 0, []
+        for uid, user in queries:
+            started = time.perf_counter()
+            found = agent.rank(uid, user, k, retriever=retriever)
+            latencies.append((time.perf_counter() - started) * 1000)
+            hits += len(exact[uid].intersection(found))
+        results.append({
+            "mode": "ivf",
+            "n_probe": n_probe,
+            "n_candidates": n_candidates,
+            "recall": round(hits / max(sum(len(v) for v in exact.values()), 1), 4),
+            "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+            "p99_ms": round(float(np.percentile(latencies, 99)), 3)
+        })
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall vs latency of IVF retrieval against exact scoring")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    import os
+    from matching_agent import MatchingAgent
+    agent = MatchingAgent(artifact_dir=os.getenv("MATCHING_ARTIFACT_DIR"))
+    features = agent.ensure_index()
+    sample = list(features.index)[:args.queries]
+    for row in recall_benchmark(agent, sample, k=args.k):
+        print(row)
@@ -0,0 +1,206 @@
+# Users that must never be offered to someone as a match.
+# Friends come from the FriendGraph; pending friend requests (either direction) and
+# blocks are kept here, each user's set as a sorted int32 array over a dense user
+# index like the graph's rows. A listener on the pending friend_requests keeps it
+# current with every worker's writes (its first snapshot is the full load), and the
+# writes in firebase_utils also apply here directly so this worker sees its own at
+# once. A match request only does a few in-memory lookups to build its mask.
+from friend_graph import FriendGraph
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+_EMPTY = np.zeros(0, dtype=np.int32)
+
+class ExclusionIndex:
+    def __init__(self, graph: Optional[FriendGraph] = None):
+        self.graph = graph
+        self._lock = threading.Lock()
+        self._ids: Dict[str, int] = {}
+        self._names: List[str] = []
+        self._pending: List[np.ndarray] = []  # id -> sorted ids with a pending request to or from it
+        self._blocked: List[np.ndarray] = []  # id -> sorted ids blocked by or blocking it
+        self._requests: Dict[str, Tuple[str, str]] = {}  # pending request id -> (from_user, to_user)
+        self._pair_requests: Dict[Tuple[int, int], int] = {}  # open requests per unordered pair
+        self._watch = None
+        self._loaded = threading.Event()
+        self._subscribers: List[Callable[[str, str], None]] = []
+        self.ready = False
+        self.updates = 0
+
+    def _id(self, user_id: str) -> int:
+        found = self._ids.get(user_id)
+        if found is None:
+            found = self._ids[user_id] = len(self._names)
+            self._names.append(user_id)
+            self._pending.append(_EMPTY)
+            self._blocked.append(_EMPTY)
+        return found
+
+    # Add or drop b in a's row and a in b's row.
+    @staticmethod
+    def _set(rows: List[np.ndarray], a: int, b: int, present: bool):
+        for row, other in ((a, b), (b, a)):
+            values = rows[row]
+            pos = np.searchsorted(values, other)
+            found = pos < len(values) and values[pos] == other
+            if present and not found:
+                rows[row] = np.insert(values, pos, other).astype(np.int32)
+            elif not present and found:
+                rows[row] = np.delete(values, pos)
+
+    def _open(self, request_id: str, from_user: str, to_user: str) -> bool:
+        if request_id in self._requests or from_user == to_user:
+            return False
+        a, b = self._id(from_user), self._id(to_user)
+        pair = (min(a, b), max(a, b))
+        self._requests[request_id] = (from_user, to_user)
+        self._pair_requests[pair] = self._pair_requests.get(pair, 0) + 1
+        self._set(self._pending, a, b, True)
+        return True
+
+    def _close(self, request_id: str) -> Optional[Tuple[str, str]]:
+        users = self._requests.pop(request_id, None)
+        if users is None:
+            return None
+        a, b = self._ids[users[0]], self._ids[users[1]]
+        pair = (min(a, b), max(a, b))
+        self._pair_requests[pair] -= 1
+        if self._pair_requests[pair] == 0:
+            del self._pair_requests[pair]
+            self._set(self._pending, a, b, False)
+        return users
+
+    def _reset_pending(self):
+        self._requests, self._pair_requests = {}, {}
+        self._pending = [_EMPTY] * len(self._names)
+
+    # Full load from (request_id, from_user, to_user) for every pending friend request.
+    def rebuild(self, pending: Iterable[Tuple[str, str, str]]) -> Dict:
+        with self._lock:
+            blocked = [(self._names[a], self._names[b]) for a, row in enumerate(self._blocked) for b in row if a < b]
+            self._ids, self._names, self._pending, self._blocked = {}, [], [], []
+            self._reset_pending()
+            for request_id, from_user, to_user in pending:
+                self._open(request_id, from_user, to_user)
+            for a, b in blocked:
+                self._set(self._blocked, self._id(a), self._id(b), True)
+            self.ready = True
+            logger.info(f"Exclusion index built: {len(self._requests)} pending requests")
+            return {"users": len(self._names), "pending_requests": len(self._requests)}
+
+    # Write-through from create_friend_request.
+    def request_sent(self, request_id: str, from_user: str, to_user: str):
+        with self._lock:
+            self._open(request_id, from_user, to_user)
+            self.updates += 1
+
+    def request_pair(self, request_id: str) -> Optional[Tuple[str, str]]:
+        with self._lock:
+            return self._requests.get(request_id)
+
+    # Write-through from update_friend_request_status; the pair stays excluded while another request is open.
+    def request_closed(self, request_id: str) -> Optional[Tuple[str, str]]:
+        with self._lock:
+            users = self._close(request_id)
+            if users is not None:
+                self.updates += 1
+            return users
+
+    # Listen to pending friend_requests; False if the listener did not deliver its first snapshot.
+    def start(self, db, timeout: float = 30.0) -> bool:
+        if self._watch is not None:
+            return self._loaded.is_set()
+        self._loaded.clear()
+        try:
+            self._watch = db.collection("friend_requests").where("status", "==", "pending") \
+                .on_snapshot(self._on_snapshot)
+        except Exception as e:
+            logger.error(f"Failed to start friend_requests listener: {e}")
+            self._watch = None
+            return False
+        if not self._loaded.wait(timeout):
+            logger.warning(f"Pending friend requests not loaded after {timeout}s")
+            return False
+        return True
+
+    def stop(self):
+        if self._watch is not None:
+            try:
+                self._watch.unsubscribe()
+            except Exception as e:
+                logger.error(f"Failed to stop friend_requests listener: {e}")
+            self._watch = None
+        self._loaded.clear()
+
+    # Register callback(from_user, to_user) for pairs whose pending state changed after the initial load.
+    def subscribe(self, callback: Callable[[str, str], None]):
+        self._subscribers.append(callback)
+
+    def _on_snapshot(self, col_snapshot, changes, read_time):
+        initial = not self._loaded.is_set()
+        touched = []
+        with self._lock:
+            if initial:
+                self._reset_pending()
+            for change in changes:
+                doc = change.document
+                data = doc.to_dict() if change.type.name != "REMOVED" else None
+                # Answered (or deleted) requests leave the query; status is checked here as well.
+                if data and data.get("status") == "pending" and data.get("from_user") and data.get("to_user"):
+                    if self._open(doc.id, data["from_user"], data["to_user"]):
+                        touched.append((data["from_user"], data["to_user"]))
+                else:
+                    users = self._close(doc.id)
+                    if users is not None:
+                        touched.append(users)
+            self.updates += len(touched)
+            if initial:
+                self.ready = True
+                self._loaded.set()
+                logger.info(f"Exclusion index loaded {len(self._requests)} pending requests")
+        if not initial:
+            for from_user, to_user in touched:
+                for callback in self._subscribers:
+                    try:
+                        callback(from_user, to_user)
+                    except Exception as e:
+                        logger.error(f"Exclusion subscriber failed for {from_user}, {to_user}: {e}")
+
+    def block(self, user1_id: str, user2_id: str, blocked: bool = True):
+        if user1_id == user2_id:
+            return
+        with self._lock:
+            self._set(self._blocked, self._id(user1_id), self._id(user2_id), blocked)
+            self.updates += 1
+
+    def excluded(self, user_id: str) -> List[str]:
+        """Friends, pending requests in either direction and blocks of `user_id` (not the user itself)"""
+        friends = self.graph.friends(user_id) if self.graph is not None else []
+        with self._lock:
+            row = self._ids.get(user_id)
+            if row is None:
+                return friends
+            others = np.union1d(self._pending[row], self._blocked[row])
+            return friends + [self._names[i] for i in others]
+
+    def friends_of_friends(self, user_id: str) -> Tuple[List[str], np.ndarray]:
+        """The graph's friend suggestions minus pending requests and blocks in either direction"""
+        if self.graph is None:
+            return [], np.zeros(0, dtype=np.int64)
+        return self.graph.friends_of_friends(user_id, exclude=self.excluded(user_id))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "listening": self._watch is not None,
+                "users": len(self._names),
+                "pending_requests": len(self._requests),
+                "pending_pairs": len(self._pair_requests),
+                "blocked_pairs": sum(len(row) for row in self._blocked) // 2,
+                "updates": self.updates
+            }
@@ -0,0 +1,443 @@
+from models import UserRecord
+from filter_index import FilterIndex
+from scipy import sparse
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import logging
+import copy
+import zlib
+
+logger = logging.getLogger(__name__)
+
+GYM_LEVELS = ['beginner', 'intermediate', 'advanced']
+
+def parse_age(user: UserRecord) -> float:
+    """Same parsing rule as MatchingAgent._calculate_age_compatibility, NaN when unusable"""
+    try:
+        return float(int(user.age))
+    except (ValueError, TypeError, AttributeError):
+        return np.nan
+
+def gym_level_code(user: UserRecord) -> int:
+    """Index into GYM_LEVELS, -1 when unknown"""
+    try:
+        return GYM_LEVELS.index(user.gymLevel.lower())
+    except (ValueError, AttributeError):
+        return -1
+
+def sports_set(user: UserRecord) -> set:
+    return set(sport.lower() for sport in user.sports) if user.sports else set()
+
+def feature_fingerprint(text: str) -> int:
+    """Stable checksum of a user's feature text, used to spot edits made after a build"""
+    return zlib.crc32(text.encode("utf-8"))
+
+# Elementwise score rules shared by the single-user and block scorers (inputs broadcast).
+def _age_scores(diff: np.ndarray) -> np.ndarray:
+    return np.select(
+        [np.isnan(diff), diff <= 2, diff <= 5, diff <= 10],
+        [0.5, 1.0, 0.8, 0.5],
+        default=0.2
+    )
+
+def _gym_scores(query_levels: np.ndarray, levels: np.ndarray) -> np.ndarray:
+    diff = np.abs(levels.astype(np.int16) - query_levels)
+    return np.select(
+        [(levels < 0) | (query_levels < 0), diff == 0, diff == 1],
+        [0.5, 1.0, 0.7],
+        default=0.3
+    )
+
+def _jaccard(intersection: np.ndarray, union: np.ndarray) -> np.ndarray:
+    # Both empty -> neutral 0.5, same as the per-pair Jaccard.
+    return np.where(union > 0, intersection / np.maximum(union, 1), 0.5)
+
+class QueryFeatures:
+    """One user's features, encoded against a FeatureStore's vocabularies"""
+    __slots__ = ('text', 'age', 'gym_level', 'sports', 'sports_count')
+
+    def __init__(self, text, age: float, gym_level: int, sports: np.ndarray, sports_count: int):
+        self.text = text  # 1 x n_terms sparse row (L2-normalised)
+        self.age = age
+        self.gym_level = gym_level
+        self.sports = sports  # indicator over the store's sports vocabulary
+        self.sports_count = sports_count  # includes sports the store has never seen
+
+COMPONENTS = ('textSimilarity', 'ageCompatibility', 'gymLevelMatch', 'sportsOverlap')
+
+def _weighted(components: Dict[str, np.ndarray], weights: Dict[str, float]) -> np.ndarray:
+    total = (
+        components['textSimilarity'] * weights['text_similarity'] +
+        components['ageCompatibility'] * weights['age_compatibility'] +
+        components['gymLevelMatch'] * weights['gym_level_match'] +
+        components['sportsOverlap'] * weights['sports_overlap']
+    )
+    return np.minimum(total, 1.0)
+
+def _widen(matrix: sparse.csr_matrix, width: int) -> sparse.csr_matrix:
+    # Extra sports columns for rows built before those sports existed (shares the buffers).
+    if matrix.shape[1] >= width:
+        return matrix
+    return sparse.csr_matrix((matrix.data, matrix.indices, matrix.indptr), shape=(matrix.shape[0], width), copy=False)
+
+class FeatureRows:
+    """One contiguous run of feature rows: a store's base (possibly memory-mapped) or its delta"""
+
+    def __init__(self, text: sparse.csr_matrix, ages: np.ndarray, gym_levels: np.ndarray,
+                 sports: sparse.csr_matrix, fingerprints: np.ndarray):
+        self.text = text
+        self.ages = ages
+        self.gym_levels = gym_levels
+        self.sports = sports  # may be narrower than the store's sports vocabulary
+        self.sports_counts = np.asarray(sports.sum(axis=1)).ravel()
+        self.fingerprints = fingerprints
+
+    def __len__(self) -> int:
+        return self.text.shape[0]
+
+    def components(self, query: QueryFeatures, rows: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+        text = self.text if rows is None else self.text[rows]
+        ages = self.ages if rows is None else self.ages[rows]
+        levels = self.gym_levels if rows is None else self.gym_levels[rows]
+        sports = self.sports if rows is None else self.sports[rows]
+        counts = self.sports_counts if rows is None else self.sports_counts[rows]
+        # TF-IDF rows are L2-normalised, so the dot product is the cosine similarity.
+        intersection = np.asarray(sports @ query.sports[:sports.shape[1]]).ravel()
+        return {
+            'textSimilarity': np.asarray((text @ query.text.T).todense()).ravel(),
+            'ageCompatibility': np.full(len(ages), 0.5) if np.isnan(query.age) else _age_scores(np.abs(ages - query.age)),
+            'gymLevelMatch': np.full(len(levels), 0.5) if query.gym_level < 0 else _gym_scores(np.int16(query.gym_level), levels),
+            'sportsOverlap': _jaccard(intersection, counts + query.sports_count - intersection)
+        }
+
+    def block_components(self, other: "FeatureRows") -> Dict[str, np.ndarray]:
+        """Every row here against every row of `other`, as len(self) x len(other) matrices"""
+        width = min(self.sports.shape[1], other.sports.shape[1])
+        intersection = (self.sports[:, :width] @ other.sports[:, :width].T).toarray()
+        counts = self.sports_counts[:, None]
+        return {
+            'textSimilarity': (self.text @ other.text.T).toarray(),
+            'ageCompatibility': _age_scores(np.abs(self.ages[:, None] - other.ages[None, :])),
+            'gymLevelMatch': _gym_scores(self.gym_levels[:, None].astype(np.int16), other.gym_levels[None, :]),
+            'sportsOverlap': _jaccard(intersection, counts + other.sports_counts[None, :] - intersection)
+        }
+
+    def take(self, rows: np.ndarray) -> "FeatureRows":
+        return FeatureRows(self.text[rows], self.ages[rows], self.gym_levels[rows], self.sports[rows], self.fingerprints[rows])
+
+    def slice(self, start: int, stop: int) -> "FeatureRows":
+        """Rows [start, stop) over the same buffers (no copies)"""
+        return FeatureRows(_csr_rows(self.text, start, stop), self.ages[start:stop], self.gym_levels[start:stop],
+                     _csr_rows(self.sports, start, stop), self.fingerprints[start:stop])
+
+    @staticmethod
+    def stack(first: "FeatureRows", second: "FeatureRows") -> "FeatureRows":
+        width = max(first.sports.shape[1], second.sports.shape[1])
+        return FeatureRows(
+            sparse.vstack([first.text, second.text], format='csr'),
+            np.concatenate([first.ages, second.ages]),
+            np.concatenate([first.gym_levels, second.gym_levels]),
+            sparse.vstack([_widen(first.sports, width), _widen(second.sports, width)], format='csr'),
+            np.concatenate([first.fingerprints, second.fingerprints])
+        )
+
+class FeatureStore:
+    """Columnar matching features for a population of candidate users.
+
+    Rows line up with `user_ids`: a sparse TF-IDF matrix, an age vector, a
+    gym-level code vector and a sparse sports incidence matrix. Scoring one
+    user against every row is a handful of NumPy/SciPy operations.
+
+    A store is never modified in place: apply_changes returns a new store, so
+    a request scoring against the old one is unaffected. The arrays a store
+    was built or mapped with stay its `base` untouched; re-vectorized users
+    go to a small in-memory `delta` appended after it, and the rows they
+    replace are marked inactive until the next full rebuild.
+    """
+
+    def __init__(self, user_ids: List[str], text: sparse.csr_matrix, ages: np.ndarray,
+                 gym_levels: np.ndarray, sports: sparse.csr_matrix, sports_vocab: Dict[str, int],
+                 active: Optional[np.ndarray] = None, index: Optional[Dict[str, int]] = None,
+                 fingerprints: Optional[np.ndarray] = None):
+        self.user_ids = user_ids
+        self.active = np.ones(len(user_ids), dtype=bool) if active is None else active
+        # user id -> row, active rows only
+        self.index = {uid: i for i, uid in enumerate(user_ids)} if index is None else index
+        self.sports_vocab = sports_vocab
+        fingerprints = np.zeros(text.shape[0], dtype=np.uint32) if fingerprints is None else fingerprints
+        self.base = FeatureRows(text, ages, gym_levels, sports, fingerprints)
+        self.delta: Optional[FeatureRows] = None  # rows appended by apply_changes, numbered after the base
+        self._filter_index: Optional[FilterIndex] = None  # built on first filtered request
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    @property
+    def inactive_rows(self) -> int:
+        return len(self.user_ids) - len(self.index)
+
+    @property
+    def delta_rows(self) -> int:
+        return len(self.delta) if self.delta is not None else 0
+
+    def _segments(self) -> List[FeatureRows]:
+        return [self.base] if self.delta is None else [self.base, self.delta]
+
+    def merged(self) -> FeatureRows:
+        """Every row as one run, for publishing and saving; a fresh copy whenever there is a delta"""
+        if self.delta is None:
+            return self.base
+        merged = FeatureRows.stack(self.base, self.delta)
+        merged.sports = _widen(merged.sports, len(self.sports_vocab))
+        return merged
+
+    # Whole-store views; the scoring paths below never need them and go segment by segment.
+    @property
+    def text(self) -> sparse.csr_matrix:
+        return self.merged().text
+
+    @property
+    def ages(self) -> np.ndarray:
+        return self.merged().ages
+
+    @property
+    def gym_levels(self) -> np.ndarray:
+        return self.merged().gym_levels
+
+    @property
+    def sports(self) -> sparse.csr_matrix:
+        return self.merged().sports
+
+    @property
+    def sports_counts(self) -> np.ndarray:
+        return self.merged().sports_counts
+
+    @property
+    def fingerprints(self) -> np.ndarray:
+        return self.merged().fingerprints
+
+    def fingerprint(self, row: int) -> int:
+        base_rows = len(self.base)
+        return int(self.base.fingerprints[row] if row < base_rows else self.delta.fingerprints[row - base_rows])
+
+    def column(self, name: str, rows: np.ndarray) -> np.ndarray:
+        """Dense per-row values ('ages', 'gym_levels' or 'fingerprints') at `rows`"""
+        rows = np.asarray(rows, dtype=np.int64)
+        base = getattr(self.base, name)
+        if self.delta is None:
+            return base[rows]
+        in_base = rows < len(self.base)
+        values = np.empty(len(rows), dtype=base.dtype)
+        values[in_base] = base[rows[in_base]]
+        values[~in_base] = getattr(self.delta, name)[rows[~in_base] - len(self.base)]
+        return values
+
+    def rows_from(self, start: int) -> FeatureRows:
+        """Rows [start, end) without copying the base when `start` is past it"""
+        base_rows = len(self.base)
+        if self.delta is None:
+            return self.base.slice(start, base_rows)
+        if start >= base_rows:
+            return self.delta.slice(start - base_rows, len(self.delta))
+        return FeatureRows.stack(self.base.slice(start, base_rows), self.delta)
+
+    def take(self, rows: np.ndarray) -> FeatureRows:
+        """Private copy of `rows`, in that order"""
+        rows = np.asarray(rows, dtype=np.int64)
+        if self.delta is None:
+            return self.base.take(rows)
+        in_base = rows < len(self.base)
+        stacked = FeatureRows.stack(self.base.take(rows[in_base]), self.delta.take(rows[~in_base] - len(self.base)))
+        order = np.concatenate([np.flatnonzero(in_base), np.flatnonzero(~in_base)])
+        return stacked.take(np.argsort(order, kind="stable"))
+
+    @classmethod
+    def build(cls, users: Dict[str, UserRecord], vectorizer, feature_text,
+              sports_vocab: Optional[Dict[str, int]] = None) -> "FeatureStore":
+        """Vectorize every user; `feature_text` is MatchingAgent._create_feature_text"""
+        user_ids = list(users.keys())
+        population = list(users.values())
+
+        texts = [feature_text(u) for u in population]
+        text = sparse.csr_matrix(vectorizer.transform(texts))
+        fingerprints = np.array([feature_fingerprint(t) for t in texts], dtype=np.uint32)
+        ages = np.array([parse_age(u) for u in population], dtype=np.float64)
+        gym_levels = np.array([gym_level_code(u) for u in population], dtype=np.int8)
+
+        # Sparse user x sport incidence matrix, extending the given vocabulary.
+        sports_vocab = {} if sports_vocab is None else sports_vocab
+        indices, indptr = [], [0]
+        for user in population:
+            for sport in sports_set(user):
+                indices.append(sports_vocab.setdefault(sport, len(sports_vocab)))
+            indptr.append(len(indices))
+        sports_matrix = sparse.csr_matrix(
+            (np.ones(len(indices), dtype=np.float32), np.array(indices, dtype=np.int32), np.array(indptr, dtype=np.int64)),
+            shape=(len(population), len(sports_vocab))
+        )
+
+        logger.info(f"Built feature store for {len(user_ids)} users ({text.nnz} text non-zeros)")
+        return cls(user_ids, text, ages, gym_levels, sports_matrix, sports_vocab, fingerprints=fingerprints)
+
+    def apply_changes(self, changed: Dict[str, UserRecord], removed: List[str], vectorizer, feature_text) -> "FeatureStore":
+        """New store with `changed` users re-vectorized and `removed` users dropped.
+
+        Only the changed rows go through the vectorizer, reusing the fitted
+        vocabulary. The base arrays are shared as they are (a memory-mapped
+        artifact stays mapped); new rows extend the delta.
+        """
+        active = self.active.copy()
+        index = dict(self.index)
+        for uid in list(changed) + list(removed):
+            row = index.pop(uid, None)
+            if row is not None:
+                active[row] = False
+
+        store = copy.copy(self)
+        store.active, store.index = active, index
+        if not changed:
+            return store
+
+        added = FeatureStore.build(changed, vectorizer, feature_text, sports_vocab=dict(self.sports_vocab))
+        offset = len(self.user_ids)
+        for i, uid in enumerate(added.user_ids):
+            index[uid] = offset + i
+        store.user_ids = self.user_ids + added.user_ids
+        store.active = np.concatenate([active, added.active])
+        store.sports_vocab = added.sports_vocab
+        store.delta = added.base if self.delta is None else FeatureRows.stack(self.delta, added.base)
+        if self._filter_index is not None:
+            store._filter_index = self._filter_index.extend(store)
+        return store
+
+    def filter_index(self) -> FilterIndex:
+        if self._filter_index is None:
+            self._filter_index = FilterIndex.build(self)
+        return self._filter_index
+
+    def filter_rows(self, min_age: Optional[int] = None, max_age: Optional[int] = None,
+                    gym_levels: Optional[List[str]] = None, sports: Optional[List[str]] = None) -> Optional[np.ndarray]:
+        """Active rows matching MatchFilters-style criteria, None when nothing is filtered"""
+        sport_ids = None
+        if sports:
+            sport_ids = [self.sports_vocab[s.lower()] for s in sports if s.lower() in self.sports_vocab]
+        gym_codes = None
+        if gym_levels:
+            gym_codes = [GYM_LEVELS.index(g.lower()) for g in gym_levels if g.lower() in GYM_LEVELS]
+        return self.filter_index().resolve(self, sport_ids, gym_codes, min_age, max_age)
+
+    def encode(self, user: UserRecord, vectorizer, feature_text) -> QueryFeatures:
+        text = sparse.csr_matrix(vectorizer.transform([feature_text(user)]))
+        user_sports = sports_set(user)
+        indicator = np.zeros(len(self.sports_vocab), dtype=np.float32)
+        for sport in user_sports:
+            if sport in self.sports_vocab:
+                indicator[self.sports_vocab[sport]] = 1.0
+        return QueryFeatures(text, parse_age(user), gym_level_code(user), indicator, len(user_sports))
+
+    # Vectorized versions of the per-pair helpers in MatchingAgent, base and delta scored in place.
+    def components(self, query: QueryFeatures, rows: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+        if self.delta is None:
+            return self.base.components(query, rows)
+        base_rows = len(self.base)
+        if rows is None:
+            base, delta = self.base.components(query), self.delta.components(query)
+            return {name: np.concatenate([base[name], delta[name]]) for name in COMPONENTS}
+        rows = np.asarray(rows)
+        in_base = rows < base_rows
+        base = self.base.components(query, rows[in_base])
+        delta = self.delta.components(query, rows[~in_base] - base_rows)
+        components = {}
+        for name in COMPONENTS:
+            components[name] = np.empty(len(rows))
+            components[name][in_base] = base[name]
+            components[name][~in_base] = delta[name]
+        return components
+
+    def score(self, query: QueryFeatures, weights: Dict[str, float],
+              rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """Weighted compatibility of `query` against every row (or just `rows`)"""
+        components = self.components(query, rows)
+        return _weighted(components, weights), components
+
+    def score_block(self, rows: np.ndarray, weights: Dict[str, float],
+                    candidates: Optional["FeatureStore"] = None) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """Scores of the users at `rows` against every row, as len(rows) x n matrices.
+
+        Text and sports terms are one sparse matrix-matrix product each; age
+        and gym level broadcast. Callers bound memory by passing blocks.
+        `candidates` (e.g. a shard()) replaces the columns.
+        """
+        queries = self.take(rows)
+        other = self if candidates is None else candidates
+        parts = [queries.block_components(segment) for segment in other._segments()]
+        components = parts[0] if len(parts) == 1 else {
+            name: np.hstack([part[name] for part in parts]) for name in COMPONENTS
+        }
+        return _weighted(components, weights), components
+
+    def top_k(self, scores: np.ndarray, k: int, exclude: Optional[List[int]] = None,
+              rows: Optional[np.ndarray] = None, min_score: float = 0.0) -> List[int]:
+        """Positions in `scores` of the k best, best first; ties broken by user id so pages are stable.
+
+        `scores` covers every row, or just `rows` when scoring was restricted
+        to a candidate subset, in which case row = rows[position]. `min_score`
+        is a percentage compared against the rounded compatibilityScore.
+        """
+        rows = np.arange(len(self.user_ids)) if rows is None else np.asarray(rows)
+        mask = self.active[rows]
+        if exclude:
+            mask &= ~np.isin(rows, exclude)
+        if min_score > 0:
+            mask &= np.round(scores * 100, 1) >= min_score
+        valid = np.flatnonzero(mask)
+        if k <= 0 or len(valid) == 0:
+            return []
+        if k < len(valid):
+            # O(n) partition, then keep every position tied with the k-th best so the tie-break sees them all.
+            subset = scores[valid]
+            kth_best = subset[np.argpartition(-subset, k - 1)[k - 1]]
+            candidates = valid[subset >= kth_best]
+        else:
+            candidates = valid
+        ranked = sorted(candidates.tolist(), key=lambda pos: (-scores[pos], self.user_ids[rows[pos]]))
+        return ranked[:k]
+
+    def top_k_block(self, rows: np.ndarray, weights: Dict[str, float], k: int,
+                    exclude: Optional[List[List[int]]] = None) -> List[Tuple[np.ndarray, np.ndarray, Dict[str, np.ndarray]]]:
+        """For each user at `rows`, their k best other rows as (rows, scores, components), best first.
+
+        `exclude[i]`, when given, lists further rows the i-th user must not get.
+        """
+        scores, components = self.score_block(rows, weights)
+        ranked = []
+        for i, row in enumerate(rows):
+            cols = np.array(self.top_k(scores[i], k, exclude=[row] + list(exclude[i] if exclude else [])),
+                            dtype=np.int64)
+            ranked.append((cols, scores[i, cols], {name: values[i, cols] for name, values in components.items()}))
+        return ranked
+
+    def shard(self, start: int, stop: int) -> "FeatureStore":
+        """Rows [start, stop) as a scoring-only store; no copies unless the range straddles base and delta"""
+        base_rows = len(self.base)
+        if self.delta is None or stop <= base_rows:
+            rows = self.base.slice(start, stop)
+        elif start >= base_rows:
+            rows = self.delta.slice(start - base_rows, stop - base_rows)
+        else:
+            rows = self.take(np.arange(start, stop))
+        return FeatureStore(
+            self.user_ids[start:stop], rows.text, rows.ages, rows.gym_levels, rows.sports,
+            self.sports_vocab, self.active[start:stop], index={}, fingerprints=rows.fingerprints
+        )
+
+def _csr_rows(matrix: sparse.csr_matrix, start: int, stop: int) -> sparse.csr_matrix:
+    indptr = matrix.indptr[start:stop + 1]
+    return sparse.csr_matrix(
+        (matrix.data[indptr[0]:indptr[-1]], matrix.indices[indptr[0]:indptr[-1]], indptr - indptr[0]),
+        shape=(stop - start, matrix.shape[1])
+    )
+
+def breakdown_at(components: Dict[str, np.ndarray], row: int) -> Dict[str, float]:
+    """Per-user score breakdown in the shape calculate_compatibility returns"""
+    return {name: round(float(values[row]), 3) for name, values in components.items()}
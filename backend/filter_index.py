@@ -0,0 +1,114 @@
+from typing import Dict, List, Optional
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+_EMPTY = np.zeros(0, dtype=np.int64)
+
+def _postings(keys: np.ndarray, offset: int = 0) -> Dict[int, np.ndarray]:
+    """key -> sorted row ids, grouping rows by an integer key column"""
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    bounds = np.flatnonzero(np.diff(sorted_keys)) + 1
+    return {
+        int(group_keys[0]): rows + offset
+        for group_keys, rows in zip(np.split(sorted_keys, bounds), np.split(order.astype(np.int64), bounds))
+        if len(rows)
+    }
+
+def _merge(old: Dict, new: Dict) -> Dict:
+    # Appended rows always have larger ids, so concatenation keeps every list sorted.
+    merged = dict(old)
+    for key, rows in new.items():
+        merged[key] = np.concatenate([merged[key], rows]) if key in merged else rows
+    return merged
+
+class FilterIndex:
+    """Posting lists over FeatureStore rows, keyed by sport, gym-level code and age bucket.
+
+    MatchFilters resolve to a row set by list union/intersection, so a
+    selective filter costs time proportional to the matching rows rather
+    than the population. Retired rows stay in the lists and are dropped
+    against the store's active mask at resolve time.
+    """
+
+    def __init__(self, sports: Dict[int, np.ndarray], gym_levels: Dict[int, np.ndarray],
+                 ages: Dict[int, np.ndarray], rows: int, age_bucket: int = 1):
+        self.sports = sports  # sports vocab id -> rows
+        self.gym_levels = gym_levels  # GYM_LEVELS index -> rows
+        self.ages = ages  # age // age_bucket -> rows
+        self.rows = rows
+        self.age_bucket = age_bucket
+
+    @classmethod
+    def _parts(cls, features, start: int, age_bucket: int):
+        part = features.rows_from(start)
+        sports = part.sports.tocsc()
+        sport_lists = {
+            col: sports.indices[sports.indptr[col]:sports.indptr[col + 1]].astype(np.int64) + start
+            for col in range(sports.shape[1]) if sports.indptr[col + 1] > sports.indptr[col]
+        }
+        gym_levels = np.asarray(part.gym_levels)
+        gym_lists = _postings(gym_levels, start)
+        gym_lists.pop(-1, None)  # unknown level never matches a filter
+
+        ages = np.asarray(part.ages)
+        known = np.flatnonzero(~np.isnan(ages))
+        age_lists = {
+            bucket: known[rows] + start
+            for bucket, rows in _postings((ages[known] // age_bucket).astype(np.int64)).items()
+        }
+        return sport_lists, gym_lists, age_lists
+
+    @classmethod
+    def build(cls, features, age_bucket: int = 1) -> "FilterIndex":
+        sports, gym_levels, ages = cls._parts(features, 0, age_bucket)
+        return cls(sports, gym_levels, ages, len(features.user_ids), age_bucket)
+
+    def extend(self, features) -> "FilterIndex":
+        """Index for a store that appended rows to the one this index was built for"""
+        sports, gym_levels, ages = self._parts(features, self.rows, self.age_bucket)
+        return FilterIndex(
+            _merge(self.sports, sports),
+            _merge(self.gym_levels, gym_levels),
+            _merge(self.ages, ages),
+            len(features.user_ids),
+            self.age_bucket
+        )
+
+    def _union(self, lists: List[np.ndarray]) -> np.ndarray:
+        lists = [rows for rows in lists if len(rows)]
+        if not lists:
+            return _EMPTY
+        return lists[0] if len(lists) == 1 else np.unique(np.concatenate(lists))
+
+    def resolve(self, features, sport_ids: Optional[List[int]] = None, gym_codes: Optional[List[int]] = None,
+                min_age: Optional[int] = None, max_age: Optional[int] = None) -> Optional[np.ndarray]:
+        """Sorted active rows passing every filter, or None when no filter is set"""
+        selections = []
+        if sport_ids is not None:
+            selections.append(self._union([self.sports.get(i, _EMPTY) for i in sport_ids]))
+        if gym_codes is not None:
+            selections.append(self._union([self.gym_levels.get(c, _EMPTY) for c in gym_codes]))
+        if min_age is not None or max_age is not None:
+            low = min_age if min_age is not None else 0
+            high = max_age if max_age is not None else 200
+            buckets = [rows for bucket, rows in self.ages.items()
+                       if bucket * self.age_bucket <= high and (bucket + 1) * self.age_bucket - 1 >= low]
+            rows = self._union(buckets)
+            if self.age_bucket > 1 and len(rows):  # trim the partial buckets at either end
+                ages = features.column("ages", rows)
+                rows = rows[(ages >= low) & (ages <= high)]
+            selections.append(rows)
+
+        if not selections:
+            return None
+        # Intersect smallest first so the work tracks the most selective filter.
+        selections.sort(key=len)
+        rows = selections[0]
+        for other in selections[1:]:
+            if not len(rows):
+                break
+            rows = np.intersect1d(rows, other, assume_unique=True)
+        return rows[features.active[rows]]
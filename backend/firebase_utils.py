@@ -1,10 +1,18 @@
 import firebase_admin  # Firebase Admin SDK for Python
 from firebase_admin import credentials, firestore  # Import credentials and Firestore client
 from google.cloud.firestore_v1.base_client import BaseClient  # Firestore base client (not always needed)
-from models import User
+from models import User, UserRecord, RECORD_FIELDS
+from user_store import UserStore
+from friend_graph import FriendGraph
+from exclusions import ExclusionIndex
+from replica import SqliteReplica
+from metrics import instrument_firestore
+from profiling import accumulate
 from google.cloud.firestore_v1.field_path import FieldPath
-from typing import Dict, Optional, List, Union  # Type hints for better code clarity
+from typing import Dict, Optional, List, Tuple, Union  # Type hints for better code clarity
 import os  # For file path operations
+import base64
+import json
 import logging  # For logging errors and info
 from datetime import datetime
 
@@ -19,7 +27,7 @@ try:
             os.path.join(os.path.dirname(__file__), "DontShare", "firebase-account-key.json")  # Path to service account key
         )
         firebase_admin.initialize_app(cred)  # Initialize Firebase app
-    db = firestore.client()  # Get Firestore client
+    db = instrument_firestore(firestore.client())  # Firestore client with read/write accounting
 except Exception as e:
     logger.error(f"Firebase initialization failed: {e}")  # Log error if initialization fails
     raise
@@ -35,6 +43,11 @@ def _convert_firestore_data(data: dict) -> dict:
 
 # Fetch and validate user document
 def get_user_data(user_id: str) -> Optional[User]:
+    # Served from the in-memory snapshot once the listener is up.
+    if user_store.is_ready:
+        return user_store.get(user_id)
+    if _replica_ready():
+        return _users_from({user_id: replica.get_user(user_id)}).get(user_id)
     try:
         doc_ref = db.collection("users").document(user_id)  # Reference to user document
         doc = doc_ref.get()  # Get document snapshot
@@ -58,6 +71,16 @@ def get_all_users(exclude: List[str] = None) -> Dict[str, User]:
     """Get all users except excluded ones"""
     if exclude is None:
         exclude = []
+    if user_store.is_ready:
+        users = user_store.all(exclude=exclude)
+        logger.info(f"Retrieved {len(users)} users from user store")
+        return users
+    if _replica_ready():
+        excluded = set(exclude)
+        docs = replica.query_users(surveyed_only=True)
+        users = _users_from({uid: data for uid, data in docs.items() if uid not in excluded})
+        logger.info(f"Retrieved {len(users)} users from read replica")
+        return users
     
     try:
         users_ref = db.collection("users")  # Reference to users collection
@@ -68,8 +91,9 @@ def get_all_users(exclude: List[str] = None) -> Dict[str, User]:
             if doc.id not in exclude:  # Skip excluded users
                 data = doc.to_dict()
                 if 'surveyCompleted' in data and data['surveyCompleted']:  # Only include users who completed survey
-                    converted_data = _convert_firestore_data(data)
-                    users[doc.id] = User(**converted_data)
+                    with accumulate("pydantic.parse"):
+                        converted_data = _convert_firestore_data(data)
+                        users[doc.id] = User(**converted_data)
         
         logger.info(f"Retrieved {len(users)} users")  # Log number of users retrieved
         return users
@@ -77,6 +101,37 @@ def get_all_users(exclude: List[str] = None) -> Dict[str, User]:
         logger.error(f"Error fetching users: {e}")  # Log error if fetch fails
         return {}
 
+# Matching fields of every surveyed user, for bulk scans. The user store hands out records
+# built when each document arrived; the fallbacks read just RECORD_FIELDS without Pydantic.
+def get_all_user_records(exclude: List[str] = None) -> Dict[str, UserRecord]:
+    if user_store.is_ready:
+        return user_store.records(exclude)
+    excluded = set(exclude or [])
+    if _replica_ready():
+        docs = replica.query_users(surveyed_only=True)
+        return _records_from({uid: data for uid, data in docs.items() if uid not in excluded})
+    try:
+        docs = db.collection("users").where("surveyCompleted", "==", True).select(RECORD_FIELDS).stream()
+        records = _records_from({doc.id: doc.to_dict() for doc in docs if doc.id not in excluded})
+        logger.info(f"Retrieved {len(records)} user records")
+        return records
+    except Exception as e:
+        logger.error(f"Error fetching user records: {e}")
+        return {}
+
+# Records for the given ids; users who are missing or have not completed the survey are left out.
+def batch_get_user_records(user_ids: List[str]) -> Dict[str, UserRecord]:
+    if user_store.is_ready:
+        return user_store.get_records(user_ids)
+    if _replica_ready():
+        return _records_from(replica.get_users(user_ids))
+    try:
+        refs = [db.collection("users").document(uid) for uid in user_ids]
+        return _records_from({doc.id: doc.to_dict() for doc in db.get_all(refs, field_paths=RECORD_FIELDS) if doc.exists})
+    except Exception as e:
+        logger.error(f"Batch record fetch failed: {e}")
+        return {}
+
 #Update user's sports list with validation
 def update_user_sports(user_id: str, sports: List[str]) -> bool:
     try:
@@ -106,26 +161,28 @@ def update_user_sports(user_id: str, sports: List[str]) -> bool:
 
 def batch_get_users(user_ids: List[str]) -> Dict[str, User]:
     """Efficiently fetch multiple users in batch"""
+    if user_store.is_ready:
+        return user_store.get_many(user_ids)
+    if _replica_ready():
+        return _users_from(replica.get_users(user_ids))
     try:
-        users = {}
         batch_refs = [db.collection("users").document(uid) for uid in user_ids]  # Create document references
         docs = db.get_all(batch_refs)  # Batch fetch documents
-        
-        for doc in docs:
-            if doc.exists:
-                data = _convert_firestore_data(doc.to_dict())
-                users[doc.id] = User(**data)
-        
-        return users
+        # Validated one by one: a bad document only drops itself from the batch.
+        return _users_from({doc.id: doc.to_dict() for doc in docs if doc.exists})
     except Exception as e:
         logger.error(f"Batch fetch failed: {e}")  # Log error if batch fetch fails
         return {}
 
 # Create the new friends requests documents. (In the firebase database)
-def create_friend_request(from_user_id: str, to_user_id: str) -> Optional[str]:
+# Callers that already loaded both users pass them in to skip the re-reads.
+def create_friend_request(from_user_id: str, to_user_id: str,
+                          from_user: Optional[User] = None, to_user: Optional[User] = None) -> Optional[str]:
     try:
-        from_user = get_user_data(from_user_id)
-        to_user = get_user_data(to_user_id)
+        if from_user is None:
+            from_user = get_user_data(from_user_id)
+        if to_user is None:
+            to_user = get_user_data(to_user_id)
         
         request_data = {
             "from_user": from_user_id,
@@ -137,6 +194,7 @@ def create_friend_request(from_user_id: str, to_user_id: str) -> Optional[str]:
         }
         # Adds a new doc with the data in request_data to the friend_requests collection in Firestore.
         _, doc_ref = db.collection("friend_requests").add(request_data)
+        exclusions.request_sent(doc_ref.id, from_user_id, to_user_id)
         # and returning the newly created friend request doc. 
         logger.info("DEBUGGING: Returning the newly added user request doc.")
         return doc_ref.id
@@ -156,36 +214,30 @@ def update_friend_request_status(request_id: str, status: str) -> bool:
             "status": status,
             "responded_at": firestore.SERVER_TIMESTAMP
         })
+        exclusions.request_closed(request_id)
         return True
     
     except Exception as e:
         logger.error(f"Error updating friend request: {e}")
         return False
     
+# Both users' friends arrays, queued on a batch (op is ArrayUnion or ArrayRemove).
+def _queue_friendship(batch, user1_id: str, user2_id: str, op):
+    for user_id, friend_id in ((user1_id, user2_id), (user2_id, user1_id)):
+        batch.update(db.collection("users").document(user_id), {
+            "friends": op([friend_id]),
+            "updated_at": firestore.SERVER_TIMESTAMP
+        })
+
 # Add mutual friendship between two users
 def add_friendship(user1_id: str, user2_id: str) -> bool:
     try:
-        batch = db.batch() 
-        user1_ref = db.collection("users").document(user1_id)
-        user2_ref = db.collection("users").document(user2_id)
-        
-        batch.update(user1_ref, {
-            "friends": firestore.ArrayUnion([user2_id]),
-            "updated_at": firestore.SERVER_TIMESTAMP
-        })
-        batch.update(user2_ref, {
-            "friends": firestore.ArrayUnion([user1_id]),
-            "updated_at": firestore.SERVER_TIMESTAMP
-        })
-        # commit the changes. 
+        batch = db.batch()
+        _queue_friendship(batch, user1_id, user2_id, firestore.ArrayUnion)
+        # Both arrays change in one commit; the ids are all the log needs, so no re-reads.
         batch.commit()
-        user1_data = get_user_data(user1_id)
-        user1 = user1_data.fullName
-        
-        user2_data = get_user_data(user2_id)
-        user2 = user2_data.fullName
-        
-        logger.info(f"Successfully add_friendship function between {user1} and {user2}")
+        friend_graph.link(user1_id, user2_id)
+        logger.info(f"Successfully added friendship between {user1_id} and {user2_id}")
         return True
     
     except Exception as e:
@@ -195,34 +247,68 @@ def add_friendship(user1_id: str, user2_id: str) -> bool:
 # Adding the remove friendships in the firebase database. 
 def remove_friends_from_lists(user1_id: str, user2_id: str) -> bool:
     try:
-        batch = db.batch() 
-        user1_ref = db.collection("users").document(user1_id)
-        user2_ref = db.collection("users").document(user2_id)
-        
-        batch.update(user1_ref, {
-            "friends": firestore.ArrayRemove([user2_id]),
-            "updated_at": firestore.SERVER_TIMESTAMP
-        })
-        batch.update(user2_ref, {
-            "friends": firestore.ArrayRemove([user1_id]),
-            "updated_at": firestore.SERVER_TIMESTAMP
-        })
-        
+        batch = db.batch()
+        _queue_friendship(batch, user1_id, user2_id, firestore.ArrayRemove)
         batch.commit() # Removed the friendship correctly. 
-        user1_data = get_user_data(user1_id)
-        user1 = user1_data.fullName
-        
-        user2_data = get_user_data(user2_id)
-        user2 = user2_data.fullName
-        
-        logger.info(f"Successfully remove_friendship function between {user1} and {user2}")
+        friend_graph.link(user1_id, user2_id, linked=False)
+        logger.info(f"Successfully removed friendship between {user1_id} and {user2_id}")
         return True
     except Exception as e:
         logger.error(f"Error removing friendship: {e}")
         return False
 
+# One answer as a transaction: the request is read inside it and must still be pending, so two
+# concurrent answers (or a worker whose exclusion index is behind) cannot both commit. The status
+# and, for an accept, both friends arrays are written together; returns (from_user, to_user).
+@firestore.transactional
+def _answer_request(transaction, request_id: str, status: str) -> Optional[Tuple[str, str]]:
+    request_ref = db.collection("friend_requests").document(request_id)
+    snapshot = request_ref.get(transaction=transaction)
+    data = snapshot.to_dict() if snapshot.exists else None
+    if not data or data.get("status") != "pending" or not data.get("from_user") or not data.get("to_user"):
+        return None
+    transaction.update(request_ref, {
+        "status": status,
+        "responded_at": firestore.SERVER_TIMESTAMP
+    })
+    if status == "accepted":
+        _queue_friendship(transaction, data["from_user"], data["to_user"], firestore.ArrayUnion)
+    return data["from_user"], data["to_user"]
+
+# Answer one friend request ("accepted" | "rejected") without any post-commit reads.
+# Returns {"status", "from_user", "to_user"}, or None when it is missing, already answered or the write failed.
+def respond_to_friend_request(request_id: str, status: str) -> Optional[Dict]:
+    try:
+        if status not in ("accepted", "rejected"):
+            raise ValueError("Invalid status")
+        pair = _answer_request(db.transaction(), request_id, status)
+    except Exception as e:
+        logger.error(f"Error answering friend request {request_id}: {e}")
+        return None
+    # Either way the request is no longer pending here.
+    exclusions.request_closed(request_id)
+    if pair is None:
+        logger.warning(f"Friend request {request_id} not found or already answered")
+        return None
+    from_user, to_user = pair
+    if status == "accepted":
+        friend_graph.link(from_user, to_user)
+    return {"status": status, "from_user": from_user, "to_user": to_user}
+
+# Answer many friend requests ({request_id: status}), each in its own transaction.
+# Returns the committed answers by request id.
+def respond_to_friend_requests(responses: Dict[str, str]) -> Dict[str, Dict]:
+    answered = {}
+    for request_id, status in responses.items():
+        result = respond_to_friend_request(request_id, status)
+        if result is not None:
+            answered[request_id] = result
+    return answered
+
 #Get pending friend requests for a user. 
 def get_pending_requests(user_id: str) -> List[Dict]:
+    if _replica_ready():
+        return replica.pending_requests(user_id)
     try:
         requests = db.collection("friend_requests") \
             .where("to_user", "==", user_id) \
@@ -238,6 +324,25 @@ def get_pending_requests(user_id: str) -> List[Dict]:
         logger.error(f"Error fetching pending requests: {e}")
         return []
 
+# (request_id, from_user, to_user) for every pending friend request, to seed the exclusion index.
+def get_pending_request_pairs() -> List[Tuple[str, str, str]]:
+    if _replica_ready():
+        return replica.pending_request_pairs()
+    try:
+        requests = db.collection("friend_requests") \
+            .where("status", "==", "pending") \
+            .select(["from_user", "to_user"]) \
+            .stream()
+        pairs = []
+        for doc in requests:
+            data = doc.to_dict()
+            if data.get("from_user") and data.get("to_user"):
+                pairs.append((doc.id, data["from_user"], data["to_user"]))
+        return pairs
+    except Exception as e:
+        logger.error(f"Error fetching pending request pairs: {e}")
+        return []
+
 # To fetch a friend request document by its ID
 def get_friend_request(request_id: str) -> Optional[dict]:
     try:
@@ -259,39 +364,132 @@ def get_friend_request(request_id: str) -> Optional[dict]:
 # Get a user's friends list with basic info. 
 def get_friends_list(user_id: str) -> List[Dict]:
     try:
-        # Getting uer's doc to look at their collectionss. 
-        user_ref = db.collection("users").document(user_id)
-        user_doc = user_ref.get()
-        
-        if not user_doc.exists:
-            return []
-
-        # Debugging to log the friends_ids just before the query.
-        logger.info(f"Friend IDs: {friends_ids}")
-
-        # Checking the matching users.     
-        friends_ids = user_doc.to_dict().get("friends", [])
+        # Getting the user's friend ids, then the friends in `in`-sized chunks.
+        friends_ids = get_friend_ids(user_id)
         if not friends_ids:
             return []
-        
-        friends_docs = db.collection("users").where(
-            FieldPath.document_id(), "in", friends_ids
-        ).stream()
-        
-        # For the debugging. 
-        for doc in friends_docs:
-            logger.info(f"Friend fetched: {doc.id} => {doc.to_dict()}")
-        
-        return [{"id": doc.id, **doc.to_dict()} for doc in friends_docs]
+        logger.info(f"Fetching {len(friends_ids)} friends for {user_id}")
+
+        friends = {}
+        for chunk in friend_id_chunks(friends_ids):
+            friends.update(fetch_friends_chunk(chunk))
+        return [friends[fid] for fid in friends_ids if fid in friends]
     
     except Exception as e:
         logger.error(f"Error fetching friends list: {e}")
         return []
 
+# Firestore rejects an `in` filter with more than 30 values.
+FIRESTORE_IN_LIMIT = 30
+# The only fields the friends list shows; the rest of the profile stays on the server.
+FRIEND_FIELDS = ["fullName", "preferences.gymLevel", "sports"]
+
+# The user's friend ids in stored order, or None when the user does not exist.
+def get_friend_ids(user_id: str) -> Optional[List[str]]:
+    if user_store.is_ready:
+        user = user_store.get(user_id)
+        return list(user.friends) if user else None
+    user_doc = db.collection("users").document(user_id).get(field_paths=["friends"])
+    if not user_doc.exists:
+        return None
+    return user_doc.to_dict().get("friends", [])
+
+def friend_id_chunks(friend_ids: List[str]) -> List[List[str]]:
+    return [friend_ids[i:i + FIRESTORE_IN_LIMIT] for i in range(0, len(friend_ids), FIRESTORE_IN_LIMIT)]
+
+# Projected friend entries for one chunk of ids, keyed by id.
+def fetch_friends_chunk(friend_ids: List[str]) -> Dict[str, Dict]:
+    if user_store.is_ready:
+        users = user_store.get_many(friend_ids)
+        friends = {fid: project_friend(fid, user) for fid, user in users.items()}
+        # The store only holds valid users; Firestore still returns the others, so read those from it.
+        unvalidated = user_store.unvalidated(friend_ids)
+        if unvalidated:
+            logger.info(f"Reading friends {unvalidated} from Firestore: their profiles do not validate")
+            friends.update(query_friends(unvalidated))
+    else:
+        friends = query_friends(friend_ids)
+    missing = [fid for fid in friend_ids if fid not in friends]
+    if missing:
+        logger.warning(f"Skipping friends with no user document: {missing}")
+    return friends
+
+def query_friends(friend_ids: List[str]) -> Dict[str, Dict]:
+    docs = db.collection("users").where(
+        FieldPath.document_id(), "in", friend_ids
+    ).select(FRIEND_FIELDS).stream()
+    return {doc.id: {"id": doc.id, **doc.to_dict()} for doc in docs}
+
+# Same shape as a projected Firestore document.
+def project_friend(user_id: str, user: User) -> Dict:
+    return {
+        "id": user_id,
+        "fullName": user.fullName,
+        "preferences": {"gymLevel": user.preferences.gymLevel},
+        "sports": user.sports or []
+    }
+
+# Opaque page cursor: the position after the last friend served plus that friend's id,
+# so a page boundary survives friends being removed earlier in the list.
+def encode_friends_cursor(offset: int, last_id: str) -> str:
+    raw = json.dumps({"o": offset, "id": last_id}).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_friends_cursor(cursor: str, friend_ids: List[str]) -> int:
+    """Index of the next friend to serve; raises ValueError on a malformed cursor"""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        offset, last_id = int(data["o"]), data["id"]
+    except Exception:
+        raise ValueError("Invalid cursor")
+    try:
+        return friend_ids.index(last_id) + 1
+    except ValueError:
+        return min(max(offset, 0), len(friend_ids))
+
 # Enhanced converter to handle friend request timestamps
 def _convert_firestore_data(data: dict) -> dict:
     if 'created_at' in data and hasattr(data['created_at'], 'to_datetime'):
         data['created_at'] = data['created_at'].to_datetime()
     if 'responded_at' in data and hasattr(data['responded_at'], 'to_datetime'):
         data['responded_at'] = data['responded_at'].to_datetime()
-    return data
\ No newline at end of file
+    return data
+
+# Process-wide users snapshot backing the read helpers above (started from main.py on startup).
+user_store = UserStore(db, _convert_firestore_data)
+
+# Friend graph over the same snapshot (built and subscribed from main.py), written through by
+# add_friendship / remove_friends_from_lists so it does not wait for the listener.
+friend_graph = FriendGraph()
+
+# Who each user must not be matched with: the graph's friends plus pending requests and blocks,
+# seeded from main.py and written through by create_friend_request / update_friend_request_status.
+exclusions = ExclusionIndex(friend_graph)
+
+# Optional local SQLite mirror of users and friend_requests (USER_READS=replica, see replica.py).
+# Reads fall through to it when the user store is not running, and to Firestore until its first copy.
+replica = SqliteReplica(os.getenv("REPLICA_PATH", "replica.db"), db) if os.getenv("USER_READS") == "replica" else None
+
+def _replica_ready() -> bool:
+    return replica is not None and replica.is_ready
+
+# Validated users from raw replica documents; half-finished profiles are skipped like everywhere else.
+def _users_from(docs: Dict[str, Optional[dict]]) -> Dict[str, User]:
+    users = {}
+    for user_id, data in docs.items():
+        if data is None:
+            continue
+        try:
+            with accumulate("pydantic.parse"):
+                users[user_id] = User(**_convert_firestore_data(data))
+        except Exception as e:
+            logger.debug("Skipping replica user %s: %s", user_id, e)
+    return users
+
+def _records_from(docs: Dict[str, Optional[dict]]) -> Dict[str, UserRecord]:
+    records = {}
+    for user_id, data in docs.items():
+        record = UserRecord.from_document(user_id, data) if data is not None else None
+        if record is not None:
+            records[user_id] = record
+    return records
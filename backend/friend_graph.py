@@ -0,0 +1,104 @@
+# In-memory friend graph.
+# Every user id gets a dense integer; each user's `friends` list is kept as a sorted
+# int32 array (one CSR row), so graph questions are numpy operations over a few
+# small arrays instead of document reads. Built from the user store snapshot, then
+# kept current by its change feed and by the friendship writes in firebase_utils.
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+_EMPTY = np.zeros(0, dtype=np.int32)
+
+class FriendGraph:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids: Dict[str, int] = {}
+        self._names: List[str] = []
+        self._rows: List[np.ndarray] = []  # id -> sorted friend ids
+        self.ready = False
+        self.edges = 0
+        self.updates = 0
+
+    def _id(self, user_id: str) -> int:
+        found = self._ids.get(user_id)
+        if found is None:
+            found = self._ids[user_id] = len(self._names)
+            self._names.append(user_id)
+            self._rows.append(_EMPTY)
+        return found
+
+    def _set_row(self, user_id: str, friend_ids: Iterable[str]):
+        row = self._id(user_id)
+        friends = np.unique(np.array([self._id(f) for f in friend_ids if f != user_id], dtype=np.int32))
+        self.edges += len(friends) - len(self._rows[row])
+        self._rows[row] = friends
+
+    # Full load from {user_id: User}; users without a friends list get an empty row.
+    def rebuild(self, users: Dict) -> Dict:
+        with self._lock:
+            self._ids, self._names, self._rows, self.edges = {}, [], [], 0
+            for user_id, user in users.items():
+                self._set_row(user_id, getattr(user, "friends", None) or [])
+            self.ready = True
+            logger.info(f"Friend graph built: {len(self._names)} users, {self.edges} friend links")
+            return {"users": len(self._names), "edges": self.edges}
+
+    # UserStore change-feed callback: the document's friends list replaces the row.
+    def on_user_changed(self, user_id: str, user):
+        with self._lock:
+            self._set_row(user_id, (user.friends or []) if user is not None else [])
+            self.updates += 1
+
+    # Write-through from add_friendship / remove_friends_from_lists (both directions).
+    def link(self, user1_id: str, user2_id: str, linked: bool = True):
+        with self._lock:
+            for a, b in ((user1_id, user2_id), (user2_id, user1_id)):
+                row, other = self._id(a), self._id(b)
+                friends = self._rows[row]
+                present = np.isin(other, friends)
+                if linked and not present:
+                    self._rows[row] = np.insert(friends, np.searchsorted(friends, other), other).astype(np.int32)
+                    self.edges += 1
+                elif not linked and present:
+                    self._rows[row] = friends[friends != other]
+                    self.edges -= 1
+            self.updates += 1
+
+    def friends(self, user_id: str) -> List[str]:
+        with self._lock:
+            row = self._ids.get(user_id)
+            return [self._names[i] for i in self._rows[row]] if row is not None else []
+
+    def mutual_count(self, user1_id: str, user2_id: str) -> int:
+        with self._lock:
+            a, b = self._ids.get(user1_id), self._ids.get(user2_id)
+            if a is None or b is None:
+                return 0
+            return len(np.intersect1d(self._rows[a], self._rows[b], assume_unique=True))
+
+    def friends_of_friends(self, user_id: str, exclude: Iterable[str] = ()) -> Tuple[List[str], np.ndarray]:
+        """Users two hops away (not already friends) with their mutual-friend counts, most mutual first"""
+        with self._lock:
+            row = self._ids.get(user_id)
+            if row is None:
+                return [], np.zeros(0, dtype=np.int64)
+            own = self._rows[row]
+            hops = [self._rows[f] for f in own]
+            excluded = np.array([self._ids[u] for u in exclude if u in self._ids], dtype=np.int32)
+            names = self._names
+        if not hops:
+            return [], np.zeros(0, dtype=np.int64)
+        # Each two-hop path through a friend is one mutual friend.
+        candidates, counts = np.unique(np.concatenate(hops), return_counts=True)
+        keep = ~np.isin(candidates, own) & (candidates != row)
+        if len(excluded):
+            keep &= ~np.isin(candidates, excluded)
+        candidates, counts = candidates[keep], counts[keep]
+        order = np.argsort(-counts, kind="stable")
+        return [names[i] for i in candidates[order]], counts[order]
+
+    def stats(self) -> Dict:
+        return {"ready": self.ready, "users": len(self._names), "edges": self.edges, "updates": self.updates}
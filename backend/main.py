@@ -1,27 +1,67 @@
-from fastapi import FastAPI, HTTPException, status, Query
+from fastapi import FastAPI, HTTPException, status, Query, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, validator
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Match
+from pydantic import BaseModel, Field, validator
 from typing import List, Optional, Dict, Any
 from datetime import datetime
 from typing import List
 import logging
 import traceback
+import asyncio
+import time
+import json
+import os
 
 # Importing other files. 
-from models import User, FriendRequest, FriendRequestResponse,FriendRequestAction
+from models import User, FriendRequest, FriendRequestResponse,FriendRequestAction, FriendRequestBatchAction
 from matching_agent import MatchingAgent
+from candidate_retrieval import IVFRetriever, SentenceEncoder
+from parallel_scoring import ShardedScorer
+from reindex_queue import ReindexQueue
+from match_table import MatchTableJob, make_sink
 from firebase_utils import (
-    get_user_data,
-    get_all_users,
-    update_user_sports,
-    create_friend_request,
-    update_friend_request_status,
-    add_friendship,
-    get_friend_request,  # Added this import.
-    get_pending_requests,
-    get_friends_list,
-    remove_friends_from_lists
+    db,
+    replica,
+    user_store,
+    friend_graph,
+    exclusions,
+    get_pending_request_pairs
+)
+from platform_stats import PlatformStats
+# Awaitable versions of the firebase_utils helpers; blocking calls run on a bounded pool.
+from async_firebase import (
+    run_blocking,
+    run_scoring,
+    get_user_data_async,
+    get_all_users_async,
+    update_user_sports_async,
+    create_friend_request_async,
+    respond_to_friend_request_async,
+    remove_friends_from_lists_async,
+    get_pending_requests_async,
+    get_friends_page_async,
+    shutdown as shutdown_firestore_io
+)
+from user_loader import UserLoader, get_user_loader, loader_stats
+import profiling
+from response_cache import response_cache
+from admission import ConcurrencyLimiter, Overloaded, SingleFlight
+from metrics import (
+    REGISTRY,
+    REQUEST_SECONDS,
+    REQUESTS_IN_FLIGHT,
+    CACHE_HIT_RATIO,
+    CACHE_LOOKUPS,
+    MATCHING_INDEX_LAG_SECONDS,
+    MATCHING_INDEX_PENDING,
+    ADMISSION_DECISIONS,
+    ADMISSION_ACTIVE,
+    SINGLE_FLIGHT_SHARED,
+    CONTENT_TYPE,
+    begin_request,
+    end_request,
+    render as render_metrics
 )
 
 # Configure logging with more detail
@@ -43,15 +83,186 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Route template ("/matches/{user_id}") for metric labels, resolved before the handler runs.
+def _route_of(scope) -> str:
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+# Latency, in-flight count and Firestore reads/writes for every request, labelled by route.
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    route = _route_of(request.scope)
+    REQUESTS_IN_FLIGHT.inc(method=request.method, route=route)
+    token = begin_request(route)
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        REQUEST_SECONDS.observe(time.perf_counter() - started, method=request.method, route=route, status=status_code)
+        REQUESTS_IN_FLIGHT.dec(method=request.method, route=route)
+        end_request(token)
+
+# Opt-in profiling for /matches, /stats and /friend-requests: `X-Profile: 1` or `?profile=1`,
+# together with the admin token, adds the span tree to the response. A small sample is profiled
+# silently so slow requests get dumped to the profile file either way.
+@app.middleware("http")
+async def profile_request(request: Request, call_next):
+    path = request.url.path
+    if not profiling.covers(path):
+        return await call_next(request)
+    explicit = profiling.requested(request.headers, request.query_params)
+    if not explicit and not profiling.sampled():
+        return await call_next(request)
+
+    profile, token = profiling.start(f"{request.method} {path}")
+    try:
+        response = await call_next(request)
+    finally:
+        profiling.finish(profile, token)
+    profiling.maybe_dump(profile, path)
+    if not explicit:
+        return response
+    # Streams (the /matches/batch NDJSON) and other non-JSON bodies pass through untouched.
+    if not response.headers.get("content-type", "").startswith("application/json"):
+        response.headers["Server-Timing"] = profiling.server_timing(profile)
+        return response
+
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    # The body changes, so drop the validators and length computed for the original.
+    headers = {k: v for k, v in response.headers.items() if k.lower() not in ("content-length", "etag")}
+    headers["Server-Timing"] = profiling.server_timing(profile)
+    if body:
+        data = json.loads(body)
+        if isinstance(data, dict):
+            data["_profile"] = profile.to_dict()
+            body = json.dumps(data, default=str).encode()
+    return Response(body, status_code=response.status_code, headers=headers)
+
+# Approximate candidate retrieval (MATCHING_RETRIEVAL=ivf); exact scoring otherwise.
+def _make_retriever() -> Optional[IVFRetriever]:
+    if os.getenv("MATCHING_RETRIEVAL", "exact") != "ivf":
+        return None
+    encoder_path = os.getenv("MATCHING_ENCODER_PATH")  # local sentence-transformers model directory
+    return IVFRetriever(
+        n_probe=int(os.getenv("MATCHING_IVF_PROBE", "8")),
+        n_candidates=int(os.getenv("MATCHING_IVF_CANDIDATES", "300")),
+        encoder=SentenceEncoder(encoder_path) if encoder_path else None
+    )
+
+# Multi-process scoring over shared-memory features (SCORING_WORKERS > 0); one core otherwise.
+def _make_scorer() -> Optional[ShardedScorer]:
+    workers = int(os.getenv("SCORING_WORKERS", "0"))
+    if workers <= 0:
+        return None
+    shard_size = os.getenv("SCORING_SHARD_SIZE")
+    return ShardedScorer(
+        workers,
+        shard_size=int(shard_size) if shard_size else None,
+        min_rows=int(os.getenv("SCORING_MIN_ROWS", "20000")),
+        republish_interval=float(os.getenv("SCORING_REPUBLISH_INTERVAL", "5"))
+    )
+
 # Initialize matching agent with error handling
 try:
-    matching_agent = MatchingAgent()
+    matching_agent = MatchingAgent(
+        featurizer=os.getenv("MATCHING_FEATURIZER", "tfidf"),
+        artifact_dir=os.getenv("MATCHING_ARTIFACT_DIR"),  # set to share a prebuilt model across workers
+        retriever=_make_retriever(),
+        scorer=_make_scorer(),
+        exclusions=exclusions
+    )
     logger.info("MatchingAgent initialized successfully")
 except Exception as e:
     logger.error(f"Failed to initialize MatchingAgent: {e}")
     logger.error(f"Traceback: {traceback.format_exc()}")
     raise
 
+# Profile edits are applied to the matching index by a background pass once a burst goes quiet.
+reindex_queue = ReindexQueue(
+    matching_agent,
+    window=float(os.getenv("REINDEX_WINDOW", "1.0")),
+    max_delay=float(os.getenv("REINDEX_MAX_DELAY", "10.0"))
+)
+
+# Live scoring: identical concurrent computations share one result, at most SCORING_CONCURRENCY
+# run at once and SCORING_QUEUE more wait up to SCORING_MAX_WAIT seconds; the rest get 503.
+single_flight = SingleFlight()
+scoring_limiter = ConcurrencyLimiter(
+    "scoring",
+    limit=int(os.getenv("SCORING_CONCURRENCY", str(os.cpu_count() or 4))),
+    queue=int(os.getenv("SCORING_QUEUE", "32")),
+    retry_after=int(os.getenv("SCORING_RETRY_AFTER", "1")),
+    max_wait=float(os.getenv("SCORING_MAX_WAIT", "5"))
+)
+
+# matching_agent.find_matches behind single-flight and the scoring limiter.
+async def find_matches_shared(user_id: str, user: User, limit: int, min_score: float = 0.0,
+                              filters: Optional[Dict] = None) -> List[Dict]:
+    key = ("find_matches", user_id, limit, min_score, json.dumps(filters, sort_keys=True) if filters else None)
+    return await single_flight.do(key, lambda: scoring_limiter.run(
+        matching_agent.find_matches, user_id, limit, filters=filters, min_score=min_score, current_user=user
+    ))
+
+# Precomputed top-K table (MATCH_TABLE=firestore | jsonl:<path> | sqlite:<path>); live scoring otherwise.
+match_table = MatchTableJob(matching_agent, make_sink(os.environ["MATCH_TABLE"])) if os.getenv("MATCH_TABLE") else None
+
+# Platform aggregates kept current from the user store feed and checkpointed to stats/platform.
+platform_stats = PlatformStats(db)
+
+# Load the users snapshot once and keep it current with a Firestore listener.
+@app.on_event("startup")
+def start_user_store():
+    # Profile edits re-vectorize just that user's row in the matching index, in debounced batches.
+    reindex_queue.start()
+    user_store.subscribe(reindex_queue.on_user_changed)
+    # Any change to a user's document invalidates the cached responses built from it.
+    user_store.subscribe(lambda user_id, user: response_cache.bump(user_id))
+    user_store.subscribe(platform_stats.apply)
+    user_store.subscribe(friend_graph.on_user_changed)
+    if not user_store.start():
+        logger.warning("User store unavailable, reads will go to Firestore directly")
+    else:
+        everyone = lambda: user_store.all(surveyed_only=False)
+        platform_stats.rebuild(everyone())
+        friend_graph.rebuild(everyone())
+        platform_stats.start_schedule(
+            everyone,
+            checkpoint_interval=float(os.getenv("PLATFORM_STATS_CHECKPOINT_INTERVAL", "60")),
+            reconcile_interval=float(os.getenv("PLATFORM_STATS_RECONCILE_INTERVAL", "3600"))
+        )
+    # Pending friend requests from every worker: a listener, or a one-off read if it cannot start.
+    exclusions.subscribe(lambda from_user, to_user: response_cache.bump(from_user, to_user))
+    if not exclusions.start(db):
+        logger.warning("Friend request listener unavailable, loading pending requests once")
+        exclusions.rebuild(get_pending_request_pairs())
+    # Only the worker that owns the replica sets REPLICA_SYNC_INTERVAL; the rest just read it.
+    if replica is not None and os.getenv("REPLICA_SYNC_INTERVAL"):
+        replica.start_schedule(float(os.environ["REPLICA_SYNC_INTERVAL"]))
+    # Only the worker that owns the schedule sets MATCH_TABLE_INTERVAL.
+    if match_table and os.getenv("MATCH_TABLE_INTERVAL"):
+        match_table.start_schedule(float(os.environ["MATCH_TABLE_INTERVAL"]))
+
+@app.on_event("shutdown")
+def stop_user_store():
+    user_store.stop()
+    exclusions.stop()
+    reindex_queue.stop()
+    platform_stats.stop_schedule()
+    if replica is not None:
+        replica.stop_schedule()
+    platform_stats.checkpoint()
+    if match_table:
+        match_table.stop_schedule()
+    if matching_agent.scorer is not None:
+        matching_agent.scorer.close()
+    shutdown_firestore_io()
+
 # Request models.
 # Model for updating user's sports preferences
 class SportsUpdateRequest(BaseModel):
@@ -73,6 +284,12 @@ class MatchFilters(BaseModel):
     sports: Optional[List[str]] = None  # Sports to match. 
     min_compatibility: Optional[float] = 0.0  # Minimum score threshold.
     
+# Model for scoring many users in one call (POST /matches/batch)
+class BatchMatchRequest(BaseModel):
+    user_ids: List[str]
+    limit: int = Field(default=5, ge=1, le=20)
+    min_score: float = Field(default=0.0, ge=0.0, le=100.0)
+
 # Standard API response format
 class ApiResponse(BaseModel):
     status: str  # "success" or "error"
@@ -82,11 +299,14 @@ class ApiResponse(BaseModel):
 
 # User Management Endpoints. 
 @app.get("/users/{user_id}", response_model=User)
-async def get_user(user_id: str):
+async def get_user(user_id: str, request: Request, loader: UserLoader = Depends(get_user_loader)):
     try:
         logger.info(f"Fetching user data for user_id: {user_id}")
+        cached = await response_cache.entry(request, "user", [user_id])
+        if cached.response is not None:
+            return cached.response
         # Getting the user's data. 
-        user = get_user_data(user_id)
+        user = await loader.load(user_id)
         user_name = user.fullName
         if not user:
             logger.warning(f"User {user_id} not found")
@@ -96,7 +316,7 @@ async def get_user(user_id: str):
             )
     
         logger.info(f"Successfully retrieved user profile: {user_name}")
-        return user
+        return await cached.respond(user)
     
     except HTTPException:
         raise
@@ -112,12 +332,21 @@ async def get_user(user_id: str):
 @app.get("/matches/{user_id}")
 async def get_matches(
     user_id: str,
+    request: Request,
     limit: int = Query(default=5, ge=1, le=20),
-    min_score: float = Query(default=0.0, ge=0.0, le=100.0)
+    min_score: float = Query(default=0.0, ge=0.0, le=100.0),
+    loader: UserLoader = Depends(get_user_loader)
 ):
     try:
+        # An unchanged profile answers from the cache (or 304) without scoring.
+        # Other users' profiles feed the result too: the index version covers them.
+        cached = await response_cache.entry(request, "matches", [user_id], limit=limit, min_score=min_score,
+                                            index=matching_agent.data_version())
+        if cached.response is not None:
+            return cached.response
+
         # Getting the test code user's name.
-        user = get_user_data(user_id);
+        user = await loader.load(user_id);
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -126,6 +355,29 @@ async def get_matches(
             
         user_name = user.fullName;
         logger.info(f"Finding matches for user_Name: {user_name}, limit: {limit}, min_score: {min_score}")
+
+        # Serve the precomputed list when it was built from the user's current profile.
+        stored = await run_blocking(match_table.lookup, user_id) if match_table else None
+        if match_table:
+            match_table_lookups["hit" if stored is not None else "miss"] += 1
+        if stored is not None:
+            # Friends and pending requests made since the row was written are dropped here; when that
+            # leaves the page short, live scoring fills it instead.
+            excluded = set(exclusions.excluded(user_id))
+            kept = [m for m in stored["matches"] if m["userId"] not in excluded]
+            TargetMatch = [m for m in kept if m["compatibilityScore"] >= min_score][:limit]
+            if TargetMatch and (len(TargetMatch) == limit or len(kept) == len(stored["matches"])):
+                return await cached.respond({
+                    "userId": user_id,
+                    "matches": TargetMatch,
+                    "total": len(TargetMatch),
+                    "criteria": {
+                        "limit": limit,
+                        "min_score": min_score
+                    },
+                    "generated_at": stored["generated_at"],
+                    "version": stored["version"]
+                })
         
         # Debug: Check if matching_agent is initialized
         if not matching_agent:
@@ -135,22 +387,18 @@ async def get_matches(
                 detail="Matching service not available"
             )
         
-        # Trying to find the matching users. 
+        # Trying to find the matching users; min_score is applied before the limit cut.
         logger.info("Calling matching_agent.find_matches...")
-        TargetMatch = matching_agent.find_matches(user_id, limit)
+        TargetMatch = await find_matches_shared(user_id, user, limit, min_score)
         logger.info(f"Raw matches returned: {len(TargetMatch) if TargetMatch else 0}")
 
-        if not TargetMatch:
+        # 404 only when there is nobody to match at all; everyone falling below min_score is an empty 200.
+        if not TargetMatch and (min_score <= 0 or not await find_matches_shared(user_id, user, 1)):
             logger.warning(f"No matches found for user {user_id}")
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="No compatible matches found."
             )
-                
-        if min_score > 0:
-            original_count = len(TargetMatch)
-            TargetMatch = [m for m in TargetMatch if m["compatibilityScore"] >= min_score]
-            logger.info(f"Filtered matches from {original_count} to {len(TargetMatch)} based on min_score")
         
         logger.info(f"Successfully found {len(TargetMatch)} matches for user {user_id}")
         
@@ -165,7 +413,7 @@ async def get_matches(
             "generated_at": datetime.utcnow().isoformat()
         }
         
-        return response
+        return await cached.respond(response)
         
     except HTTPException:
         raise
@@ -182,12 +430,13 @@ async def get_matches(
 async def get_advanced_matches(
     user_id: str,
     filters: MatchFilters,
-    limit: int = Query(default=5, ge=1, le=20)
+    limit: int = Query(default=5, ge=1, le=20),
+    loader: UserLoader = Depends(get_user_loader)
 ):
     try:
         logger.info("Advanced Matching Algorithm has been activated.")
         # Getting the test code user's name.
-        user = get_user_data(user_id);
+        user = await loader.load(user_id);
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -196,21 +445,19 @@ async def get_advanced_matches(
             
         user_name = user.fullName;
         logger.info(f"Finding matches for user_Name: {user_name}");
-        # Basic implementation - can be enhanced with filtering logic
-        matches = matching_agent.find_matches(user_id, limit)
-        
-        # Apply filters (basic implementation)
-        filtered_matches = []
-        for match in matches:
-            if match["compatibilityScore"] >= (filters.min_compatibility * 100):
-                filtered_matches.append(match)
+        # Filters are resolved against the posting lists before scoring, so limit holds after filtering.
+        filtered_matches = await find_matches_shared(
+            user_id, user, limit, min_score=(filters.min_compatibility or 0.0) * 100, filters=filters.dict()
+        )
         
         return {
             "userId": user_id,
-            "matches": filtered_matches[:limit],
+            "matches": filtered_matches,
             "filters_applied": filters.dict(),
             "total": len(filtered_matches)
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in advanced matching for {user_id}: {str(e)}")
         logger.error(f"Traceback: {traceback.format_exc()}")
@@ -219,12 +466,93 @@ async def get_advanced_matches(
             detail="Failed to generate advanced matches"
         )
 
+# Batch limits: ids per request, and CPU seconds of scoring before the stream is cut short.
+MATCH_BATCH_MAX_USERS = int(os.getenv("MATCH_BATCH_MAX_USERS", "1000"))
+MATCH_BATCH_CPU_SECONDS = float(os.getenv("MATCH_BATCH_CPU_SECONDS", "10"))
+MATCH_BATCH_BLOCK_SIZE = int(os.getenv("MATCH_BATCH_BLOCK_SIZE", "64"))
+
+# Top matches for many users in one call, streamed as one JSON line per user as each block is scored.
+# The last line is a summary; when the CPU budget ran out it lists the ids that were not scored.
+@app.post("/matches/batch")
+async def get_batch_matches(body: BatchMatchRequest):
+    user_ids = list(dict.fromkeys(body.user_ids))
+    if not user_ids:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="user_ids cannot be empty"
+        )
+    if len(user_ids) > MATCH_BATCH_MAX_USERS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MATCH_BATCH_MAX_USERS} user ids per batch"
+        )
+    if scoring_limiter.saturated():
+        raise Overloaded(scoring_limiter.name, scoring_limiter.retry_after)
+    logger.info(f"Batch matching {len(user_ids)} users, limit: {body.limit}, min_score: {body.min_score}")
+    results = matching_agent.iter_batch_matches(
+        user_ids, body.limit, min_score=body.min_score,
+        block_size=MATCH_BATCH_BLOCK_SIZE, cpu_budget=MATCH_BATCH_CPU_SECONDS
+    )
+
+    # Each step of the generator (one scored block) runs on the IO pool, off the event loop.
+    async def lines():
+        try:
+            while True:
+                result = await scoring_limiter.run(next, results, None)
+                if result is None:
+                    break
+                yield json.dumps(result, default=str) + "\n"
+        except Overloaded as e:
+            logger.warning("Batch matching cut short: scoring is saturated")
+            yield json.dumps({"error": e.detail, "retry_after": scoring_limiter.retry_after}) + "\n"
+        except Exception as e:
+            logger.error(f"Batch matching failed: {str(e)}")
+            logger.error(f"Traceback: {traceback.format_exc()}")
+            yield json.dumps({"error": "Failed to generate batch matches"}) + "\n"
+        finally:
+            try:
+                results.close()
+            except ValueError:
+                pass  # client went away while a block was still being scored; it finishes and is dropped
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+# Recompute the materialized match table on demand (changed users only unless full=true).
+@app.post("/matches/recompute")
+def recompute_match_table(full: bool = Query(default=False)):
+    if not match_table:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Match table is not enabled"
+        )
+    try:
+        return {
+            "status": "success",
+            "run": match_table.run(full=full)
+        }
+    except Exception as e:
+        logger.error(f"Match table recompute failed: {str(e)}")
+        logger.error(f"Traceback: {traceback.format_exc()}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to recompute match table"
+        )
+
 # Get detailed explanation of why two users match. 
 @app.get("/matches/{user_id}/explain/{target_user_id}")
-async def explain_match(user_id: str, target_user_id: str):
+async def explain_match(user_id: str, target_user_id: str, request: Request,
+                        loader: UserLoader = Depends(get_user_loader)):
     try:
         logger.info(f"Explaining match between {user_id} and {target_user_id}")
-        explanation = matching_agent.get_match_explanation(user_id, target_user_id)
+        cached = await response_cache.entry(request, "explain", [user_id, target_user_id],
+                                            index=matching_agent.data_version())
+        if cached.response is not None:
+            return cached.response
+        # Both profiles in one batched read.
+        users = await loader.load_many([user_id, target_user_id])
+        explanation = await run_scoring(
+            matching_agent.get_match_explanation, user_id, target_user_id, users[user_id], users[target_user_id]
+        )
         
         if "error" in explanation:
             raise HTTPException(
@@ -234,12 +562,12 @@ async def explain_match(user_id: str, target_user_id: str):
         
         logger.info(f"Generated match explanation: {user_id} <-> {target_user_id}")
         
-        return {
+        return await cached.respond({
             "user1_id": user_id,
             "user2_id": target_user_id,
             "explanation": explanation,
             "generated_at": datetime.utcnow().isoformat()
-        }
+        })
         
     except HTTPException:
         raise
@@ -257,7 +585,7 @@ async def update_sports(user_id: str, request: SportsUpdateRequest):
     try:
         logger.info(f"Updating sports for user {user_id}: {request.sports}")
         # Have updated the sports preferences. 
-        success = update_user_sports(user_id, request.sports)
+        success = await update_user_sports_async(user_id, request.sports)
         if not success:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -265,8 +593,9 @@ async def update_sports(user_id: str, request: SportsUpdateRequest):
             )
         logger.info(f"Successfully updated sports for user {user_id}")
         
-        # Force refresh the vectorizer with all user data
-        matching_agent.refresh_vectorizer()
+        # Re-vectorized by the background reindex pass; the response does not wait for it.
+        reindex_queue.push(user_id)
+        response_cache.bump(user_id)
         
         return {
             "status": "success",
@@ -288,10 +617,11 @@ async def update_sports(user_id: str, request: SportsUpdateRequest):
 
 # Analytics & Statistics
 @app.get("/stats/matches/{user_id}")
-async def get_user_match_stats(user_id: str):
+async def get_user_match_stats(user_id: str, loader: UserLoader = Depends(get_user_loader)):
     try:
         logger.info(f"Getting match stats for user {user_id}")
-        matches = matching_agent.find_matches(user_id, limit=20)
+        user = await loader.load(user_id)
+        matches = await find_matches_shared(user_id, user, 20) if user else []
         
         if not matches:
             return {
@@ -321,6 +651,8 @@ async def get_user_match_stats(user_id: str):
             "generated_at": datetime.utcnow().isoformat()
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error generating stats for {user_id}: {str(e)}")
         logger.error(f"Traceback: {traceback.format_exc()}")
@@ -334,8 +666,16 @@ async def get_user_match_stats(user_id: str):
 async def get_platform_stats():
     try:
         logger.info("Getting platform statistics")
+        # Maintained incrementally once the user store is up.
+        if platform_stats.ready:
+            return platform_stats.snapshot()
+        # Before that, the last checkpoint is one read instead of a full scan.
+        checkpoint = await run_blocking(platform_stats.load_checkpoint)
+        if checkpoint:
+            return checkpoint
+
         # Getting all the users.
-        all_users = get_all_users()
+        all_users = await get_all_users_async()
         
         if not all_users:
             return {
@@ -372,6 +712,79 @@ async def get_platform_stats():
             detail="Failed to generate platform statistics"
         )
 
+# Staleness metrics for the in-memory users snapshot.
+@app.get("/stats/user-store")
+async def get_user_store_stats():
+    return {
+        "user_store": user_store.stats(),
+        "matching_index": matching_agent.index_stats(),
+        "reindex_queue": reindex_queue.stats(),
+        "user_loader": loader_stats(),
+        "response_cache": response_cache.stats(),
+        "platform_stats": platform_stats.stats(),
+        "replica": replica.stats() if replica is not None else None,
+        "friend_graph": friend_graph.stats(),
+        "exclusions": exclusions.stats(),
+        "scoring_admission": scoring_limiter.stats(),
+        "single_flight": single_flight.stats(),
+        "generated_at": datetime.utcnow().isoformat()
+    }
+
+# Force a full reload of the users snapshot.
+@app.post("/admin/user-store/resync")
+def resync_user_store():
+    if not user_store.resync():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="User store resync did not complete"
+        )
+    return {
+        "status": "success",
+        "user_store": user_store.stats(),
+        "resynced_at": datetime.utcnow().isoformat()
+    }
+
+# Served-from-table vs computed /matches responses.
+match_table_lookups = {"hit": 0, "miss": 0}
+
+# Copy cache counters into the metrics registry at scrape time.
+def _collect_cache_metrics():
+    cache = response_cache.stats()
+    loader = loader_stats()
+    lookups = {
+        "response": {"hit": cache["hits"] + cache["not_modified"], "miss": cache["misses"]},
+        "user_loader": {"hit": loader["coalesced"], "miss": loader["lookups"] - loader["coalesced"]},
+        "match_table": match_table_lookups
+    }
+    for name, counts in lookups.items():
+        for result, count in counts.items():
+            CACHE_LOOKUPS.set_total(count, cache=name, result=result)
+        total = counts["hit"] + counts["miss"]
+        if total:
+            CACHE_HIT_RATIO.set(counts["hit"] / total, cache=name)
+
+REGISTRY.add_collector(_collect_cache_metrics)
+
+def _collect_reindex_metrics():
+    MATCHING_INDEX_LAG_SECONDS.set(reindex_queue.lag_seconds())
+    MATCHING_INDEX_PENDING.set(matching_agent.index_stats()["pending_updates"])
+
+REGISTRY.add_collector(_collect_reindex_metrics)
+
+def _collect_admission_metrics():
+    admission = scoring_limiter.stats()
+    for result in ("admitted", "queued", "rejected", "timed_out"):
+        ADMISSION_DECISIONS.set_total(admission[result], limiter=scoring_limiter.name, result=result)
+    ADMISSION_ACTIVE.set(admission["active"], limiter=scoring_limiter.name)
+    SINGLE_FLIGHT_SHARED.set_total(single_flight.shared)
+
+REGISTRY.add_collector(_collect_admission_metrics)
+
+# Prometheus scrape endpoint.
+@app.get("/metrics")
+async def metrics_endpoint():
+    return Response(render_metrics(), media_type=CONTENT_TYPE)
+
 # Health check endpoint
 @app.get("/health")
 async def health_check():
@@ -381,7 +794,9 @@ async def health_check():
         return {
             "status": "healthy",
             "timestamp": datetime.utcnow().isoformat(),
-            "matching_agent_initialized": matching_agent is not None
+            "matching_agent_initialized": matching_agent is not None,
+            "user_store_ready": user_store.is_ready,
+            "matching_index_lag_seconds": reindex_queue.lag_seconds()
         }
     except Exception as e:
         logger.error(f"Health check failed: {str(e)}")
@@ -394,17 +809,16 @@ async def health_check():
 ##########################################################################################
 # Sending Friend Request Endpoints API.
 @app.post("/friend-requests/send", response_model=FriendRequestResponse)
-async def send_friend_request_endpoint(data: FriendRequest):  # Renamed to avoid conflict
+async def send_friend_request_endpoint(data: FriendRequest, loader: UserLoader = Depends(get_user_loader)):  # Renamed to avoid conflict
     try:
         from_user = data.from_user
         to_user = data.to_user
         logger.info(f"Sending friend request from {from_user} to {to_user}")
         
-        # Getting the data for the from user and to user 
-        from_user_data = get_user_data(from_user)
-        logger.info("DEBUGGING: Got the data of From User!!!")
-        to_user_data = get_user_data(to_user)
-        logger.info("DEBUGGING: Got the data of To User!!!")
+        # Getting the data for the from user and to user in one batched read
+        users = await loader.load_many([from_user, to_user])
+        from_user_data = users[from_user]
+        to_user_data = users[to_user]
         
         if not from_user_data or not to_user_data:
             raise HTTPException(
@@ -413,12 +827,14 @@ async def send_friend_request_endpoint(data: FriendRequest):  # Renamed to avoid
             )
             
         # Create request. 
-        request_id = create_friend_request(from_user, to_user)
+        request_id = await create_friend_request_async(from_user, to_user, from_user_data, to_user_data)
         logger.info("DEBUGGING: Friend Request has been made it!!!")
         if not request_id:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Failed to create friend request")
+        # Both users' cached match lists still offer each other.
+        response_cache.bump(from_user, to_user)
         
         logger.info("DEBUGGING: Has Successfully sent the friend request!!!")
         return FriendRequestResponse(
@@ -448,46 +864,16 @@ async def respond_to_request(action: FriendRequestAction):
                 detail="Invalid response type"
             )
         
-        # Update request status
+        # Status and (on accept) both friends arrays are written in one commit, no re-reads.
         new_status = "accepted" if response == "accept" else "rejected"
-        success = update_friend_request_status(request_id, new_status)
-        
-        if not success:
+        answered = await respond_to_friend_request_async(request_id, new_status)
+        if not answered:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
-                detail="Request not found or update failed"
+                detail="Request not found, already answered or update failed"
             )
-        
-        # If accepted, create friendship
-        if new_status == "accepted":
-            # Fetch the friend request document to get user IDs.
-            request_data = get_friend_request(request_id)
-            if not request_data:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="Friend request not found"
-                )
-                
-            from_user = request_data.get('from_user')
-            to_user = request_data.get('to_user')
-            
-            # Check if user IDs are present
-            if not from_user or not to_user:
-                logger.error("Friend request accepted but user IDs missing")
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="Friend request data incomplete"
-                )
-            
-            # Add friendship relationship
-            friendship_success = add_friendship(from_user, to_user)
-            logger.info("Debugging: Added the friendship.")
-            if not friendship_success:
-                logger.error(f"Failed to create friendship between {from_user} and {to_user}")
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="Failed to create friendship"
-                )
+        # A rejected pair can be matched again; an accepted one is now friends.
+        response_cache.bump(answered["from_user"], answered["to_user"])
         
         return FriendRequestResponse(
             request_id=request_id,
@@ -503,19 +889,73 @@ async def respond_to_request(action: FriendRequestAction):
             detail="Failed to process response"
         )
 
+# Most request ids answered per /friend-requests/respond/batch call, and how many run at once.
+FRIEND_REQUEST_BATCH_MAX = int(os.getenv("FRIEND_REQUEST_BATCH_MAX", "500"))
+FRIEND_REQUEST_BATCH_CONCURRENCY = int(os.getenv("FRIEND_REQUEST_BATCH_CONCURRENCY", "8"))
+
+# Answer many friend requests in one call. Every answer is its own transaction, so a bad
+# request (missing user, already answered) fails alone; they run a few at a time.
+@app.post("/friend-requests/respond/batch")
+async def respond_to_requests(body: FriendRequestBatchAction):
+    actions = {action.request_id: action.response for action in body.actions}
+    if not actions:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="actions cannot be empty"
+        )
+    if len(actions) > FRIEND_REQUEST_BATCH_MAX:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {FRIEND_REQUEST_BATCH_MAX} requests per batch"
+        )
+    if any(response not in ["accept", "reject"] for response in actions.values()):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid response type"
+        )
+    logger.info(f"Responding to {len(actions)} friend requests")
+    slots = asyncio.Semaphore(FRIEND_REQUEST_BATCH_CONCURRENCY)
+
+    async def answer(request_id: str, response: str):
+        async with slots:
+            return await respond_to_friend_request_async(
+                request_id, "accepted" if response == "accept" else "rejected"
+            )
+
+    outcomes = await asyncio.gather(*[answer(request_id, response) for request_id, response in actions.items()])
+    answered = {request_id: outcome for request_id, outcome in zip(actions, outcomes) if outcome}
+    results = []
+    for request_id in actions:
+        if request_id in answered:
+            new_status = answered[request_id]["status"]
+            response_cache.bump(answered[request_id]["from_user"], answered[request_id]["to_user"])
+            results.append(FriendRequestResponse(
+                request_id=request_id, status=new_status, message=f"Friend request {new_status}"
+            ))
+        else:
+            results.append(FriendRequestResponse(
+                request_id=request_id, status="failed",
+                message="Request not found, already answered or update failed"
+            ))
+    return {
+        "results": results,
+        "answered": len(answered),
+        "failed": len(actions) - len(answered)
+    }
+
 # Showing the pending friend requests that have been sent. 
 @app.get("/friend-requests/pending/{user_id}")
-async def get_pending_requests_endpoint(user_id: str):  # Renamed to avoid conflict
+async def get_pending_requests_endpoint(user_id: str, loader: UserLoader = Depends(get_user_loader)):  # Renamed to avoid conflict
     try:
         logger.info(f"Fetching pending requests for {user_id}")
         # Getting all the pending requests the current user got. 
-        requests = get_pending_requests(user_id)
+        requests = await get_pending_requests_async(user_id)
         
-        # Enrich each request with sender name.
+        # Enrich each request with sender name; every sender is fetched in one batch.
+        senders = await loader.load_many(list({r.get("from_user") for r in requests if r.get("from_user")}))
         enriched_requests = []
         for r in requests:
-            from_user_id = r.get("from_user")
-            sender = get_user_data(from_user_id)
+            sender = senders.get(r.get("from_user"))
             r["from_user_name"] = sender.fullName if sender else "Unknown"
             enriched_requests.append(r)
         
@@ -534,29 +974,107 @@ async def get_pending_requests_endpoint(user_id: str):  # Renamed to avoid confl
 
 # Would change it to DELETE method later. 
 @app.post("/friends/remove")
-def remove_friend(user1_id: str, user2_id: str):
-    success = remove_friends_from_lists(user1_id, user2_id)
+async def remove_friend(user1_id: str, user2_id: str):
+    success = await remove_friends_from_lists_async(user1_id, user2_id)
     if success:
+        response_cache.bump(user1_id, user2_id)
         return {"message": f"Friendship removed between {user1_id} and {user2_id}"}
     else:
         raise HTTPException(status_code=500, detail="Failed to remove friendship")
 
 # Showing the list of friends. 
 @app.get("/friends/{user_id}")
-async def get_friends_list_endpoint(user_id: str):
+async def get_friends_list_endpoint(
+    user_id: str,
+    cursor: Optional[str] = None,
+    limit: int = Query(default=50, ge=1, le=200)
+):
     try:
         logger.info(f"Fetching friends list for {user_id}")
-        # Getting all the friends that requests have been accepted. 
-        friends = get_friends_list(user_id)
+        # Getting one page of the friends whose requests have been accepted. 
+        page = await get_friends_page_async(user_id, cursor, limit)
+        if page is None:
+            page = {"friends": [], "total": 0, "next_cursor": None}
         return {
             "user_id": user_id,
-            "friends": friends,
-            "count": len(friends),
+            "friends": page["friends"],
+            "count": len(page["friends"]),
+            "total": page["total"],
+            "next_cursor": page["next_cursor"],
             "retrieved_at": datetime.utcnow().isoformat()
         }
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     except Exception as e:
         logger.error(f"Error fetching friends list: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to get friends list"
-        )
\ No newline at end of file
+        )
+
+# Friend-of-friend candidates examined per suggestions request (most mutual friends first).
+FRIEND_SUGGESTION_POOL = int(os.getenv("FRIEND_SUGGESTION_POOL", "500"))
+
+# People you may know: friends of friends ranked by mutual friends blended with match compatibility.
+@app.get("/friends/{user_id}/suggestions")
+async def get_friend_suggestions(
+    user_id: str,
+    limit: int = Query(default=10, ge=1, le=50),
+    mutual_weight: float = Query(default=0.5, ge=0.0, le=1.0),
+    loader: UserLoader = Depends(get_user_loader)
+):
+    if not friend_graph.ready:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Friend graph is not loaded"
+        )
+    try:
+        user = await loader.load(user_id)
+        if not user:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="User not found"
+            )
+        # Mutual-friend counts come from the in-memory graph, minus pending requests and blocks; no documents are read.
+        candidates, mutual = exclusions.friends_of_friends(user_id)
+        candidates, mutual = candidates[:FRIEND_SUGGESTION_POOL], mutual[:FRIEND_SUGGESTION_POOL]
+        compatibility = await run_scoring(matching_agent.compatibility_scores, user_id, user, candidates)
+
+        ranked = []
+        top_mutual = int(mutual[0]) if len(mutual) else 1
+        for candidate, count in zip(candidates, mutual.tolist()):
+            compat = compatibility.get(candidate)
+            # Candidates without a survey have no compatibility yet and count as neutral.
+            score = mutual_weight * count / top_mutual + (1 - mutual_weight) * (0.5 if compat is None else compat)
+            ranked.append((score, count, candidate, compat))
+        ranked.sort(key=lambda r: (-r[0], -r[1], r[2]))
+        ranked = ranked[:limit]
+
+        profiles = await loader.load_many([candidate for _, _, candidate, _ in ranked])
+        suggestions = [
+            {
+                "userId": candidate,
+                "fullName": profiles[candidate].fullName if profiles.get(candidate) else None,
+                "mutualFriends": count,
+                "compatibilityScore": round(compat * 100, 1) if compat is not None else None,
+                "score": round(score * 100, 1)
+            }
+            for score, count, candidate, compat in ranked
+        ]
+        return {
+            "userId": user_id,
+            "suggestions": suggestions,
+            "total": len(suggestions),
+            "candidates_considered": len(candidates),
+            "mutual_weight": mutual_weight,
+            "generated_at": datetime.utcnow().isoformat()
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error building friend suggestions for {user_id}: {str(e)}")
+        logger.error(f"Traceback: {traceback.format_exc()}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to get friend suggestions"
+        )
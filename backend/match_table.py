@@ -0,0 +1,274 @@
+# Materialized per-user top-K match lists.
+# MatchTableJob scores every surveyed user against the feature matrix in blocks
+# and writes each user's top-K to a sink (the Firestore `matches` collection, a
+# local JSONL file or a SQLite database). Each row records the feature
+# fingerprint it was computed from, so incremental runs only recompute users
+# whose profile changed since the last run.
+from firebase_utils import db, get_all_user_records
+from typing import Dict, Optional
+from datetime import datetime
+import numpy as np
+import threading
+import argparse
+import sqlite3
+import json
+import time
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+class FirestoreMatchSink:
+    """One document per user in the `matches` collection"""
+
+    def __init__(self, collection: str = "matches", batch_size: int = 400):
+        self.collection = collection
+        self.batch_size = batch_size  # Firestore caps a batch at 500 writes
+
+    def write(self, rows: Dict[str, Dict]):
+        items = list(rows.items())
+        for start in range(0, len(items), self.batch_size):
+            batch = db.batch()
+            for user_id, row in items[start:start + self.batch_size]:
+                batch.set(db.collection(self.collection).document(user_id), row)
+            batch.commit()
+
+    def read(self, user_id: str) -> Optional[Dict]:
+        doc = db.collection(self.collection).document(user_id).get()
+        return doc.to_dict() if doc.exists else None
+
+    def fingerprints(self) -> Dict[str, int]:
+        docs = db.collection(self.collection).select(["fingerprint"]).stream()
+        return {doc.id: doc.to_dict().get("fingerprint") for doc in docs}
+
+class JsonlMatchSink:
+    """Append-only JSON lines file; the last line for a user wins, compacted once most lines are superseded"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._rows: Dict[str, Dict] = {}
+        self._lines = 0
+        self.compactions = 0
+        self._loaded_mtime: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        mtime = self._mtime()
+        if mtime is None or mtime == self._loaded_mtime:
+            return
+        rows, lines = {}, 0
+        with open(self.path) as f:
+            for line in f:
+                if line.strip():
+                    row = json.loads(line)
+                    rows[row["userId"]] = row
+                    lines += 1
+        self._rows, self._lines, self._loaded_mtime = rows, lines, mtime
+
+    def _mtime(self) -> Optional[float]:
+        try:
+            return os.path.getmtime(self.path)
+        except FileNotFoundError:
+            return None
+
+    # Rewrite just the live rows and swap the file in atomically, so readers never see half of it.
+    def _compact(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            for row in self._rows.values():
+                f.write(json.dumps(row) + "\n")
+        os.replace(tmp_path, self.path)
+        self.compactions += 1
+        self._lines = len(self._rows)
+        self._loaded_mtime = self._mtime()
+
+    # Our own appends are applied in memory; the file is only re-read after someone else wrote it.
+    def write(self, rows: Dict[str, Dict]):
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._refresh()
+            with open(self.path, "a") as f:
+                for row in rows.values():
+                    f.write(json.dumps(row) + "\n")
+            for user_id, row in rows.items():
+                self._rows[user_id] = row
+            self._lines += len(rows)
+            self._loaded_mtime = self._mtime()
+            if self._lines > 2 * len(self._rows):
+                self._compact()
+
+    def read(self, user_id: str) -> Optional[Dict]:
+        with self._lock:
+            self._refresh()
+            return self._rows.get(user_id)
+
+    def fingerprints(self) -> Dict[str, int]:
+        with self._lock:
+            self._refresh()
+            return {uid: row.get("fingerprint") for uid, row in self._rows.items()}
+
+class SqliteMatchSink:
+    """Local SQLite table keyed by user id"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS matches ("
+                "user_id TEXT PRIMARY KEY, generated_at TEXT, version TEXT, fingerprint INTEGER, payload TEXT)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def write(self, rows: Dict[str, Dict]):
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO matches VALUES (?, ?, ?, ?, ?)",
+                [(uid, row["generated_at"], row["version"], row["fingerprint"], json.dumps(row))
+                 for uid, row in rows.items()]
+            )
+
+    def read(self, user_id: str) -> Optional[Dict]:
+        with self._connect() as conn:
+            found = conn.execute("SELECT payload FROM matches WHERE user_id = ?", (user_id,)).fetchone()
+        return json.loads(found[0]) if found else None
+
+    def fingerprints(self) -> Dict[str, int]:
+        with self._connect() as conn:
+            return dict(conn.execute("SELECT user_id, fingerprint FROM matches"))
+
+# "firestore", "jsonl:/path/matches.jsonl" or "sqlite:/path/matches.db"
+def make_sink(spec: str):
+    kind, _, path = spec.partition(":")
+    if kind == "firestore":
+        return FirestoreMatchSink(path or "matches")
+    if kind == "jsonl":
+        return JsonlMatchSink(path or "matches.jsonl")
+    if kind == "sqlite":
+        return SqliteMatchSink(path or "matches.db")
+    raise ValueError(f"Unknown match table sink: {spec}")
+
+class MatchTableJob:
+    def __init__(self, agent, sink, k: int = 20, block_size: int = 64):
+        self.agent = agent
+        self.sink = sink
+        self.k = k  # the largest limit /matches/{user_id} accepts
+        self.block_size = block_size  # users scored per matrix product; bounds memory at block_size x n
+        self._fingerprints: Optional[Dict[str, int]] = None
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        self.last_run: Optional[Dict] = None
+
+    def _recorded(self) -> Dict[str, int]:
+        if self._fingerprints is None:
+            self._fingerprints = self.sink.fingerprints()
+        return self._fingerprints
+
+    # Recompute changed users (or everyone with full=True) and write their rows.
+    def run(self, full: bool = False) -> Dict:
+        with self._lock:
+            started = time.perf_counter()
+            features = self.agent.ensure_index()
+            if features is None:
+                return {"recomputed": 0}
+            recorded = self._recorded()
+            targets = [
+                (uid, row) for uid, row in features.index.items()
+                if full or recorded.get(uid) != features.fingerprint(row)
+            ]
+            users = get_all_user_records()
+            version = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+            generated_at = datetime.utcnow().isoformat()
+
+            # Candidate columns are sharded across the scoring processes when the agent has a pool.
+            scorer = self.agent.scorer
+            top_k_block = features.top_k_block
+            if scorer is not None and scorer.should_shard(len(features.user_ids), features):
+                top_k_block = lambda rows, weights, k, exclude: scorer.top_k_block(features, rows, weights, k, exclude)
+
+            written = 0
+            for start in range(0, len(targets), self.block_size):
+                block = targets[start:start + self.block_size]
+                rows = np.array([row for _, row in block])
+                exclude = [self.agent.excluded_rows(features, uid) for uid, _ in block]
+                ranked = top_k_block(rows, self.agent.weights, self.k, exclude)
+                table_rows = {}
+                for (uid, row), (cols, scores, components) in zip(block, ranked):
+                    matches = []
+                    for pos, col in enumerate(cols):
+                        match_uid = features.user_ids[col]
+                        if match_uid in users:
+                            matches.append(self.agent.match_data(match_uid, users[match_uid], scores, components, pos))
+                    table_rows[uid] = {
+                        "userId": uid,
+                        "matches": matches,
+                        "k": self.k,
+                        "fingerprint": features.fingerprint(row),
+                        "version": version,
+                        "generated_at": generated_at
+                    }
+                self.sink.write(table_rows)
+                recorded.update({uid: r["fingerprint"] for uid, r in table_rows.items()})
+                written += len(table_rows)
+
+            self.last_run = {
+                "full": full,
+                "recomputed": written,
+                "skipped": len(features) - written,
+                "version": version,
+                "generated_at": generated_at,
+                "seconds": round(time.perf_counter() - started, 3)
+            }
+            logger.info(f"Match table run: {self.last_run}")
+            return self.last_run
+
+    def is_current(self, user_id: str, row: Dict) -> bool:
+        """True when a stored row was computed from the user's current profile"""
+        features = self.agent.features
+        if features is None or self.agent.is_dirty(user_id):
+            return False
+        index_row = features.index.get(user_id)
+        return index_row is not None and row.get("fingerprint") == features.fingerprint(index_row)
+
+    # Stored row for the user, or None when missing or computed from an older profile.
+    def lookup(self, user_id: str) -> Optional[Dict]:
+        try:
+            row = self.sink.read(user_id)
+        except Exception as e:
+            logger.error(f"Match table read failed for {user_id}: {e}")
+            return None
+        return row if row is not None and self.is_current(user_id, row) else None
+
+    # Incremental run every `interval` seconds, full run every `full_every` runs.
+    def start_schedule(self, interval: float, full_every: int = 24):
+        self._schedule(interval, full_every, 0)
+
+    def _schedule(self, interval: float, full_every: int, count: int):
+        def tick():
+            try:
+                self.run(full=full_every > 0 and count % full_every == 0)
+            except Exception as e:
+                logger.error(f"Scheduled match table run failed: {e}")
+            self._schedule(interval, full_every, count + 1)
+
+        self._timer = threading.Timer(interval, tick)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def stop_schedule(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recompute the materialized match table")
+    parser.add_argument("command", choices=["run"])
+    parser.add_argument("--sink", default=os.getenv("MATCH_TABLE", "firestore"))
+    parser.add_argument("--full", action="store_true")
+    parser.add_argument("--k", type=int, default=20)
+    args = parser.parse_args()
+
+    from matching_agent import MatchingAgent
+    agent = MatchingAgent(artifact_dir=os.getenv("MATCHING_ARTIFACT_DIR"))
+    print(MatchTableJob(agent, make_sink(args.sink), k=args.k).run(full=args.full))
@@ -1,36 +1,112 @@
-from models import User
-from firebase_utils import get_user_data, get_all_users  # Move imports to top
-from sklearn.feature_extraction.text import TfidfVectorizer
+from models import User, UserRecord, as_record
+from firebase_utils import get_user_data, get_all_user_records, batch_get_user_records  # Move imports to top
+from feature_store import FeatureStore, breakdown_at, feature_fingerprint
+from model_artifact import current_version, load_artifact
+from candidate_retrieval import IVFRetriever
+from parallel_scoring import ShardedScorer
+from exclusions import ExclusionIndex
+from metrics import MATCHING_STAGE_SECONDS
+from profiling import span, trace_event
+from contextlib import contextmanager
+from sklearn.feature_extraction.text import TfidfVectorizer, HashingVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
-from typing import List, Dict, Tuple
+from typing import Iterator, List, Dict, Tuple, Optional, Union
 import numpy as np
+import threading
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
+# One matching stage: always feeds the stage histogram, and the span tree when the request is profiled.
+@contextmanager
+def _stage(name: str):
+    with MATCHING_STAGE_SECONDS.time(stage=name), span(f"matching.{name}"):
+        yield
+
 class MatchingAgent:
-    def __init__(self):
+    def __init__(self, featurizer: str = "tfidf", rebuild_interval: float = 6 * 3600, drift_threshold: float = 0.2,
+                 artifact_dir: Optional[str] = None, artifact_check_interval: float = 5.0,
+                 retriever: Optional[IVFRetriever] = None, scorer: Optional[ShardedScorer] = None,
+                 exclusions: Optional[ExclusionIndex] = None):
+        # "tfidf" keeps a fitted vocabulary/IDF; "hashing" is stateless and never needs a refit.
+        if featurizer not in ("tfidf", "hashing"):
+            raise ValueError(f"Unknown featurizer: {featurizer}")
+        self.featurizer = featurizer
         # Each user's preferences become a point in high-dimensional space.
-        self.vectorizer = TfidfVectorizer(
-            stop_words='english',
-            max_features=1000,
-            ngram_range=(1, 2)  # Include bigrams for better matching
-        )
+        self.vectorizer = self._make_vectorizer()
         self.weights = {
             'text_similarity': 0.3,
             'age_compatibility': 0.1,
             'gym_level_match': 0.3,
             'sports_overlap': 0.3
         }
+        # Columnar features for the population the vectorizer was last fitted on.
+        self.index_version = 0
+        self.features = None
+        # Full rebuilds (IDF refit) happen on a schedule or once enough rows changed.
+        self.rebuild_interval = rebuild_interval
+        self.drift_threshold = drift_threshold
+        self.fitted_at: Optional[float] = None
+        self.rows_changed = 0
+        self._dirty = set()
+        self._dirty_lock = threading.Lock()  # mark_dirty never waits for a reindex pass holding _lock
+        self._marks = 0
+        # Set while a ReindexQueue applies edits in the background; requests then serve the index as is
+        # and hand rebuilds and artifact swaps to `reindex` (the queue) instead of running them.
+        self.defer_dirty = False
+        self.reindex = None
+        self._lock = threading.RLock()
+        # Shared on-disk model written by `model_artifact.py build`; refits are the build step's job.
+        self.artifact_dir = artifact_dir
+        self.artifact_check_interval = artifact_check_interval
+        self.artifact_version: Optional[str] = None
+        self._artifact_checked_at = 0.0
+        # Optional ANN stage: only its candidates get the full weighted rerank.
+        self.retriever = retriever
+        # Optional process pool: large candidate sets are scored shard by shard on several cores.
+        self.scorer = scorer
+        # Optional friends / pending requests / blocks that are masked out before the top-k cut.
+        self.exclusions = exclusions
+
+    # Every swap of the feature store (refit, artifact load, reindex pass) is a new index version.
+    @property
+    def features(self) -> Optional[FeatureStore]:
+        return self._features
+
+    @features.setter
+    def features(self, features: Optional[FeatureStore]):
+        self._features = features
+        self.index_version += 1
+
+    # Changes whenever results for any user may change: a new index, or an edit queued for one.
+    def data_version(self) -> str:
+        return f"{self.index_version}.{self._marks}"
+
+    def _make_vectorizer(self):
+        if self.featurizer == "hashing":
+            return HashingVectorizer(
+                stop_words='english',
+                ngram_range=(1, 2),
+                n_features=2 ** 12,
+                alternate_sign=False,
+                norm='l2'
+            )
+        return TfidfVectorizer(
+            stop_words='english',
+            max_features=1000,
+            ngram_range=(1, 2)  # Include bigrams for better matching
+        )
     
     # Data Preprocessing
-    def _create_feature_text(self, user: User) -> str:
+    def _create_feature_text(self, user: Union[User, UserRecord]) -> str:
         """Combine user attributes for vectorization"""
+        record = as_record(user)
         # Combines attributes into a single text blob
-        sports_text = ' '.join(user.sports) if user.sports else 'general'
+        sports_text = ' '.join(record.sports) if record.sports else 'general'
         
         # Enables NLP processing of structured data
-        return f"{user.preferences.gymLevel} {user.preferences.workoutGoal} {sports_text} {user.preferences.age}"
+        return f"{record.gymLevel} {record.workoutGoal} {sports_text} {record.age}"
 
     # helper for better recommendations by calculating the each survery results.
     def _calculate_age_compatibility(self, user1: User, user2: User) -> float:
@@ -63,12 +139,17 @@ class MatchingAgent:
         except (ValueError, AttributeError):
             return 0.5
 
-    def _calculate_sports_overlap(self, user1: User, user2: User) -> float:
+    def _calculate_sports_overlap(self, user1: User, user2: User,
+                                  user_ids: Optional[Tuple[str, str]] = None) -> float:
         """Calculate sports interest overlap"""
         sports1 = set(sport.lower() for sport in user1.sports) if user1.sports else set()
         sports2 = set(sport.lower() for sport in user2.sports) if user2.sports else set()
         
-        logger.info(f"Comparing sports between {user1.email} and {user2.email}")
+        # Per-pair, so only recorded when a profile or DEBUG logging asks for it.
+        # Ids, never emails: profiles are returned to the caller, who may not own either user.
+        user1_id, user2_id = user_ids or (None, None)
+        logger.debug("Comparing sports between %s and %s", user1_id, user2_id)
+        trace_event("sports_overlap", user1=user1_id, user2=user2_id)
 
         if not sports1 and not sports2:
             return 0.5  # Both have no specific sports
@@ -78,7 +159,8 @@ class MatchingAgent:
         
         return len(intersection) / len(union) if union else 0
     # Core AI Engine. 
-    def calculate_compatibility(self, user1: User, user2: User) -> Tuple[float, Dict[str, float]]:
+    def calculate_compatibility(self, user1: User, user2: User,
+                                user_ids: Optional[Tuple[str, str]] = None) -> Tuple[float, Dict[str, float]]:
         try:
             # Convert user profiles → TF-IDF vectors. 
             texts = [self._create_feature_text(user1), self._create_feature_text(user2)]
@@ -88,7 +170,7 @@ class MatchingAgent:
             # Individual compatibility scores (Calculate domain-specific scores)
             age_compat = self._calculate_age_compatibility(user1, user2)
             gym_match = self._calculate_gym_level_match(user1, user2)
-            sports_overlap = self._calculate_sports_overlap(user1, user2)
+            sports_overlap = self._calculate_sports_overlap(user1, user2, user_ids)
             
             # Fuse scores with custom weights
             total_score = (
@@ -113,69 +195,343 @@ class MatchingAgent:
             return 0.0, {}
     
     # Recommendation Engine. 
-    def find_matches(self, current_user_id: str, limit: int = 5) -> List[Dict]:
+    def find_matches(self, current_user_id: str, limit: int = 5, filters: Optional[Dict] = None,
+                     min_score: float = 0.0, current_user: Optional[User] = None) -> List[Dict]:
+        """Top `limit` matches; `filters` (MatchFilters fields) and `min_score` apply before the cut"""
         try:
-            # First getting the current user's data. 
-            current_user = get_user_data(current_user_id)
+            # First getting the current user's data (unless the caller already loaded it).
+            if current_user is None:
+                current_user = get_user_data(current_user_id)
             if not current_user or not current_user.surveyCompleted:
                 logger.warning(f"User {current_user_id} not found or survey incomplete")
                 return []
 
-            # Fetching all users except the current user.
-            all_users = get_all_users(exclude=[current_user_id])
-            if not all_users:
+            features, rows, scores, components, winners = self._rank(
+                current_user_id, current_user, limit, self.retriever, filters, min_score
+            )
+            if not winners:
                 logger.info("No other users available for matching")
                 return []
 
-            # ✅ Refit TF-IDF vectorizer with all user texts
-            all_texts = [self._create_feature_text(current_user)] + [
-                self._create_feature_text(user) for user in all_users.values()
-            ]
-            self.vectorizer.fit(all_texts)
-
+            # Only the winners get a result dict.
             matches = []
+            winner_rows = [pos if rows is None else rows[pos] for pos in winners]
+            with _stage("load_users"):
+                users = batch_get_user_records([features.user_ids[row] for row in winner_rows])
+            for pos, row in zip(winners, winner_rows):
+                uid = features.user_ids[row]
+                user = users.get(uid)
+                if user is None:
+                    continue
+                matches.append(self.match_data(uid, user, scores, components, pos))
 
-            for uid, user in all_users.items():
-                compatibility_score, breakdown = self.calculate_compatibility(current_user, user)
-
-                match_data = {
-                    "userId": uid,
-                    "name": user.fullName,
-                    "email": user.email,
-                    "sports": user.sports,
-                    "gymLevel": user.preferences.gymLevel,
-                    "workoutGoal": user.preferences.workoutGoal,
-                    "compatibilityScore": round(compatibility_score * 100, 1),
-                    "scoreBreakdown": breakdown
-                }
-                matches.append(match_data)
-
-            sorted_matches = sorted(matches, key=lambda x: x["compatibilityScore"], reverse=True)
-            logger.info(f"Found {len(sorted_matches)} potential matches for user {current_user_id}")
-            return sorted_matches[:limit]
+            return matches
 
         except Exception as e:
             logger.error(f"Error finding matches for user {current_user_id}: {e}")
             return []
     
+    # Result dict for one winner; `pos` indexes the score and component arrays.
+    def match_data(self, uid: str, user: UserRecord, scores: np.ndarray, components: Dict[str, np.ndarray], pos) -> Dict:
+        return {
+            "userId": uid,
+            "name": user.name,
+            "email": user.email,
+            "sports": user.sports,
+            "gymLevel": user.gymLevel,
+            "workoutGoal": user.workoutGoal,
+            "compatibilityScore": round(float(scores[pos]) * 100, 1),
+            "scoreBreakdown": breakdown_at(components, pos)
+        }
+
+    # Candidate retrieval + weighted scoring + top-k; positions in `winners` index `scores`.
+    def _rank(self, current_user_id: str, current_user: Union[User, UserRecord], limit: int, retriever: Optional[IVFRetriever],
+              filters: Optional[Dict] = None, min_score: float = 0.0):
+        # Reuse the fitted index; only edited profiles are re-vectorized.
+        features = self.ensure_index()
+        if features is None or len(features) == 0:
+            return features, None, np.zeros(0), {}, []
+
+        # Filters resolve to a row set from posting lists before anything is scored.
+        filtered = None
+        if filters:
+            filtered = features.filter_rows(
+                min_age=filters.get("min_age"),
+                max_age=filters.get("max_age"),
+                gym_levels=filters.get("gym_levels"),
+                sports=filters.get("sports")
+            )
+            if filtered is not None and len(filtered) == 0:
+                return features, filtered, np.zeros(0), {}, []
+
+        current_user = as_record(current_user, current_user_id)
+        query = features.encode(current_user, self.vectorizer, self._create_feature_text)
+        rows = filtered
+        if retriever is not None and (filtered is None or len(filtered) > retriever.n_candidates):
+            with _stage("retrieve"):
+                candidates = retriever.candidates(features, query, self._create_feature_text(current_user))
+            if candidates is not None:
+                if filtered is not None:
+                    candidates = np.intersect1d(candidates, filtered)
+                # Too few survivors after filtering: score the filtered set exactly instead.
+                if filtered is None or len(candidates) >= limit:
+                    rows = candidates
+        exclude = self.excluded_rows(features, current_user_id)
+        # Counted here: on the sharded path only the winners come back.
+        scored = len(features.user_ids) if rows is None else len(rows)
+        logger.info(f"Scoring {scored} potential matches for user {current_user_id}")
+        if self.scorer is not None and self.scorer.should_shard(scored, features):
+            # Workers return only their shard's winners; the merged result is already top-k, best first.
+            with _stage("score"):
+                rows, scores, components = self.scorer.top_k(features, query, self.weights, limit, rows,
+                                                             exclude, min_score)
+            return features, rows, scores, components, list(range(len(rows)))
+        with _stage("score"):
+            scores, components = features.score(query, self.weights, rows)
+        with _stage("sort"):
+            winners = features.top_k(scores, limit, exclude=exclude, rows=rows, min_score=min_score)
+        return features, rows, scores, components, winners
+
+    # Rows `user_id` must not be offered: their own, plus friends, pending requests and blocks.
+    def excluded_rows(self, features: FeatureStore, user_id: str) -> List[int]:
+        excluded = self.exclusions.excluded(user_id) if self.exclusions is not None else []
+        return [features.index[uid] for uid in (user_id, *excluded) if uid in features.index]
+
+    # Top matches for many users at once: each block of requested users is scored against the
+    # whole population as one matrix-matrix product (exact scoring, no retriever). Yields an error
+    # entry for each id missing from the index, then results block by block, then a summary.
+    # Stops early once `cpu_budget` seconds were spent; the budget is checked between blocks
+    # and sharded blocks are charged their wall time.
+    def iter_batch_matches(self, user_ids: List[str], limit: int = 5, min_score: float = 0.0,
+                           block_size: int = 64, cpu_budget: Optional[float] = None) -> Iterator[Dict]:
+        features = self.ensure_index()
+        known = [uid for uid in user_ids if features is not None and uid in features.index]
+        for uid in user_ids:
+            if features is None or uid not in features.index:
+                yield {"userId": uid, "error": "User not found or survey incomplete"}
+
+        spent, scored = 0.0, 0
+        for start in range(0, len(known), block_size):
+            if cpu_budget is not None and spent >= cpu_budget:
+                break
+            block = known[start:start + block_size]
+            rows = np.array([features.index[uid] for uid in block])
+            exclude = [self.excluded_rows(features, uid) for uid in block]
+            sharded = self.scorer is not None and self.scorer.should_shard(len(features.user_ids), features)
+            started = time.perf_counter() if sharded else time.thread_time()
+            with _stage("score"):
+                if sharded:
+                    ranked = self.scorer.top_k_block(features, rows, self.weights, limit, exclude)
+                else:
+                    ranked = features.top_k_block(rows, self.weights, limit, exclude)
+            spent += (time.perf_counter() if sharded else time.thread_time()) - started
+
+            with _stage("load_users"):
+                users = batch_get_user_records([features.user_ids[col] for cols, _, _ in ranked for col in cols])
+            for uid, (cols, scores, components) in zip(block, ranked):
+                matches = []
+                for pos, col in enumerate(cols):
+                    match_uid = features.user_ids[col]
+                    if match_uid in users and round(float(scores[pos]) * 100, 1) >= min_score:
+                        matches.append(self.match_data(match_uid, users[match_uid], scores, components, pos))
+                yield {"userId": uid, "matches": matches, "total": len(matches)}
+            scored += len(block)
+
+        unscored = known[scored:]
+        if unscored:
+            logger.warning(f"Batch matching stopped after {spent:.2f}s CPU with {len(unscored)} users left")
+        yield {
+            "done": True,
+            "requested": len(user_ids),
+            "scored": scored,
+            "cpu_seconds": round(spent, 3),
+            "truncated": bool(unscored),
+            "unscored": unscored
+        }
+
+    # Ranked user ids only (recall benchmarks).
+    def rank(self, current_user_id: str, current_user: User, limit: int,
+             retriever: Optional[IVFRetriever] = None) -> List[str]:
+        features, rows, _, _, winners = self._rank(current_user_id, current_user, limit, retriever)
+        return [features.user_ids[pos if rows is None else rows[pos]] for pos in winners]
+
+    # Feature text per row, for retrievers that embed profiles ("" for retired rows).
+    def row_texts(self, features: FeatureStore) -> List[str]:
+        users = batch_get_user_records(list(features.index))
+        return [
+            self._create_feature_text(users[uid]) if uid in users and features.active[row] else ""
+            for row, uid in enumerate(features.user_ids)
+        ]
+
     #Force refresh the vectorizer with current user data
     def refresh_vectorizer(self):
-        all_users = get_all_users()
-        all_texts = [self._create_feature_text(user) for user in all_users.values()]
-        self.vectorizer.fit(all_texts)
+        with self._lock:
+            # Edits that land during the scan stay queued for the next incremental pass.
+            with self._dirty_lock:
+                self._dirty.clear()
+            with _stage("load_users"):
+                all_users = get_all_user_records()
+            with _stage("fit"):
+                all_texts = [self._create_feature_text(user) for user in all_users.values()]
+                self.vectorizer.fit(all_texts)
+                self.features = FeatureStore.build(all_users, self.vectorizer, self._create_feature_text)
+            self.fitted_at = time.time()
+            self.rows_changed = 0
+            if self.retriever is not None:
+                self.retriever.centroids = None  # rows were renumbered
         logger.info("Vectorizer refreshed with latest user data")
+
+    # Queue a user whose profile changed; the row is re-vectorized on the next request.
+    def mark_dirty(self, user_id: str):
+        with self._dirty_lock:
+            self._dirty.add(user_id)
+            self._marks += 1
+
+    def is_dirty(self, user_id: str) -> bool:
+        return user_id in self._dirty
+
+    # UserStore change-feed callback.
+    def on_user_changed(self, user_id: str, user: Optional[User]):
+        self.mark_dirty(user_id)
+
+    def _needs_rebuild(self) -> bool:
+        if self.features is None or self.fitted_at is None:
+            return True
+        if self.artifact_version is not None:
+            return False
+        if time.time() - self.fitted_at >= self.rebuild_interval:
+            return True
+        # Too many rows vectorized against an IDF fitted on an older population.
+        return self.rows_changed > self.drift_threshold * max(len(self.features), 1)
+
+    def _apply_dirty(self):
+        with self._dirty_lock:
+            user_ids = list(self._dirty)
+            self._dirty.clear()
+        with _stage("load_users"):
+            changed = batch_get_user_records(user_ids)  # unsurveyed users have no record
+        removed = [uid for uid in user_ids if uid not in changed]
+        with _stage("reindex"):
+            self.features = self.features.apply_changes(changed, removed, self.vectorizer, self._create_feature_text)
+        self.rows_changed += len(user_ids)
+        logger.info(f"Re-vectorized {len(changed)} users, dropped {len(removed)} from the matching index")
+
+    # Swap in a newer artifact version if CURRENT moved; checked at most every artifact_check_interval.
+    def _maybe_load_artifact(self) -> bool:
+        if not self.artifact_dir:
+            return False
+        now = time.time()
+        if self.features is not None and now - self._artifact_checked_at < self.artifact_check_interval:
+            return False
+        self._artifact_checked_at = now
+
+        version = current_version(self.artifact_dir)
+        if version is None or version == self.artifact_version:
+            return False
+        try:
+            header, features = load_artifact(self.artifact_dir, version)
+        except Exception as e:
+            logger.error(f"Failed to load matching artifact {version}: {e}")
+            return False
+
+        self.featurizer = header["featurizer"]
+        vectorizer = self._make_vectorizer()
+        if self.featurizer == "tfidf":
+            vectorizer.vocabulary_ = header["vocabulary"]
+            vectorizer.idf_ = np.array(header["idf"])
+        self.vectorizer, self.features = vectorizer, features
+        if self.retriever is not None:
+            self.retriever.centroids = None  # rows were renumbered
+        self.artifact_version = version
+        self.fitted_at = now
+        self.rows_changed = 0
+        self._reconcile()
+        logger.info(f"Matching index now served from artifact {version}")
+        return True
+
+    # Queue every user whose profile differs from what the artifact was built from.
+    def _reconcile(self):
+        users = get_all_user_records()
+        stale = [uid for uid, user in users.items()
+                 if uid not in self.features.index
+                 or self.features.fingerprint(self.features.index[uid]) != feature_fingerprint(self._create_feature_text(user))]
+        stale += [uid for uid in self.features.index if uid not in users]
+        with self._dirty_lock:
+            self._dirty.update(stale)
+
+    # Make sure the index exists and reflects queued edits, rebuilding it when due.
+    # `background` is the ReindexQueue pass, which applies edits even while requests defer them.
+    def ensure_index(self, background: bool = False) -> Optional[FeatureStore]:
+        features = self.features
+        if self.defer_dirty and not background and features is not None and self.reindex is not None:
+            # No lock on the request path: whatever a pass is doing, serve the store it last swapped in.
+            if self._background_work_due(features):
+                self.reindex.request_pass()
+            return features
+        with self._lock:
+            self._maybe_load_artifact()
+            if self._needs_rebuild():
+                self.refresh_vectorizer()
+            elif self._dirty and (background or not self.defer_dirty):
+                self._apply_dirty()
+            if self.retriever is not None and self.retriever.needs_rebuild(self.features):
+                texts = self.row_texts(self.features) if self.retriever.needs_texts else None
+                self.retriever.build(self.features, texts)
+            return self.features
+
+    # Work ensure_index would do besides queued edits: a refit, an artifact check or an ANN rebuild.
+    def _background_work_due(self, features: FeatureStore) -> bool:
+        if self._needs_rebuild():
+            return True
+        if self.artifact_dir and time.time() - self._artifact_checked_at >= self.artifact_check_interval:
+            return True
+        return self.retriever is not None and self.retriever.needs_rebuild(features)
+
+    # Compatibility (0-1) of one user with each candidate, scored in one vectorized pass.
+    # Candidates outside the matching index (no survey yet) are left out.
+    def compatibility_scores(self, user_id: str, user: User, candidate_ids: List[str]) -> Dict[str, float]:
+        features = self.ensure_index()
+        if features is None or not candidate_ids:
+            return {}
+        known = [uid for uid in candidate_ids if uid in features.index]
+        if not known:
+            return {}
+        rows = np.array([features.index[uid] for uid in known])
+        query = features.encode(as_record(user, user_id), self.vectorizer, self._create_feature_text)
+        with _stage("score"):
+            scores, _ = features.score(query, self.weights, rows)
+        return dict(zip(known, scores.tolist()))
+
+    def index_stats(self) -> Dict:
+        features = self.features
+        return {
+            "featurizer": self.featurizer,
+            "artifact_version": self.artifact_version,
+            "users": len(features) if features is not None else 0,
+            "inactive_rows": features.inactive_rows if features is not None else 0,
+            "delta_rows": features.delta_rows if features is not None else 0,
+            "pending_updates": len(self._dirty),
+            "rows_changed_since_fit": self.rows_changed,
+            "scoring": self.scorer.stats() if self.scorer is not None else None,
+            "fitted_seconds_ago": round(time.time() - self.fitted_at, 3) if self.fitted_at else None
+        }
     
     # Explainable AI. 
-    def get_match_explanation(self, user_id1: str, user_id2: str) -> Dict:
+    def get_match_explanation(self, user_id1: str, user_id2: str,
+                              user1: Optional[User] = None, user2: Optional[User] = None) -> Dict:
         """Get detailed explanation of why two users match"""
         try:
-            user1 = get_user_data(user_id1)
-            user2 = get_user_data(user_id2)
+            # Explanations use the same fitted vocabulary as find_matches.
+            self.ensure_index()
+            if user1 is None:
+                user1 = get_user_data(user_id1)
+            if user2 is None:
+                user2 = get_user_data(user_id2)
             
             if not user1 or not user2:
                 return {"error": "One or both users not found"}
             
-            score, breakdown = self.calculate_compatibility(user1, user2)
+            score, breakdown = self.calculate_compatibility(user1, user2, (user_id1, user_id2))
             # Provides transparent reasoning for matches:
             return {
                 "compatibilityScore": round(score * 100, 1),
@@ -0,0 +1,296 @@
+# Process metrics in the Prometheus text exposition format (served at /metrics).
+# Counters, gauges and histograms with labels, plus collectors that refresh
+# values from component stats() at scrape time. Firestore document reads and
+# writes are attributed to the route whose request caused them through a
+# context variable that run_blocking carries into the IO threads.
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import threading
+import bisect
+import time
+import logging
+import profiling
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    # For collectors mirroring a monotonic counter kept elsewhere.
+    def set_total(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], list] = {}  # key -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        lines = []
+        for key, series in items:
+            labels = _format_labels(self.labelnames, key)
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = 'le="%s"' % _format_value(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {series[-1]}")
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: _Metric):
+        self._metrics.append(metric)
+
+    # Callback run before each scrape, typically copying a component's stats() into gauges.
+    def add_collector(self, collector: Callable[[], None]):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.error(f"Metrics collector failed: {e}")
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# HTTP
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Request latency by route", ["method", "route", "status"])
+REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "Requests currently being handled", ["method", "route"])
+
+# Firestore
+FIRESTORE_READS = Counter("firestore_document_reads_total", "Firestore documents read", ["route"])
+FIRESTORE_WRITES = Counter("firestore_document_writes_total", "Firestore documents written", ["route"])
+READS_PER_REQUEST = Histogram(
+    "firestore_reads_per_request", "Firestore documents read per request (read amplification)", ["route"],
+    buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250, 1000, 10000)
+)
+
+# Matching
+MATCHING_STAGE_SECONDS = Histogram(
+    "matching_stage_seconds", "MatchingAgent time per stage", ["stage"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0, 5.0, 30.0)
+)
+MATCHING_INDEX_LAG_SECONDS = Gauge(
+    "matching_index_lag_seconds", "Age of the oldest profile change not yet in the matching index"
+)
+MATCHING_INDEX_PENDING = Gauge("matching_index_pending_updates", "Profile changes queued for re-indexing")
+
+# Admission control
+ADMISSION_DECISIONS = Counter(
+    "admission_decisions_total", "Scoring calls by admission outcome (admitted, queued, rejected, timed_out)",
+    ["limiter", "result"]
+)
+ADMISSION_ACTIVE = Gauge("admission_active", "Scoring calls holding a slot", ["limiter"])
+SINGLE_FLIGHT_SHARED = Counter("single_flight_shared_total", "Calls answered by an identical in-flight computation")
+
+# Caches
+CACHE_HIT_RATIO = Gauge("cache_hit_ratio", "Hits over lookups since start", ["cache"])
+CACHE_LOOKUPS = Counter("cache_lookups_total", "Cache lookups by result", ["cache", "result"])
+
+class _RequestIO:
+    __slots__ = ("route", "reads", "writes")
+
+    def __init__(self, route: str):
+        self.route = route
+        self.reads = 0
+        self.writes = 0
+
+_current_io: ContextVar[Optional[_RequestIO]] = ContextVar("current_io", default=None)
+
+def begin_request(route: str):
+    """Attribute Firestore IO in this context to `route`; returns a token for end_request"""
+    return _current_io.set(_RequestIO(route))
+
+def end_request(token) -> Optional[_RequestIO]:
+    io = _current_io.get()
+    _current_io.reset(token)
+    if io is not None:
+        READS_PER_REQUEST.observe(io.reads, route=io.route)
+    return io
+
+def record_reads(count: int):
+    if count <= 0:
+        return
+    io = _current_io.get()
+    if io is not None:
+        io.reads += count
+    FIRESTORE_READS.inc(count, route=io.route if io is not None else "background")
+
+def record_writes(count: int):
+    if count <= 0:
+        return
+    io = _current_io.get()
+    if io is not None:
+        io.writes += count
+    FIRESTORE_WRITES.inc(count, route=io.route if io is not None else "background")
+
+def render() -> str:
+    return REGISTRY.render()
+
+# Firestore client wrapper: every query, document and batch handed out by the client
+# is wrapped too, so document reads and writes are counted wherever they happen.
+_CHAINED = {
+    "collection", "collection_group", "document", "where", "order_by", "limit", "limit_to_last",
+    "offset", "select", "start_at", "start_after", "end_at", "end_before", "batch", "transaction"
+}
+_WRITES = {"set", "update", "delete", "create", "add"}
+
+def _unwrap(value):
+    if isinstance(value, _FirestoreProxy):
+        return value._target
+    if isinstance(value, (list, tuple)):
+        return type(value)(_unwrap(v) for v in value)
+    return value
+
+def _counted(docs, name: str):
+    current = profiling.open_span(f"firestore.{name}")
+    read = 0
+    try:
+        for doc in docs:
+            read += 1
+            yield doc
+    finally:
+        record_reads(max(read, 1))  # an empty result still bills one read
+        profiling.close_span(current, documents=read)
+
+class _FirestoreProxy:
+    __slots__ = ("_target",)
+
+    def __init__(self, target):
+        self._target = target
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._target, name)
+        if not callable(attr) or name.startswith("_"):
+            return attr
+
+        def call(*args, **kwargs):
+            args = [_unwrap(a) for a in args]
+            kwargs = {k: _unwrap(v) for k, v in kwargs.items()}
+            if name == "on_snapshot":
+                callback = args[0]
+                args[0] = lambda snapshot, changes, read_time: (
+                    record_reads(len(changes)), callback(snapshot, changes, read_time)
+                )[1]
+            if name in _CHAINED:
+                return _FirestoreProxy(attr(*args, **kwargs))
+            if name in ("stream", "get_all"):
+                return _counted(attr(*args, **kwargs), name)
+            with profiling.span(f"firestore.{name}"):
+                result = attr(*args, **kwargs)
+            if name == "get":
+                if isinstance(result, list):
+                    record_reads(max(len(result), 1))
+                elif hasattr(result, "__next__"):
+                    return _counted(result, name)
+                else:
+                    record_reads(1)
+            elif name in _WRITES:
+                # Batched and transactional writes count when queued.
+                record_writes(1)
+            return result
+
+        return call
+
+def instrument_firestore(client):
+    """Firestore client whose document reads/writes feed the per-route counters"""
+    return _FirestoreProxy(client)
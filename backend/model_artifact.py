@@ -0,0 +1,142 @@
+# On-disk matching model shared by every uvicorn worker.
+# `python model_artifact.py build` writes one versioned directory of plain .npy
+# arrays plus a header.json. The CURRENT file names the live version and is
+# replaced atomically, so workers memory-map the arrays read-only and pick up
+# a new version on their next check without a restart.
+from feature_store import FeatureRows, FeatureStore
+from datetime import datetime
+from scipy import sparse
+from typing import Dict, Optional, Tuple
+import numpy as np
+import argparse
+import shutil
+import json
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+CURRENT_FILE = "CURRENT"
+HEADER_FILE = "header.json"
+DEFAULT_ARTIFACT_DIR = os.getenv(
+    "MATCHING_ARTIFACT_DIR",
+    os.path.join(os.path.dirname(__file__), "artifacts", "matching")
+)
+
+def _arrays(features: FeatureStore, rows: FeatureRows) -> Dict[str, np.ndarray]:
+    return {
+        "user_ids": np.array(features.user_ids, dtype=str),
+        "active": features.active,
+        "fingerprints": rows.fingerprints,
+        "text_data": rows.text.data,
+        "text_indices": rows.text.indices,
+        "text_indptr": rows.text.indptr,
+        "ages": rows.ages,
+        "gym_levels": rows.gym_levels,
+        "sports_data": rows.sports.data,
+        "sports_indices": rows.sports.indices,
+        "sports_indptr": rows.sports.indptr
+    }
+
+# Write a new version next to the old ones and flip CURRENT to it.
+def write_artifact(agent, root: str = DEFAULT_ARTIFACT_DIR, keep: int = 3) -> str:
+    features = agent.ensure_index()
+    if features is None:
+        raise RuntimeError("Matching index is empty, nothing to write")
+
+    version = datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+    os.makedirs(root, exist_ok=True)
+    staging = os.path.join(root, f".tmp-{version}")
+    os.makedirs(staging)
+
+    rows = features.merged()
+    for name, array in _arrays(features, rows).items():
+        np.save(os.path.join(staging, f"{name}.npy"), np.ascontiguousarray(array))
+
+    header = {
+        "format_version": FORMAT_VERSION,
+        "version": version,
+        "created_at": datetime.utcnow().isoformat(),
+        "featurizer": agent.featurizer,
+        "rows": len(features.user_ids),
+        "users": len(features),
+        "text_shape": list(rows.text.shape),
+        "sports_vocab": features.sports_vocab,
+        "weights": agent.weights
+    }
+    if agent.featurizer == "tfidf":
+        header["vocabulary"] = {term: int(i) for term, i in agent.vectorizer.vocabulary_.items()}
+        np.save(os.path.join(staging, "idf.npy"), agent.vectorizer.idf_)
+    with open(os.path.join(staging, HEADER_FILE), "w") as f:
+        json.dump(header, f)
+
+    os.rename(staging, os.path.join(root, version))
+    pointer = os.path.join(root, f".{CURRENT_FILE}-{version}")
+    with open(pointer, "w") as f:
+        f.write(version)
+    os.replace(pointer, os.path.join(root, CURRENT_FILE))  # atomic swap
+    logger.info(f"Wrote matching artifact {version} ({len(features)} users) to {root}")
+
+    _prune(root, keep)
+    return version
+
+def _prune(root: str, keep: int):
+    # Workers still mapping a pruned version keep their pages until they swap.
+    versions = sorted(d for d in os.listdir(root) if not d.startswith(".") and d != CURRENT_FILE)
+    for old in versions[:-keep]:
+        shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+
+def current_version(root: str = DEFAULT_ARTIFACT_DIR) -> Optional[str]:
+    try:
+        with open(os.path.join(root, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+# Map a version read-only; returns the header and the feature store.
+def load_artifact(root: str = DEFAULT_ARTIFACT_DIR, version: Optional[str] = None) -> Tuple[Dict, FeatureStore]:
+    version = version or current_version(root)
+    if version is None:
+        raise FileNotFoundError(f"No matching artifact in {root}")
+    path = os.path.join(root, version)
+    with open(os.path.join(path, HEADER_FILE)) as f:
+        header = json.load(f)
+    if header.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported artifact format {header.get('format_version')} in {path}")
+
+    def mapped(name: str) -> np.ndarray:
+        return np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+
+    if header["featurizer"] == "tfidf":
+        header["idf"] = mapped("idf")
+
+    user_ids = mapped("user_ids").tolist()
+    active = np.array(mapped("active"))  # small, and apply_changes copies it anyway
+    text = sparse.csr_matrix(
+        (mapped("text_data"), mapped("text_indices"), mapped("text_indptr")),
+        shape=tuple(header["text_shape"]), copy=False
+    )
+    sports_vocab = header["sports_vocab"]
+    sports = sparse.csr_matrix(
+        (mapped("sports_data"), mapped("sports_indices"), mapped("sports_indptr")),
+        shape=(len(user_ids), len(sports_vocab)), copy=False
+    )
+    index = {uid: i for i, uid in enumerate(user_ids) if active[i]}
+    features = FeatureStore(user_ids, text, mapped("ages"), mapped("gym_levels"), sports,
+                            sports_vocab, active, index, mapped("fingerprints"))
+    logger.info(f"Mapped matching artifact {version} ({len(features)} users)")
+    return header, features
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the shared matching artifact")
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("--out", default=DEFAULT_ARTIFACT_DIR)
+    parser.add_argument("--featurizer", default=os.getenv("MATCHING_FEATURIZER", "tfidf"))
+    parser.add_argument("--keep", type=int, default=3)
+    args = parser.parse_args()
+
+    from matching_agent import MatchingAgent
+    agent = MatchingAgent(featurizer=args.featurizer)
+    agent.refresh_vectorizer()
+    print(write_artifact(agent, args.out, args.keep))
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
 from typing import List, Optional
 from datetime import datetime
 
@@ -42,4 +42,76 @@ class FriendRequestResponse(BaseModel):
     
 class FriendRequestAction(BaseModel):  # ✅ New input model
     request_id: str
-    response: str
\ No newline at end of file
+    response: str
+
+class FriendRequestBatchAction(BaseModel):
+    actions: List[FriendRequestAction]
+
+# Slim view of a user for bulk matching scans: only what feature building and match
+# results read. Built once when a document is ingested (UserStore) or straight from
+# raw documents (replica / Firestore fallbacks), so scans skip Pydantic entirely.
+# Only users who completed the survey get a record, and only if the document would also
+# pass User validation, so every read path agrees on who exists. The extra fields here
+# are read for that check alone.
+RECORD_FIELDS = [
+    "fullName", "email", "phoneNumber", "sports", "surveyCompleted", "createdAt", "friends", "friendRequests",
+    "preferences.age", "preferences.gymLevel", "preferences.height", "preferences.weight",
+    "preferences.workoutGoal", "preferences.sports"
+]
+
+def _str_list(value) -> bool:
+    return isinstance(value, list) and all(isinstance(v, str) for v in value)
+
+# Same rule as User.createdAt: missing means "now", anything else has to parse as a datetime.
+def _valid_created_at(data: dict) -> bool:
+    if "createdAt" not in data or isinstance(data["createdAt"], datetime):
+        return True
+    try:
+        TypeAdapter(datetime).validate_python(data["createdAt"])
+        return True
+    except ValidationError:
+        return False
+
+class UserRecord:
+    __slots__ = ("id", "name", "email", "age", "gymLevel", "workoutGoal", "sports")
+
+    def __init__(self, user_id: Optional[str], name: str, email: str, age: str, gymLevel: str,
+                 workoutGoal: str, sports: Optional[List[str]]):
+        self.id = user_id
+        self.name = name
+        self.email = email
+        self.age = age
+        self.gymLevel = gymLevel
+        self.workoutGoal = workoutGoal
+        self.sports = sports
+
+    @classmethod
+    def from_user(cls, user_id: Optional[str], user: User) -> "UserRecord":
+        prefs = user.preferences
+        return cls(user_id, user.fullName, user.email, prefs.age, prefs.gymLevel, prefs.workoutGoal, user.sports)
+
+    @classmethod
+    def from_document(cls, user_id: str, data: dict) -> Optional["UserRecord"]:
+        """Record from a raw users document; None when unsurveyed or User(**data) would fail validation"""
+        prefs = data.get("preferences")
+        if data.get("surveyCompleted") is not True or not isinstance(prefs, dict):
+            return None
+        values = (data.get("fullName"), data.get("email"),
+                  prefs.get("age"), prefs.get("gymLevel"), prefs.get("workoutGoal"))
+        required = (data.get("phoneNumber"), prefs.get("height"), prefs.get("weight"))
+        if not all(isinstance(v, str) for v in values + required):
+            return None
+        sports = data.get("sports", [])
+        if sports is not None and not _str_list(sports):
+            return None
+        if not all(_str_list(v) for v in (prefs.get("sports", []), data.get("friends", []), data.get("friendRequests", []))):
+            return None
+        if not _valid_created_at(data):
+            return None
+        return cls(user_id, *values, sports)
+
+    def __repr__(self) -> str:
+        return f"UserRecord({self.id!r}, {self.name!r}, {self.gymLevel!r}, {self.workoutGoal!r}, {self.sports!r})"
+
+def as_record(user, user_id: Optional[str] = None) -> UserRecord:
+    return user if isinstance(user, UserRecord) else UserRecord.from_user(user_id, user)
@@ -0,0 +1,287 @@
+# Multi-process scoring for MatchingAgent and MatchTableJob (SCORING_WORKERS > 0).
+# Each FeatureStore version that gets sharded is copied once into shared memory; worker
+# processes map those buffers read-only, score one shard of candidate rows per task and
+# send back only that shard's best rows. A copy is a full pass over the arrays, so a new
+# version (every reindex pass makes one) is published at most once per republish_interval
+# and scored in-process until then. The shards' winners are merged here with the
+# same (score desc, user id) order as FeatureStore.top_k, so results match the
+# single-process path exactly.
+from feature_store import FeatureRows, FeatureStore, QueryFeatures
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from scipy import sparse
+from typing import Dict, List, Optional, Tuple
+import multiprocessing
+import threading
+import time
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+Ranked = Tuple[np.ndarray, np.ndarray, Dict[str, np.ndarray]]  # rows, scores, components; best first
+
+def _arrays(features: FeatureStore, rows: FeatureRows) -> Dict[str, np.ndarray]:
+    return {
+        "text.data": rows.text.data, "text.indices": rows.text.indices, "text.indptr": rows.text.indptr,
+        "sports.data": rows.sports.data, "sports.indices": rows.sports.indices,
+        "sports.indptr": rows.sports.indptr,
+        "ages": rows.ages, "gym_levels": rows.gym_levels, "active": features.active
+    }
+
+class _Segment:
+    """One FeatureStore version copied into shared memory blocks"""
+
+    def __init__(self, features: FeatureStore):
+        self.features = features
+        self.blocks: List[shared_memory.SharedMemory] = []
+        self.in_flight = 0
+        self.retired = False
+        arrays = {}
+        rows = features.merged()  # the base as is, or one merged copy when there is a delta
+        try:
+            for name, array in _arrays(features, rows).items():
+                array = np.ascontiguousarray(array)
+                block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                self.blocks.append(block)
+                np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+                arrays[name] = (block.name, array.dtype.str, array.shape)
+        except Exception:
+            self.release()
+            raise
+        # Everything a worker needs to map this version; small enough to send with every task.
+        self.spec = {
+            "key": self.blocks[0].name,
+            "arrays": arrays,
+            "text_shape": rows.text.shape,
+            "sports_shape": rows.sports.shape
+        }
+        self.nbytes = sum(block.size for block in self.blocks)
+
+    def release(self):
+        for block in self.blocks:
+            try:
+                block.close()
+                block.unlink()
+            except Exception as e:
+                logger.error(f"Failed to release shared scoring block {block.name}: {e}")
+        self.blocks = []
+
+# Worker side: the mapped store for the newest version, plus its contiguous shards.
+_mapped: Dict = {}
+
+def _attach(spec: Dict) -> Dict:
+    if _mapped.get("key") == spec["key"]:
+        return _mapped
+    # A newer version was published: drop the views before unmapping the old buffers.
+    old_blocks = _mapped.get("blocks", [])
+    _mapped.clear()
+    for block in old_blocks:
+        block.close()
+
+    blocks, arrays = [], {}
+    for name, (block_name, dtype, shape) in spec["arrays"].items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+        arrays[name].flags.writeable = False
+    text = sparse.csr_matrix(
+        (arrays["text.data"], arrays["text.indices"], arrays["text.indptr"]), shape=spec["text_shape"]
+    )
+    sports = sparse.csr_matrix(
+        (arrays["sports.data"], arrays["sports.indices"], arrays["sports.indptr"]), shape=spec["sports_shape"]
+    )
+    # Scoring-only view: ids, vocabularies and the id index stay in the parent.
+    store = FeatureStore([], text, arrays["ages"], arrays["gym_levels"], sports, {}, arrays["active"], {})
+    _mapped.update(key=spec["key"], blocks=blocks, store=store, shards={})
+    return _mapped
+
+def _shard(mapped: Dict, start: int, stop: int) -> FeatureStore:
+    shard = mapped["shards"].get((start, stop))
+    if shard is None:
+        shard = mapped["shards"][(start, stop)] = mapped["store"].shard(start, stop)
+    return shard
+
+# Positions of the k best valid scores, keeping every tie with the k-th so the merge can break ties by user id.
+def _best(scores: np.ndarray, valid: np.ndarray, k: int) -> np.ndarray:
+    positions = np.flatnonzero(valid)
+    if k <= 0 or len(positions) <= k:
+        return positions if k > 0 else positions[:0]
+    subset = scores[positions]
+    kth_best = subset[np.argpartition(-subset, k - 1)[k - 1]]
+    return positions[subset >= kth_best]
+
+def _pick(scores: np.ndarray, components: Dict[str, np.ndarray], positions: np.ndarray, rows: np.ndarray) -> Ranked:
+    return rows, scores[positions], {name: values[positions] for name, values in components.items()}
+
+def _score_query(spec: Dict, query: QueryFeatures, weights: Dict[str, float], k: int, part,
+                 exclude: Optional[List[int]], min_score: float) -> Ranked:
+    """Worker task: one query against a shard, given as a (start, stop) range or an array of rows"""
+    mapped = _attach(spec)
+    if isinstance(part, tuple):
+        start, stop = part
+        scores, components = _shard(mapped, start, stop).score(query, weights)
+        rows = np.arange(start, stop)
+    else:
+        rows = part
+        scores, components = mapped["store"].score(query, weights, rows)
+    valid = mapped["store"].active[rows].copy()
+    if exclude:
+        valid &= ~np.isin(rows, exclude)
+    if min_score > 0:
+        valid &= np.round(scores * 100, 1) >= min_score
+    positions = _best(scores, valid, k)
+    return _pick(scores, components, positions, rows[positions])
+
+def _score_block(spec: Dict, rows: np.ndarray, weights: Dict[str, float], k: int,
+                 start: int, stop: int, exclude: Optional[List[List[int]]]) -> List[Ranked]:
+    """Worker task: a block of query rows against the candidate rows [start, stop)"""
+    mapped = _attach(spec)
+    shard = _shard(mapped, start, stop)
+    scores, components = mapped["store"].score_block(rows, weights, candidates=shard)
+    ranked = []
+    for i, row in enumerate(rows):
+        valid = shard.active.copy()
+        blocked = np.asarray([row] + list(exclude[i] if exclude else []), dtype=np.int64)
+        blocked = blocked[(blocked >= start) & (blocked < stop)]
+        valid[blocked - start] = False
+        positions = _best(scores[i], valid, k)
+        ranked.append(_pick(scores[i], {name: values[i] for name, values in components.items()},
+                            positions, positions + start))
+    return ranked
+
+class ShardedScorer:
+    """Process pool that scores candidate shards against shared-memory feature arrays"""
+
+    def __init__(self, workers: int, shard_size: Optional[int] = None, min_rows: int = 20000,
+                 start_method: str = "spawn", republish_interval: float = 5.0):
+        if workers < 1:
+            raise ValueError("ShardedScorer needs at least one worker")
+        self.workers = workers
+        self.shard_size = shard_size  # candidate rows per task; default splits evenly across the workers
+        self.min_rows = min_rows  # below this, in-process scoring beats the IPC round trip
+        # Publishing copies every feature array (O(rows + nonzeros)) into fresh shared memory, and every
+        # reindex pass makes a new FeatureStore; at most one copy per interval, in-process scoring between.
+        self.republish_interval = republish_interval
+        self._published_at = float("-inf")
+        self.deferred_publishes = 0
+        # spawn: forking a process that runs the IO thread pool and Firestore listener is not safe.
+        self._context = multiprocessing.get_context(start_method)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._segment: Optional[_Segment] = None
+        self._lock = threading.Lock()
+        self.published = 0
+        self.sharded_calls = 0
+
+    def should_shard(self, candidates: int, features: Optional[FeatureStore] = None) -> bool:
+        if candidates < self.min_rows:
+            return False
+        segment = self._segment
+        if features is None or (segment is not None and segment.features is features):
+            return True
+        # `features` would have to be published first: only if the last copy is old enough.
+        if time.monotonic() - self._published_at < self.republish_interval:
+            self.deferred_publishes += 1
+            return False
+        return True
+
+    def _ranges(self, n: int) -> List[Tuple[int, int]]:
+        size = self.shard_size or -(-n // self.workers)
+        return [(start, min(start + size, n)) for start in range(0, n, max(size, 1))]
+
+    # Created on first use; scoring threads race here, so only one of them may build the pool.
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=self._context)
+            return self._pool
+
+    # Pin the shared copy of `features` for one call, publishing it first if the index moved on.
+    def _acquire(self, features: FeatureStore) -> _Segment:
+        with self._lock:
+            if self._segment is None or self._segment.features is not features:
+                old, self._segment = self._segment, _Segment(features)
+                self.published += 1
+                self._published_at = time.monotonic()
+                logger.info(f"Published {len(features.user_ids)} feature rows to shared memory "
+                            f"({self._segment.nbytes / 2 ** 20:.1f}MB)")
+                if old is not None:
+                    old.retired = True
+                    if old.in_flight == 0:
+                        old.release()
+            self._segment.in_flight += 1
+            self.sharded_calls += 1
+            return self._segment
+
+    def _return(self, segment: _Segment):
+        with self._lock:
+            segment.in_flight -= 1
+            if segment.retired and segment.in_flight == 0:
+                segment.release()
+
+    def _merge(self, features: FeatureStore, parts: List[Ranked], k: int) -> Ranked:
+        if not parts:
+            return np.zeros(0, dtype=np.int64), np.zeros(0), {}
+        rows = np.concatenate([p[0] for p in parts]).astype(np.int64)
+        scores = np.concatenate([p[1] for p in parts])
+        order = sorted(range(len(rows)), key=lambda i: (-scores[i], features.user_ids[rows[i]]))[:k]
+        order = np.array(order, dtype=np.int64)
+        components = {name: np.concatenate([p[2][name] for p in parts])[order] for name in parts[0][2]}
+        return rows[order], scores[order], components
+
+    def top_k(self, features: FeatureStore, query: QueryFeatures, weights: Dict[str, float], k: int,
+              rows: Optional[np.ndarray] = None, exclude: Optional[List[int]] = None,
+              min_score: float = 0.0) -> Ranked:
+        """One query's k best rows (out of `rows`, or all), scored shard by shard in the pool"""
+        segment = self._acquire(features)
+        try:
+            if rows is None:
+                parts = self._ranges(len(features.user_ids))
+            else:
+                rows = np.asarray(rows)
+                parts = [rows[start:stop] for start, stop in self._ranges(len(rows))]
+            futures = [
+                self._executor().submit(_score_query, segment.spec, query, weights, k, part, exclude, min_score)
+                for part in parts
+            ]
+            return self._merge(features, [f.result() for f in futures], k)
+        finally:
+            self._return(segment)
+
+    def top_k_block(self, features: FeatureStore, rows: np.ndarray, weights: Dict[str, float],
+                    k: int, exclude: Optional[List[List[int]]] = None) -> List[Ranked]:
+        """Same as FeatureStore.top_k_block, with the candidate columns sharded across the pool"""
+        segment = self._acquire(features)
+        try:
+            rows = np.asarray(rows)
+            futures = [
+                self._executor().submit(_score_block, segment.spec, rows, weights, k, start, stop, exclude)
+                for start, stop in self._ranges(len(features.user_ids))
+            ]
+            shards = [f.result() for f in futures]
+            return [self._merge(features, [shard[i] for shard in shards], k) for i in range(len(rows))]
+        finally:
+            self._return(segment)
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+        with self._lock:
+            if self._segment is not None:
+                self._segment.release()
+                self._segment = None
+
+    def stats(self) -> Dict:
+        segment = self._segment
+        return {
+            "workers": self.workers,
+            "shard_size": self.shard_size,
+            "min_rows": self.min_rows,
+            "published_versions": self.published,
+            "deferred_publishes": self.deferred_publishes,
+            "republish_interval_seconds": self.republish_interval,
+            "sharded_calls": self.sharded_calls,
+            "shared_mb": round(segment.nbytes / 2 ** 20, 2) if segment is not None else 0.0
+        }
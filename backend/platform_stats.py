@@ -0,0 +1,200 @@
+# Platform aggregates for /stats/platform, maintained incrementally.
+# Each user's contribution (gym level, sports, survey flag, sign-up time) is
+# remembered, so a change from the user store feed is applied as "remove old
+# contribution, add new". The totals are checkpointed to stats/platform and a
+# periodic full pass over the user store replaces them if they ever drift.
+from models import User
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+import threading
+import bisect
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+RECENT_SIGNUP_DAYS = 7
+
+# (gymLevel, sports, surveyCompleted, createdAt) - what one user adds to the totals.
+Contribution = Tuple[str, Tuple[str, ...], bool, datetime]
+
+# Firestore timestamps are tz-aware, model defaults naive UTC: compare everything as aware UTC.
+def _utc(value: datetime) -> datetime:
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+def _contribution(user: Optional[User]) -> Optional[Contribution]:
+    # Same population as get_all_users: only users who completed the survey count.
+    if user is None or not user.surveyCompleted:
+        return None
+    return (user.preferences.gymLevel, tuple(user.sports or []), user.surveyCompleted, _utc(user.createdAt))
+
+class PlatformStats:
+    def __init__(self, db, collection: str = "stats", document: str = "platform"):
+        self._db = db
+        self._collection = collection
+        self._document = document
+        self._lock = threading.Lock()
+        self._contributions: Dict[str, Contribution] = {}
+        self._gym_levels: Counter = Counter()
+        self._sports: Counter = Counter()
+        self._active = 0
+        self._created: list = []  # sorted sign-up times, for the rolling recent-signups window
+        self._timers: Dict[str, threading.Timer] = {}
+        self.ready = False
+        self.dirty = False
+        self.events_applied = 0
+        self.reconciled_at: Optional[float] = None
+        self.last_drift: Optional[Dict] = None
+        self.checkpointed_at: Optional[float] = None
+
+    def _add(self, contribution: Contribution):
+        gym_level, sports, surveyed, created_at = contribution
+        self._gym_levels[gym_level] += 1
+        self._sports.update(sports)
+        self._active += surveyed
+        bisect.insort(self._created, created_at)
+
+    def _remove(self, contribution: Contribution):
+        gym_level, sports, surveyed, created_at = contribution
+        self._gym_levels[gym_level] -= 1
+        self._sports.subtract(sports)
+        self._active -= surveyed
+        del self._created[bisect.bisect_left(self._created, created_at)]
+        # Keep zero counts out of the distributions.
+        if self._gym_levels[gym_level] <= 0:
+            del self._gym_levels[gym_level]
+        for sport in sports:
+            if self._sports[sport] <= 0:
+                del self._sports[sport]
+
+    # User store subscriber: user is None on delete.
+    def apply(self, user_id: str, user: Optional[User]):
+        new = _contribution(user)
+        with self._lock:
+            old = self._contributions.pop(user_id, None)
+            if old is not None:
+                self._remove(old)
+            if new is not None:
+                self._add(new)
+                self._contributions[user_id] = new
+            self.events_applied += 1
+            self.dirty = True
+
+    # Replace the totals with a full recount; returns how far the incremental totals had drifted.
+    def rebuild(self, users: Dict[str, User]) -> Dict:
+        fresh = PlatformStats(self._db, self._collection, self._document)
+        for user_id, user in users.items():
+            contribution = _contribution(user)
+            if contribution is not None:
+                fresh._add(contribution)
+                fresh._contributions[user_id] = contribution
+
+        with self._lock:
+            drift = {}
+            if self.ready:
+                before, after = self._totals(), fresh._totals()
+                drift = {
+                    key: {"incremental": before[key], "recount": after[key]}
+                    for key in after if before[key] != after[key]
+                }
+                if drift:
+                    logger.warning(f"Platform stats drifted from a full recount: {drift}")
+            self._contributions = fresh._contributions
+            self._gym_levels, self._sports = fresh._gym_levels, fresh._sports
+            self._active, self._created = fresh._active, fresh._created
+            self.ready = True
+            self.dirty = True
+            self.reconciled_at = time.time()
+            self.last_drift = drift
+        return drift
+
+    def _recent_signups(self, now: datetime) -> int:
+        # Matches the old `(now - createdAt).days <= 7`: anything newer than 8 whole days ago.
+        cutoff = now - timedelta(days=RECENT_SIGNUP_DAYS + 1)
+        return len(self._created) - bisect.bisect_right(self._created, cutoff)
+
+    def _totals(self) -> Dict:
+        now = datetime.now(timezone.utc)
+        return {
+            "total_users": len(self._contributions),
+            "active_users": self._active,
+            "gym_level_distribution": dict(self._gym_levels),
+            # Ties broken by name so the top ten does not depend on event order.
+            "popular_sports": dict(sorted(self._sports.items(), key=lambda kv: (-kv[1], kv[0]))[:10]),
+            "recent_signups": self._recent_signups(now)
+        }
+
+    def snapshot(self) -> Dict:
+        """/stats/platform response from the in-memory totals"""
+        with self._lock:
+            totals = self._totals()
+        return {
+            "total_users": totals["total_users"],
+            "active_users": totals["active_users"],
+            "stats": {
+                "gym_level_distribution": totals["gym_level_distribution"],
+                "popular_sports": totals["popular_sports"],
+                "recent_signups": totals["recent_signups"]
+            },
+            "generated_at": datetime.utcnow().isoformat()
+        }
+
+    # Write the current response to stats/platform (skipped when nothing changed).
+    def checkpoint(self, force: bool = False) -> bool:
+        with self._lock:
+            if not self.ready or not (self.dirty or force):
+                return False
+            self.dirty = False
+        data = self.snapshot()
+        try:
+            self._db.collection(self._collection).document(self._document).set(data)
+            self.checkpointed_at = time.time()
+            return True
+        except Exception as e:
+            logger.error(f"Failed to checkpoint platform stats: {e}")
+            self.dirty = True
+            return False
+
+    # Last checkpoint, for serving before the user store has loaded.
+    def load_checkpoint(self) -> Optional[Dict]:
+        try:
+            doc = self._db.collection(self._collection).document(self._document).get()
+            return doc.to_dict() if doc.exists else None
+        except Exception as e:
+            logger.error(f"Failed to read platform stats checkpoint: {e}")
+            return None
+
+    # Checkpoint every `checkpoint_interval` seconds, recount from `source()` every `reconcile_interval`.
+    def start_schedule(self, source, checkpoint_interval: float = 60.0, reconcile_interval: float = 3600.0):
+        self._every("checkpoint", checkpoint_interval, self.checkpoint)
+        self._every("reconcile", reconcile_interval, lambda: self.rebuild(source()))
+
+    def _every(self, name: str, interval: float, job):
+        def tick():
+            try:
+                job()
+            except Exception as e:
+                logger.error(f"Scheduled platform stats {name} failed: {e}")
+            self._every(name, interval, job)
+
+        timer = threading.Timer(interval, tick)
+        timer.daemon = True
+        self._timers[name] = timer
+        timer.start()
+
+    def stop_schedule(self):
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers = {}
+
+    def stats(self) -> Dict:
+        now = time.time()
+        return {
+            "ready": self.ready,
+            "users": len(self._contributions),
+            "events_applied": self.events_applied,
+            "reconciled_seconds_ago": round(now - self.reconciled_at, 3) if self.reconciled_at else None,
+            "checkpointed_seconds_ago": round(now - self.checkpointed_at, 3) if self.checkpointed_at else None,
+            "last_drift": self.last_drift
+        }
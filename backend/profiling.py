@@ -0,0 +1,200 @@
+# Opt-in per-request profiling.
+# A profiled request carries a span tree in a context variable; code marks its
+# stages with span()/accumulate()/trace_event(), and run_blocking carries the tree
+# into the IO threads. Every helper returns after a single ContextVar lookup when
+# the request is not being profiled.
+#
+# Requests opt in with the `X-Profile: 1` header, or with `?profile=1` plus the
+# admin token. A small random sample of requests is also profiled silently, and
+# any profiled request slower than PROFILE_SLOW_MS is appended to PROFILE_DUMP_PATH.
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+from datetime import datetime
+import threading
+import random
+import json
+import time
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+PROFILED_PREFIXES = tuple(os.getenv("PROFILE_PATHS", "/matches,/stats,/friend-requests").split(","))
+SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0.01"))
+SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "1000"))
+DUMP_PATH = os.getenv("PROFILE_DUMP_PATH", os.path.join(os.path.dirname(__file__), "profiles", "slow.jsonl"))
+MAX_EVENTS = 100  # per span; the rest are only counted
+
+class Span:
+    __slots__ = ("name", "start", "end", "count", "accumulated", "children", "attrs", "events", "dropped_events")
+
+    def __init__(self, name: str, start: Optional[float] = None):
+        self.name = name
+        self.start = time.perf_counter() if start is None else start
+        self.end: Optional[float] = None
+        self.count = 1
+        self.accumulated = False  # folded from many accumulate() sections
+        self.children: List["Span"] = []
+        self.attrs: Dict = {}
+        self.events: List[tuple] = []
+        self.dropped_events = 0
+
+    @property
+    def seconds(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+    def to_dict(self, origin: float) -> Dict:
+        children = [child.to_dict(origin) for child in self.children]
+        ms = self.seconds * 1000
+        node = {"name": self.name, "start_ms": round((self.start - origin) * 1000, 3), "ms": round(ms, 3)}
+        if self.count > 1:
+            node["count"] = self.count
+        if self.attrs:
+            node["attrs"] = self.attrs
+        if children:
+            node["children"] = children
+            # Time not covered by any child (handler code, framework, serialization);
+            # children that ran concurrently on the IO pool can overlap, hence the floor.
+            node["self_ms"] = round(max(ms - sum(c["ms"] for c in children), 0.0), 3)
+        if self.events:
+            # Formatted only now, when someone asked for the profile.
+            node["events"] = [{"name": name, "at_ms": round((at - origin) * 1000, 3), **attrs}
+                              for name, at, attrs in self.events]
+        if self.dropped_events:
+            node["dropped_events"] = self.dropped_events
+        return node
+
+class Profile:
+    def __init__(self, name: str):
+        self.root = Span(name)
+        self.started_at = datetime.utcnow()
+
+    def to_dict(self) -> Dict:
+        return {"started_at": self.started_at.isoformat(), **self.root.to_dict(self.root.start)}
+
+_current: ContextVar[Optional[Span]] = ContextVar("profile_span", default=None)
+
+def active() -> bool:
+    return _current.get() is not None
+
+# Opt-in check for a request: `X-Profile: 1` or `?profile=1`, and the admin token either way.
+def requested(headers, query_params) -> bool:
+    if headers.get("x-profile") != "1" and query_params.get("profile") != "1":
+        return False
+    admin_token = os.getenv("ADMIN_TOKEN")
+    presented = headers.get("x-admin-token") or query_params.get("admin_token")
+    return bool(admin_token) and presented == admin_token
+
+def covers(path: str) -> bool:
+    return path.startswith(PROFILED_PREFIXES)
+
+def sampled() -> bool:
+    return SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE
+
+def start(name: str):
+    """Begin profiling the current context; returns (profile, token) for finish()"""
+    profile = Profile(name)
+    return profile, _current.set(profile.root)
+
+def finish(profile: Profile, token):
+    profile.root.end = time.perf_counter()
+    _current.reset(token)
+
+@contextmanager
+def span(name: str, **attrs):
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(name)
+    if attrs:
+        child.attrs.update(attrs)
+    parent.children.append(child)  # list.append is atomic, so IO threads can add siblings
+    token = _current.set(child)
+    try:
+        yield child
+    finally:
+        child.end = time.perf_counter()
+        _current.reset(token)
+
+@contextmanager
+def accumulate(name: str):
+    """Fold many short sections (e.g. per-document parsing) into one child with a count"""
+    parent = _current.get()
+    if parent is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        for child in parent.children:
+            if child.name == name and child.accumulated:
+                child.end += elapsed
+                child.count += 1
+                break
+        else:
+            child = Span(name, started)
+            child.end = started + elapsed
+            child.accumulated = True
+            parent.children.append(child)
+
+def trace_event(name: str, **attrs):
+    """Point event on the current span; attrs are kept raw and only formatted if the profile is rendered"""
+    current = _current.get()
+    if current is None:
+        return
+    if len(current.events) < MAX_EVENTS:
+        current.events.append((name, time.perf_counter(), attrs))
+    else:
+        current.dropped_events += 1
+
+# Run fn under a span in an IO thread; `submitted` is when it was queued on the pool.
+def traced(name: str, submitted: float, fn, *args, **kwargs):
+    with span(name) as current:
+        if current is not None:
+            current.attrs["queued_ms"] = round((current.start - submitted) * 1000, 3)
+        return fn(*args, **kwargs)
+
+# Manual spans for code that cannot use a with-block (Firestore result generators).
+def open_span(name: str) -> Optional[Span]:
+    parent = _current.get()
+    if parent is None:
+        return None
+    child = Span(name)
+    parent.children.append(child)
+    return child
+
+def close_span(child: Optional[Span], **attrs):
+    if child is not None:
+        child.end = time.perf_counter()
+        child.attrs.update(attrs)
+
+_dump_lock = threading.Lock()
+
+def maybe_dump(profile: Profile, path: str) -> bool:
+    """Append the profile to the slow-request file when it crossed PROFILE_SLOW_MS"""
+    ms = profile.root.seconds * 1000
+    if ms < SLOW_MS:
+        return False
+    try:
+        record = json.dumps({"path": path, **profile.to_dict()}, default=str)
+        with _dump_lock:
+            os.makedirs(os.path.dirname(os.path.abspath(DUMP_PATH)), exist_ok=True)
+            with open(DUMP_PATH, "a") as f:
+                f.write(record + "\n")
+        logger.warning(f"Slow request {path} ({ms:.0f}ms) dumped to {DUMP_PATH}")
+        return True
+    except Exception as e:
+        logger.error(f"Failed to dump profile for {path}: {e}")
+        return False
+
+# Top-level spans as a Server-Timing header (works for non-JSON and 304 responses too).
+def server_timing(profile: Profile) -> str:
+    parts = [f'total;dur={profile.root.seconds * 1000:.1f}']
+    for child in profile.root.children:
+        name = "".join(c if c.isalnum() or c in "-_" else "_" for c in child.name)
+        parts.append(f"{name};dur={child.seconds * 1000:.1f}")
+    return ", ".join(parts)
@@ -0,0 +1,154 @@
+# Debounced background re-indexing of the matching index.
+# Profile edits (the sports PATCH and the user store change feed) push the user id
+# here and return immediately. A worker thread waits until a burst has been quiet
+# for `window` seconds, or until its oldest change is `max_delay` old, and then
+# applies every queued edit to the MatchingAgent in one copy-on-write pass.
+# While the queue runs, match requests serve the current index instead of applying
+# edits themselves, and a refit or artifact swap they find due is handed to the
+# worker through request_pass(); lag_seconds() says how far behind that index is.
+from typing import Dict, Optional
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class ReindexQueue:
+    def __init__(self, agent, window: float = 1.0, max_delay: float = 10.0):
+        self.agent = agent
+        self.window = window  # quiet period that ends a burst
+        self.max_delay = max_delay  # upper bound on any change's wait, even mid-burst
+        self._cond = threading.Condition()
+        self._pending: Dict[str, float] = {}  # user id -> when it first changed (monotonic)
+        self._oldest: Optional[float] = None
+        self._last_push: Optional[float] = None
+        self._pass_requested = False  # a refit or artifact check is due; run a pass without debouncing
+        self._applying_since: Optional[float] = None  # oldest change in the pass being applied
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self.events = 0
+        self.passes = 0
+        self.users_applied = 0
+        self.coalesced = 0
+        self.requested_passes = 0
+        self.failures = 0
+        self.last_pass: Optional[Dict] = None
+
+    # Record a changed profile; the matching row is re-vectorized by the next pass.
+    def push(self, user_id: str):
+        self.agent.mark_dirty(user_id)  # lets is_dirty() callers (match table) see the edit right away
+        now = time.monotonic()
+        with self._cond:
+            if user_id in self._pending:
+                self.coalesced += 1  # already queued in this burst
+            else:
+                self._pending[user_id] = now
+            if self._oldest is None:
+                self._oldest = now
+            self._last_push = now
+            self.events += 1
+            self._cond.notify()
+
+    # UserStore change-feed callback.
+    def on_user_changed(self, user_id: str, user):
+        self.push(user_id)
+
+    # From MatchingAgent.ensure_index on the request path; repeated asks before the pass collapse into one.
+    def request_pass(self):
+        with self._cond:
+            if self._pass_requested:
+                return
+            self._pass_requested = True
+            self.requested_passes += 1
+            self._cond.notify()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self.agent.reindex = self
+        self.agent.defer_dirty = True
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="matching-reindex", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.agent.defer_dirty = False  # requests apply whatever is still queued
+        self.agent.reindex = None
+
+    def _next_batch(self) -> Optional[Dict[str, float]]:
+        with self._cond:
+            while not self._pending and not self._pass_requested and not self._stopping:
+                self._cond.wait()
+            # Debounce: keep collecting until the burst goes quiet or its oldest change is due.
+            while self._pending and not self._pass_requested and not self._stopping:
+                due = min(self._last_push + self.window, self._oldest + self.max_delay)
+                remaining = due - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            if self._stopping:
+                return None
+            batch, self._pending = self._pending, {}
+            self._applying_since, self._oldest = self._oldest, None
+            self._pass_requested = False
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            started = time.perf_counter()
+            try:
+                self.agent.ensure_index(background=True)
+                self.passes += 1
+                self.users_applied += len(batch)
+                self.last_pass = {
+                    "users": len(batch),
+                    "seconds": round(time.perf_counter() - started, 3),
+                    "at": time.time()
+                }
+                logger.info(f"Reindexed {len(batch)} changed profiles in {self.last_pass['seconds']}s")
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"Background reindex of {len(batch)} profiles failed: {e}")
+                # Put them back (they are still dirty on the agent) and retry after a quiet period.
+                with self._cond:
+                    for user_id, changed_at in batch.items():
+                        self._pending.setdefault(user_id, changed_at)
+                    if self._pending:
+                        self._oldest = min(self._pending.values())
+                        self._last_push = time.monotonic()
+            finally:
+                with self._cond:
+                    self._applying_since = None
+
+    def lag_seconds(self) -> float:
+        """Age of the oldest profile change the matching index does not reflect yet"""
+        with self._cond:
+            marks = [m for m in (self._oldest, self._applying_since) if m is not None]
+        return round(time.monotonic() - min(marks), 3) if marks else 0.0
+
+    def stats(self) -> Dict:
+        with self._cond:
+            pending = len(self._pending)
+        return {
+            "running": self._thread is not None,
+            "window_seconds": self.window,
+            "max_delay_seconds": self.max_delay,
+            "pending": pending,
+            "lag_seconds": self.lag_seconds(),
+            "events": self.events,
+            "passes": self.passes,
+            "users_applied": self.users_applied,
+            "coalesced": self.coalesced,
+            "requested_passes": self.requested_passes,
+            "failures": self.failures,
+            "last_pass": self.last_pass
+        }
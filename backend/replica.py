@@ -0,0 +1,298 @@
+# Local SQLite read replica of `users` and `friend_requests`.
+# A bulk copy seeds the database; after that, sync() only pulls documents whose
+# write timestamps (lastUpdated / updated_at / createdAt for users, created_at /
+# responded_at for requests) moved past the stored watermarks. Deletes leave no
+# timestamp behind, so every `full_every`-th scheduled run is a full re-copy.
+# firebase_utils serves its reads from here when USER_READS=replica.
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+import threading
+import argparse
+import time
+import sqlite3
+import json
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Fields whose value moves forward on every write path that touches the collection.
+WATERMARK_FIELDS = {
+    "users": ["lastUpdated", "updated_at", "createdAt"],
+    "friend_requests": ["created_at", "responded_at"]
+}
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS users ("
+    "id TEXT PRIMARY KEY, survey_completed INTEGER, gym_level TEXT, created_at TEXT, data TEXT)",
+    "CREATE TABLE IF NOT EXISTS user_sports (user_id TEXT, sport TEXT, PRIMARY KEY (user_id, sport))",
+    "CREATE TABLE IF NOT EXISTS friend_requests ("
+    "id TEXT PRIMARY KEY, from_user TEXT, to_user TEXT, status TEXT, created_at TEXT, data TEXT)",
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)",
+    "CREATE INDEX IF NOT EXISTS users_survey ON users (survey_completed)",
+    "CREATE INDEX IF NOT EXISTS users_gym_level ON users (gym_level)",
+    "CREATE INDEX IF NOT EXISTS users_created ON users (created_at)",
+    "CREATE INDEX IF NOT EXISTS user_sports_sport ON user_sports (sport)",
+    "CREATE INDEX IF NOT EXISTS requests_to_status ON friend_requests (to_user, status, created_at)",
+    "CREATE INDEX IF NOT EXISTS requests_from_to ON friend_requests (from_user, to_user, status)"
+]
+
+# Firestore timestamps survive the JSON round trip as datetimes. Anything else JSON has no
+# type for (bytes, GeoPoint, DocumentReference) is kept as its string form rather than
+# failing the whole sync over one field.
+def _encode(value):
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if hasattr(value, "to_datetime"):
+        return {"__datetime__": value.to_datetime().isoformat()}
+    logger.warning(f"Storing {type(value).__name__} value as a string in the replica")
+    return str(value)
+
+def _decode(obj: dict):
+    if len(obj) == 1 and "__datetime__" in obj:
+        return datetime.fromisoformat(obj["__datetime__"])
+    return obj
+
+def _dumps(data: dict) -> str:
+    return json.dumps(data, default=_encode)
+
+def _loads(raw: str) -> dict:
+    return json.loads(raw, object_hook=_decode)
+
+def _aware(value) -> Optional[datetime]:
+    if hasattr(value, "to_datetime"):
+        value = value.to_datetime()
+    if not isinstance(value, datetime):
+        return None
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+def _iso(value) -> Optional[str]:
+    value = _aware(value)
+    return value.isoformat() if value else None
+
+class SqliteReplica:
+    def __init__(self, path: str, db=None, overlap_seconds: float = 5.0, ready_check_seconds: float = 5.0):
+        self.path = path
+        self._db = db  # only needed for copying and syncing
+        self.overlap = timedelta(seconds=overlap_seconds)  # re-read window for writes that commit out of order
+        self._sync_lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        self.last_sync: Optional[Dict] = None
+        self.ready_check_seconds = ready_check_seconds
+        self._ready_checked_at = time.monotonic()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")  # readers keep going while a sync writes
+            for statement in SCHEMA:
+                conn.execute(statement)
+            self._copied = conn.execute("SELECT 1 FROM meta WHERE key = 'copied_at'").fetchone() is not None
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    @property
+    def is_ready(self) -> bool:
+        """True once a bulk copy has completed"""
+        # Set by our own bulk_copy; a copy run from another process (the CLI below) is
+        # picked up by re-reading meta at most every ready_check_seconds, not on every read.
+        if not self._copied and time.monotonic() - self._ready_checked_at >= self.ready_check_seconds:
+            self._ready_checked_at = time.monotonic()
+            self._copied = self._meta("copied_at") is not None
+        return self._copied
+
+    def _meta(self, key: str) -> Optional[str]:
+        with self._connect() as conn:
+            found = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return found[0] if found else None
+
+    # Writes
+    def _upsert_users(self, conn: sqlite3.Connection, docs: List[tuple]):
+        conn.executemany(
+            "INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?, ?)",
+            [(doc_id, int(bool(data.get("surveyCompleted"))), (data.get("preferences") or {}).get("gymLevel"),
+              _iso(data.get("createdAt")), _dumps(data)) for doc_id, data in docs]
+        )
+        conn.executemany("DELETE FROM user_sports WHERE user_id = ?", [(doc_id,) for doc_id, _ in docs])
+        conn.executemany(
+            "INSERT OR IGNORE INTO user_sports VALUES (?, ?)",
+            [(doc_id, sport) for doc_id, data in docs for sport in (data.get("sports") or []) if isinstance(sport, str)]
+        )
+
+    def _upsert_requests(self, conn: sqlite3.Connection, docs: List[tuple]):
+        conn.executemany(
+            "INSERT OR REPLACE INTO friend_requests VALUES (?, ?, ?, ?, ?, ?)",
+            [(doc_id, data.get("from_user"), data.get("to_user"), data.get("status"),
+              _iso(data.get("created_at")), _dumps(data)) for doc_id, data in docs]
+        )
+
+    def _upsert(self, conn: sqlite3.Connection, collection: str, docs: List[tuple]):
+        if collection == "users":
+            self._upsert_users(conn, docs)
+        else:
+            self._upsert_requests(conn, docs)
+
+    def _advance(self, mark: Optional[datetime], docs: List[tuple], field: str, started: datetime) -> datetime:
+        """Next watermark for `field` after reading `docs` in a pass that began at `started`"""
+        values = [_aware(data.get(field)) for _, data in docs]
+        values = [v for v in values if v is not None]
+        # A write can commit with a timestamp slightly older than one already read, so
+        # anything newer than `started - overlap` is read again on the next pass.
+        settled = started - self.overlap
+        newest = min(max(values), settled) if values else (settled if mark is None else mark)
+        return newest if mark is None else max(mark, newest)
+
+    # Replace both tables with a full copy of the collections.
+    def bulk_copy(self) -> Dict:
+        with self._sync_lock:
+            started = datetime.now(timezone.utc)
+            counts, watermarks = {}, {}
+            with self._connect() as conn:
+                for collection, fields in WATERMARK_FIELDS.items():
+                    docs = [(doc.id, doc.to_dict()) for doc in self._db.collection(collection).stream()]
+                    conn.execute(f"DELETE FROM {collection}")
+                    if collection == "users":
+                        conn.execute("DELETE FROM user_sports")
+                    self._upsert(conn, collection, docs)
+                    counts[collection] = len(docs)
+                    for field in fields:
+                        # Writes that landed while the stream ran are behind the copy's start at the latest.
+                        watermarks[f"{collection}.{field}"] = self._advance(None, docs, field, started).isoformat()
+                conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", list(watermarks.items()))
+                conn.execute("INSERT OR REPLACE INTO meta VALUES ('copied_at', ?)", (started.isoformat(),))
+            self._copied = True
+            self.last_sync = {"full": True, "documents": counts, "at": started.isoformat()}
+            logger.info(f"Replica bulk copy: {counts}")
+            return self.last_sync
+
+    # Pull documents written since the watermarks.
+    def sync(self) -> Dict:
+        if not self.is_ready:
+            return self.bulk_copy()
+        with self._sync_lock:
+            started = datetime.now(timezone.utc)
+            counts = {}
+            with self._connect() as conn:
+                marks = dict(conn.execute("SELECT key, value FROM meta"))
+                for collection, fields in WATERMARK_FIELDS.items():
+                    changed = {}
+                    for field in fields:
+                        mark = datetime.fromisoformat(marks[f"{collection}.{field}"])
+                        docs = [(doc.id, doc.to_dict()) for doc in
+                                self._db.collection(collection).where(field, ">", mark).stream()]
+                        changed.update(docs)
+                        marks[f"{collection}.{field}"] = self._advance(mark, docs, field, started).isoformat()
+                    self._upsert(conn, collection, list(changed.items()))
+                    counts[collection] = len(changed)
+                conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                                 [(k, v) for k, v in marks.items() if "." in k])
+                conn.execute("INSERT OR REPLACE INTO meta VALUES ('synced_at', ?)", (started.isoformat(),))
+            self.last_sync = {"full": False, "documents": counts, "at": started.isoformat()}
+            return self.last_sync
+
+    # Incremental sync every `interval` seconds, full re-copy (picks up deletes) every `full_every` runs.
+    def start_schedule(self, interval: float, full_every: int = 120):
+        self._schedule(interval, full_every, 0)
+
+    def _schedule(self, interval: float, full_every: int, count: int):
+        def tick():
+            try:
+                if count == 0 and not self.is_ready:
+                    self.bulk_copy()
+                elif full_every > 0 and count > 0 and count % full_every == 0:
+                    self.bulk_copy()
+                else:
+                    self.sync()
+            except Exception as e:
+                logger.error(f"Scheduled replica sync failed: {e}")
+            self._schedule(interval, full_every, count + 1)
+
+        self._timer = threading.Timer(0 if count == 0 else interval, tick)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def stop_schedule(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    # Reads: raw document dicts, the same shape doc.to_dict() returns.
+    def get_user(self, user_id: str) -> Optional[dict]:
+        with self._connect() as conn:
+            found = conn.execute("SELECT data FROM users WHERE id = ?", (user_id,)).fetchone()
+        return _loads(found[0]) if found else None
+
+    def get_users(self, user_ids: List[str]) -> Dict[str, dict]:
+        users = {}
+        with self._connect() as conn:
+            # SQLite caps bound parameters per statement.
+            for start in range(0, len(user_ids), 500):
+                chunk = user_ids[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT id, data FROM users WHERE id IN ({','.join('?' * len(chunk))})", chunk
+                )
+                users.update((doc_id, _loads(raw)) for doc_id, raw in rows)
+        return users
+
+    def query_users(self, surveyed_only: bool = True, gym_levels: Optional[List[str]] = None,
+                    sports: Optional[List[str]] = None, created_after: Optional[datetime] = None) -> Dict[str, dict]:
+        """Filtered scan answered from the indexes"""
+        clauses, params = [], []
+        if surveyed_only:
+            clauses.append("survey_completed = 1")
+        if gym_levels:
+            clauses.append(f"gym_level IN ({','.join('?' * len(gym_levels))})")
+            params += gym_levels
+        if sports:
+            clauses.append(f"id IN (SELECT user_id FROM user_sports WHERE sport IN ({','.join('?' * len(sports))}))")
+            params += sports
+        if created_after is not None:
+            clauses.append("created_at > ?")
+            params.append(_iso(created_after))
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._connect() as conn:
+            return {doc_id: _loads(raw) for doc_id, raw in conn.execute(f"SELECT id, data FROM users{where}", params)}
+
+    def pending_requests(self, user_id: str) -> List[dict]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, data FROM friend_requests WHERE to_user = ? AND status = 'pending' "
+                "ORDER BY created_at DESC", (user_id,)
+            ).fetchall()
+        return [{**_loads(raw), "id": doc_id} for doc_id, raw in rows]
+
+    def pending_request_pairs(self) -> List[Tuple[str, str, str]]:
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT id, from_user, to_user FROM friend_requests WHERE status = 'pending'"
+            ).fetchall()
+
+    def stats(self) -> Dict:
+        with self._connect() as conn:
+            users = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+            requests = conn.execute("SELECT COUNT(*) FROM friend_requests").fetchone()[0]
+            meta = dict(conn.execute("SELECT key, value FROM meta"))
+        return {
+            "path": self.path,
+            "ready": "copied_at" in meta,
+            "users": users,
+            "friend_requests": requests,
+            "copied_at": meta.get("copied_at"),
+            "synced_at": meta.get("synced_at"),
+            "watermarks": {k: v for k, v in meta.items() if "." in k},
+            "last_sync": self.last_sync
+        }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Copy or sync the local Firestore read replica")
+    parser.add_argument("command", choices=["copy", "sync", "stats"])
+    parser.add_argument("--path", default=os.getenv("REPLICA_PATH", "replica.db"))
+    args = parser.parse_args()
+
+    from firebase_utils import db
+    replica = SqliteReplica(args.path, db)
+    if args.command == "copy":
+        print(replica.bulk_copy())
+    elif args.command == "sync":
+        print(replica.sync())
+    else:
+        print(replica.stats())
@@ -0,0 +1,213 @@
+# Versioned response cache for the read endpoints the app re-polls.
+# Every user has a data version that is bumped whenever their document changes
+# (user store change feed, or explicitly after sports/friendship writes). A cached
+# response is keyed by route, query parameters and the versions of the users it
+# was built from; routes that read other users too pass a global data version
+# (the matching index version) as a parameter. The ETag is a hash of the body, so
+# a client presenting it gets 304 Not Modified only while the body is unchanged,
+# served from the cache without the endpoint recomputing anything.
+from async_firebase import run_blocking
+from profiling import span
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+import threading
+import hashlib
+import json
+import time
+import uuid
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+class LocalCacheBackend:
+    """In-process LRU with per-entry TTL; versions live in a dict"""
+
+    inline = True  # cheap enough to call on the event loop
+
+    def __init__(self, max_entries: int = 2048):
+        self.max_entries = max_entries
+        self.epoch = uuid.uuid4().hex  # versions restart at 0 with the process
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: float):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def versions(self, user_ids: List[str]) -> List[int]:
+        with self._lock:
+            return [self._versions.get(uid, 0) for uid in user_ids]
+
+    def bump(self, user_ids: List[str]):
+        with self._lock:
+            for uid in user_ids:
+                self._versions[uid] = self._versions.get(uid, 0) + 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class RedisCacheBackend:
+    """Shared across workers: entries expire in Redis, versions are INCR counters"""
+
+    inline = False
+
+    def __init__(self, url: str, prefix: str = "respcache"):
+        # Optional dependency: only needed when a shared cache is configured.
+        import redis
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5)
+        self.prefix = prefix
+        # A flushed store restarts versions at 0, so the epoch changes with it.
+        self.client.set(f"{prefix}:epoch", uuid.uuid4().hex, nx=True)
+        self.epoch = self.client.get(f"{prefix}:epoch").decode()
+
+    def get(self, key: str) -> Optional[Any]:
+        raw = self.client.get(f"{self.prefix}:r:{key}")
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key: str, value: Any, ttl: float):
+        self.client.set(f"{self.prefix}:r:{key}", json.dumps(value), ex=max(int(ttl), 1))
+
+    def versions(self, user_ids: List[str]) -> List[int]:
+        raw = self.client.mget([f"{self.prefix}:v:{uid}" for uid in user_ids])
+        return [int(v) if v is not None else 0 for v in raw]
+
+    def bump(self, user_ids: List[str]):
+        pipe = self.client.pipeline()
+        for uid in user_ids:
+            pipe.incr(f"{self.prefix}:v:{uid}")
+        pipe.execute()
+
+    def __len__(self) -> int:
+        return 0  # not tracked for a shared store
+
+# "memory" (default) or a redis:// URL.
+def make_cache_backend(spec: str, max_entries: int = 2048):
+    if spec == "memory":
+        return LocalCacheBackend(max_entries)
+    if spec.startswith(("redis://", "rediss://", "unix://")):
+        return RedisCacheBackend(spec)
+    raise ValueError(f"Unknown response cache backend: {spec}")
+
+def _presented(request: Request) -> List[str]:
+    header = request.headers.get("if-none-match", "")
+    return [t.strip().removeprefix("W/").strip('"') for t in header.split(",") if t.strip()]
+
+def _body_etag(content: Any) -> str:
+    return hashlib.sha1(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()[:24]
+
+class CachedResponse:
+    """Per-request handle: `response` is set on a hit, otherwise call `respond` with the fresh body"""
+
+    def __init__(self, cache: "ResponseCache", key: str, response: Optional[Response] = None,
+                 presented: Optional[List[str]] = None):
+        self.cache = cache
+        self.key = key
+        self.response = response
+        self.presented = presented or []
+
+    async def respond(self, body: Any) -> Response:
+        with span("serialize"):
+            content = jsonable_encoder(body)
+        if not self.key:  # cache disabled or unavailable
+            return JSONResponse(content)
+        etag = _body_etag(content)
+        await self.cache._call(self.cache.backend.set, self.key, {"etag": etag, "body": content}, self.cache.ttl)
+        # A recomputed body that differs from the client's copy is sent in full.
+        if etag in self.presented:
+            return Response(status_code=304, headers=self.cache.headers(etag))
+        return JSONResponse(content, headers=self.cache.headers(etag))
+
+class ResponseCache:
+    def __init__(self, backend, ttl: float = 300.0, enabled: bool = True):
+        self.backend = backend
+        self.ttl = ttl
+        self.enabled = enabled
+        self.hits = 0
+        self.not_modified = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    async def _call(self, fn, *args):
+        if self.backend.inline:
+            return fn(*args)
+        return await run_blocking(fn, *args)
+
+    def headers(self, etag: str) -> Dict[str, str]:
+        # Clients must revalidate, which is exactly the cheap 304 path.
+        return {"ETag": f'"{etag}"', "Cache-Control": "private, no-cache"}
+
+    # Invalidate every cached response built from these users.
+    def bump(self, *user_ids: str):
+        ids = [uid for uid in user_ids if uid]
+        if not ids:
+            return
+        self.invalidations += len(ids)
+        try:
+            self.backend.bump(ids)
+        except Exception as e:
+            logger.error(f"Response cache invalidation failed for {ids}: {e}")
+
+    async def entry(self, request: Request, route: str, user_ids: List[str], **params) -> CachedResponse:
+        """Resolve the ETag for this request and serve it from the cache when the data has not changed"""
+        if not self.enabled:
+            return CachedResponse(self, "", None)
+        try:
+            versions = await self._call(self.backend.versions, user_ids)
+            material = json.dumps(
+                ["v2", self.backend.epoch, route, user_ids, versions, sorted(params.items())], default=str
+            )
+            key = hashlib.sha1(material.encode()).hexdigest()[:24]
+            cached = await self._call(self.backend.get, key)
+        except Exception as e:
+            logger.error(f"Response cache unavailable: {e}")
+            return CachedResponse(self, "", None)
+
+        presented = _presented(request)
+        if cached is None:
+            self.misses += 1
+            return CachedResponse(self, key, None, presented)
+        etag = cached["etag"]
+        if etag in presented:
+            self.not_modified += 1
+            return CachedResponse(self, key, Response(status_code=304, headers=self.headers(etag)))
+        self.hits += 1
+        return CachedResponse(self, key, JSONResponse(cached["body"], headers=self.headers(etag)))
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.not_modified + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self.backend),
+            "hits": self.hits,
+            "not_modified": self.not_modified,
+            "misses": self.misses,
+            "hit_ratio": round((self.hits + self.not_modified) / lookups, 4) if lookups else None,
+            "invalidations": self.invalidations,
+            "ttl_seconds": self.ttl
+        }
+
+response_cache = ResponseCache(
+    make_cache_backend(os.getenv("RESPONSE_CACHE", "memory"), int(os.getenv("RESPONSE_CACHE_SIZE", "2048"))),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", "300")),
+    enabled=os.getenv("RESPONSE_CACHE_ENABLED", "1") != "0"
+)
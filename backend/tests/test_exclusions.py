@@ -0,0 +1,27 @@
+from exclusions import ExclusionIndex
+from friend_graph import FriendGraph
+from types import SimpleNamespace
+
+def test_suggestions_skip_pending_requests_and_blocks():
+    graph = FriendGraph()
+    graph.rebuild({
+        "alice": SimpleNamespace(friends=["bob", "carol"]),
+        "bob": SimpleNamespace(friends=["alice", "dave", "erin", "frank"]),
+        "carol": SimpleNamespace(friends=["alice", "dave", "erin"]),
+        "dave": SimpleNamespace(friends=["bob", "carol"]),
+        "erin": SimpleNamespace(friends=["bob", "carol"]),
+        "frank": SimpleNamespace(friends=["bob"])
+    })
+    exclusions = ExclusionIndex(graph)
+    exclusions.rebuild([])
+    assert exclusions.friends_of_friends("alice")[0] == ["dave", "erin", "frank"]
+
+    exclusions.request_sent("r1", "erin", "alice")
+    exclusions.block("alice", "frank")
+    candidates, mutual = exclusions.friends_of_friends("alice")
+    assert candidates == ["dave"]
+    assert mutual.tolist() == [2]
+
+    # Answering the request makes erin a candidate again.
+    exclusions.request_closed("r1")
+    assert exclusions.friends_of_friends("alice")[0] == ["dave", "erin"]
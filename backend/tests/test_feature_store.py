@@ -0,0 +1,57 @@
+from feature_store import FeatureStore
+from model_artifact import load_artifact, write_artifact
+from models import UserRecord
+from sklearn.feature_extraction.text import TfidfVectorizer
+from types import SimpleNamespace
+import numpy as np
+
+WEIGHTS = {'text_similarity': 0.3, 'age_compatibility': 0.2, 'gym_level_match': 0.2, 'sports_overlap': 0.3}
+
+def feature_text(user: UserRecord) -> str:
+    return f"{user.gymLevel} {user.workoutGoal} {' '.join(user.sports or [])}"
+
+def record(i: int, sports=None) -> UserRecord:
+    return UserRecord(f"u{i}", f"User {i}", f"u{i}@example.com", str(20 + i % 30),
+                      ["Beginner", "Intermediate", "Advanced"][i % 3], ["strength", "cardio"][i % 2],
+                      sports if sports is not None else [["running"], ["swimming", "yoga"], []][i % 3])
+
+def mapped(array) -> bool:
+    while array is not None:
+        if isinstance(array, np.memmap):
+            return True
+        array = array.base
+    return False
+
+def base_arrays(store: FeatureStore):
+    base = store.base
+    return [base.text.data, base.text.indices, base.text.indptr, base.sports.data, base.sports.indices,
+            base.sports.indptr, base.ages, base.gym_levels, base.fingerprints]
+
+def test_edits_keep_mapped_base(tmp_path):
+    users = {f"u{i}": record(i) for i in range(40)}
+    vectorizer = TfidfVectorizer().fit([feature_text(u) for u in users.values()])
+    built = FeatureStore.build(users, vectorizer, feature_text)
+    agent = SimpleNamespace(ensure_index=lambda: built, featurizer="tfidf", vectorizer=vectorizer, weights=WEIGHTS)
+    write_artifact(agent, str(tmp_path))
+    _, store = load_artifact(str(tmp_path))
+    assert all(mapped(array) for array in base_arrays(store))
+
+    edited = store.apply_changes({"u3": record(3, ["climbing"]), "u40": record(40)}, ["u5"], vectorizer, feature_text)
+    edited = edited.apply_changes({"u3": record(3, ["rowing"])}, [], vectorizer, feature_text)
+
+    assert edited.base is store.base
+    assert all(mapped(array) for array in base_arrays(edited))
+    assert edited.delta_rows == 3
+    assert "u5" not in edited.index and edited.index["u3"] == 42
+
+    # Scoring base plus delta matches a store holding the same rows in one run.
+    rows = edited.merged()
+    flat = FeatureStore(edited.user_ids, rows.text, rows.ages, rows.gym_levels, rows.sports, edited.sports_vocab,
+                        edited.active, edited.index, rows.fingerprints)
+    query = edited.encode(record(7, ["rowing", "running"]), vectorizer, feature_text)
+    scores, _ = edited.score(query, WEIGHTS)
+    expected, _ = flat.score(query, WEIGHTS)
+    np.testing.assert_allclose(scores, expected)
+    assert edited.top_k(scores, 5) == flat.top_k(expected, 5)
+    block, _ = edited.score_block(np.array([42, 3, 41]), WEIGHTS)
+    np.testing.assert_allclose(block, flat.score_block(np.array([42, 3, 41]), WEIGHTS)[0])
@@ -0,0 +1,33 @@
+from replica import SqliteReplica
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+class GeoPoint:
+    def __init__(self, latitude: float, longitude: float):
+        self.latitude = latitude
+        self.longitude = longitude
+
+    def __str__(self) -> str:
+        return f"GeoPoint({self.latitude}, {self.longitude})"
+
+def fake_db(collections):
+    def collection(name):
+        docs = [SimpleNamespace(id=doc_id, to_dict=lambda data=data: dict(data))
+                for doc_id, data in collections.get(name, {}).items()]
+        return SimpleNamespace(stream=lambda: iter(docs))
+    return SimpleNamespace(collection=collection)
+
+def test_unsupported_field_type_does_not_abort_copy(tmp_path):
+    created = datetime(2024, 5, 1, tzinfo=timezone.utc)
+    db = fake_db({"users": {
+        "u1": {"fullName": "One", "surveyCompleted": True, "createdAt": created, "location": GeoPoint(52.5, 13.4)},
+        "u2": {"fullName": "Two", "surveyCompleted": True, "avatar": b"\x89PNG"}
+    }})
+    replica = SqliteReplica(str(tmp_path / "replica.db"), db)
+
+    assert replica.bulk_copy()["documents"] == {"users": 2, "friend_requests": 0}
+    assert replica.is_ready
+    one, two = replica.get_user("u1"), replica.get_user("u2")
+    assert one["location"] == "GeoPoint(52.5, 13.4)"
+    assert one["createdAt"] == created
+    assert two["fullName"] == "Two" and two["avatar"] == str(b"\x89PNG")
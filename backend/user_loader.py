@@ -0,0 +1,108 @@
+# DataLoader-style user lookups.
+# Every user id requested in the same event-loop tick, from any request, goes out
+# as one batch_get_users (a single db.get_all round trip, or an in-memory read
+# once the user store is up). Concurrent lookups of the same id share one
+# in-flight future, and each request memoizes its results via UserLoader.
+from firebase_utils import batch_get_users, user_store
+from async_firebase import run_blocking
+from models import User
+from typing import Dict, List, Optional
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+class _UserBatcher:
+    """Process-wide: coalesces lookups within a tick and dedupes in-flight ids across requests"""
+
+    def __init__(self):
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._scheduled = False
+        # Read accounting
+        self.lookups = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.round_trips = 0
+        self.documents_read = 0
+
+    def load(self, user_id: str) -> asyncio.Future:
+        self.lookups += 1
+        future = self._inflight.get(user_id) or self._pending.get(user_id)
+        if future is not None:
+            self.coalesced += 1
+            return future
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending[user_id] = future
+        if not self._scheduled:
+            self._scheduled = True
+            loop.call_soon(self._dispatch)
+        return future
+
+    def _dispatch(self):
+        self._scheduled = False
+        batch, self._pending = self._pending, {}
+        self._inflight.update(batch)
+        asyncio.ensure_future(self._fetch(batch))
+
+    async def _fetch(self, batch: Dict[str, asyncio.Future]):
+        self.batches += 1
+        try:
+            if user_store.is_ready:
+                users = user_store.get_many(list(batch))
+            else:
+                users = await run_blocking(batch_get_users, list(batch))
+                self.round_trips += 1
+                self.documents_read += len(batch)
+            for user_id, future in batch.items():
+                if not future.done():
+                    future.set_result(users.get(user_id))
+        except Exception as e:
+            logger.error(f"Batched user load failed: {e}")
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            for user_id in batch:
+                self._inflight.pop(user_id, None)
+
+    def stats(self) -> Dict:
+        return {
+            "lookups": self.lookups,
+            "coalesced": self.coalesced,
+            "batches": self.batches,
+            "round_trips": self.round_trips,
+            "documents_read": self.documents_read
+        }
+
+_batcher = _UserBatcher()
+
+class UserLoader:
+    """Per-request loader; results are memoized for the life of the request"""
+
+    def __init__(self):
+        self._memo: Dict[str, asyncio.Future] = {}
+        self.lookups = 0
+        self.memo_hits = 0
+
+    async def load(self, user_id: str) -> Optional[User]:
+        self.lookups += 1
+        future = self._memo.get(user_id)
+        if future is None:
+            future = self._memo[user_id] = _batcher.load(user_id)
+        else:
+            self.memo_hits += 1
+        # Shielded: the future is shared with other requests waiting on the same id.
+        return await asyncio.shield(future)
+
+    async def load_many(self, user_ids: List[str]) -> Dict[str, Optional[User]]:
+        users = await asyncio.gather(*(self.load(uid) for uid in user_ids))
+        return dict(zip(user_ids, users))
+
+# FastAPI dependency: one loader per request.
+def get_user_loader() -> UserLoader:
+    return UserLoader()
+
+def loader_stats() -> Dict:
+    return _batcher.stats()
@@ -0,0 +1,175 @@
+from models import User, UserRecord
+from typing import Callable, Dict, List, Optional, Set
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class UserStore:
+    """Process-wide snapshot of the users collection, kept current by a Firestore listener"""
+
+    def __init__(self, db, converter: Callable[[dict], dict], collection: str = "users"):
+        self._db = db
+        self._convert = converter  # Firestore timestamps -> datetime
+        self._collection = collection
+        self._lock = threading.RLock()
+        self._users: Dict[str, User] = {}
+        self._records: Dict[str, UserRecord] = {}  # surveyed users only, built once per change
+        self._invalid: Set[str] = set()  # documents that exist but do not validate as User
+        self._watch = None
+        self._ready = threading.Event()
+        self._subscribers: List[Callable[[str, Optional[User]], None]] = []
+        # Staleness metrics
+        self.loaded_at: Optional[float] = None
+        self.last_event_at: Optional[float] = None
+        self.last_read_time = None
+        self.events_applied = 0
+        self.invalid_documents = 0
+        self.resync_count = 0
+
+    @property
+    def is_ready(self) -> bool:
+        return self._ready.is_set()
+
+    # Load once and keep listening for adds, edits and deletes.
+    def start(self, timeout: float = 30.0) -> bool:
+        if self._watch is not None:
+            return self.is_ready
+        self._ready.clear()
+        try:
+            # The first snapshot delivers every document as ADDED, so it doubles as the initial load.
+            self._watch = self._db.collection(self._collection).on_snapshot(self._on_snapshot)
+        except Exception as e:
+            logger.error(f"Failed to start users listener: {e}")
+            self._watch = None
+            return False
+
+        if not self._ready.wait(timeout):
+            logger.warning(f"User store not ready after {timeout}s, falling back to direct reads")
+            return False
+        logger.info(f"User store loaded {len(self._users)} users")
+        return True
+
+    def stop(self):
+        if self._watch is not None:
+            try:
+                self._watch.unsubscribe()
+            except Exception as e:
+                logger.error(f"Failed to stop users listener: {e}")
+            self._watch = None
+        self._ready.clear()
+
+    # Force a full reload, e.g. after the listener dropped or data was edited out of band.
+    def resync(self, timeout: float = 30.0) -> bool:
+        logger.info("Resyncing user store")
+        self.stop()
+        with self._lock:
+            self._users = {}
+            self._records = {}
+            self._invalid = set()
+        self.resync_count += 1
+        return self.start(timeout)
+
+    # Register callback(user_id, user) for changes after the initial load; user is None on delete.
+    def subscribe(self, callback: Callable[[str, Optional[User]], None]):
+        self._subscribers.append(callback)
+
+    def _parse(self, doc_id: str, data: Optional[dict]) -> Optional[User]:
+        if data is None:
+            return None
+        try:
+            return User(**self._convert(data))
+        except Exception as e:
+            # Half-finished sign-ups do not validate yet; get_user_data treats them as missing.
+            logger.debug("Skipping user %s: %s", doc_id, e)
+            self.invalid_documents += 1
+            return None
+
+    def _on_snapshot(self, col_snapshot, changes, read_time):
+        notify = self._ready.is_set()  # the initial load is not a change
+        applied = []
+        with self._lock:
+            for change in changes:
+                doc = change.document
+                if change.type.name == "REMOVED":
+                    self._users.pop(doc.id, None)
+                    self._records.pop(doc.id, None)
+                    self._invalid.discard(doc.id)
+                    applied.append((doc.id, None))
+                    continue
+                user = self._parse(doc.id, doc.to_dict())
+                if user is None:
+                    self._users.pop(doc.id, None)
+                    self._invalid.add(doc.id)
+                else:
+                    self._users[doc.id] = user
+                    self._invalid.discard(doc.id)
+                if user is not None and user.surveyCompleted:
+                    self._records[doc.id] = UserRecord.from_user(doc.id, user)
+                else:
+                    self._records.pop(doc.id, None)
+                applied.append((doc.id, user))
+            self.events_applied += len(changes)
+            self.last_event_at = time.time()
+            self.last_read_time = read_time
+            if not self._ready.is_set():
+                self.loaded_at = self.last_event_at
+                self._ready.set()
+
+        if notify:
+            for user_id, user in applied:
+                for callback in self._subscribers:
+                    try:
+                        callback(user_id, user)
+                    except Exception as e:
+                        logger.error(f"User change subscriber failed for {user_id}: {e}")
+
+    def get(self, user_id: str) -> Optional[User]:
+        with self._lock:
+            return self._users.get(user_id)
+
+    def get_many(self, user_ids: List[str]) -> Dict[str, User]:
+        with self._lock:
+            return {uid: self._users[uid] for uid in user_ids if uid in self._users}
+
+    # Ids among `user_ids` whose documents exist but failed validation (absent from get/get_many).
+    def unvalidated(self, user_ids: List[str]) -> List[str]:
+        with self._lock:
+            return [uid for uid in user_ids if uid in self._invalid]
+
+    def all(self, exclude: Optional[List[str]] = None, surveyed_only: bool = True) -> Dict[str, User]:
+        excluded = set(exclude or [])
+        with self._lock:
+            return {
+                uid: user for uid, user in self._users.items()
+                if uid not in excluded and (user.surveyCompleted or not surveyed_only)
+            }
+
+    # Matching records (surveyed users only); no per-user work beyond the dict copy.
+    def records(self, exclude: Optional[List[str]] = None) -> Dict[str, UserRecord]:
+        with self._lock:
+            if not exclude:
+                return dict(self._records)
+            excluded = set(exclude)
+            return {uid: record for uid, record in self._records.items() if uid not in excluded}
+
+    def get_records(self, user_ids: List[str]) -> Dict[str, UserRecord]:
+        with self._lock:
+            return {uid: self._records[uid] for uid in user_ids if uid in self._records}
+
+    def stats(self) -> Dict:
+        now = time.time()
+        with self._lock:
+            size = len(self._users)
+        return {
+            "ready": self.is_ready,
+            "listening": self._watch is not None,
+            "users": size,
+            "events_applied": self.events_applied,
+            "invalid_documents": self.invalid_documents,
+            "resync_count": self.resync_count,
+            "loaded_seconds_ago": round(now - self.loaded_at, 3) if self.loaded_at else None,
+            "last_event_seconds_ago": round(now - self.last_event_at, 3) if self.last_event_at else None,
+            "last_read_time": str(self.last_read_time) if self.last_read_time else None
+        }